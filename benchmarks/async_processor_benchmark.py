@@ -0,0 +1,101 @@
+"""Load benchmark: blocking vs async Stripe calls inside the FastAPI app.
+
+Starts the fake Stripe server with fixed latency, points the SDK at it and
+drives POST /api/v1/customers through the ASGI app at a fixed concurrency,
+once with the old blocking processor and once with AsyncPaymentProcessor.
+
+    python benchmarks/async_processor_benchmark.py --requests 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+DATA_DIR = tempfile.mkdtemp()
+os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(DATA_DIR, "webhook_queue.db")
+os.environ["WEBHOOK_DEDUP_PATH"] = os.path.join(DATA_DIR, "webhook_dedup.db")
+os.environ["STRIPE_MIRROR_PATH"] = os.path.join(DATA_DIR, "stripe_mirror.db")
+# Measure I/O concurrency, not the client-side rate limiter
+os.environ.setdefault("STRIPE_WRITE_RATE", "100000")
+os.environ.setdefault("STRIPE_MAX_IN_FLIGHT", "1000")
+
+import httpx
+import stripe
+
+import api
+from async_payment_processor import AsyncPaymentProcessor
+from fake_stripe import FakeStripe
+from payment_processor import PaymentProcessor
+
+
+class BlockingProcessor(PaymentProcessor):
+    """Pre-async behaviour: awaitable from api.py, but blocks the event loop."""
+
+    async def create_customer(self, *args, **kwargs):
+        return PaymentProcessor.create_customer(self, *args, **kwargs)
+
+    async def aclose(self):
+        pass
+
+
+async def run_load(total: int, concurrency: int) -> dict:
+    """Drive the ASGI app and collect per-request latencies."""
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=api.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/v1/customers",
+                    json={"email": f"user{i}@example.com", "name": "Bench"},
+                )
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 201:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    results = {}
+    with FakeStripe(latency=args.latency_ms / 1000) as fake:
+        stripe.api_base = fake.url
+        for label, processor_class in (("blocking", BlockingProcessor), ("async", AsyncPaymentProcessor)):
+            processor = api.processor = processor_class()
+            results[label] = await run_load(args.requests, args.concurrency)
+            results[label]["http_pool"] = processor.http_pool_stats()
+            await processor.aclose()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
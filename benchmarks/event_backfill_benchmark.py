@@ -0,0 +1,97 @@
+"""Catch-up benchmark for the Events API backfill after a webhook outage.
+
+Loads a day of events into the fake Stripe (a mix of invoice, payment
+intent and subscription events), marks a share of them as already
+delivered in the dedup index, then runs EventBackfill over the day and
+reports listing/handling throughput and the remaining lag. Stripe's list
+latency is simulated per page; the shared governor's read rate
+(STRIPE_READ_RATE, default 80/s) caps pages per second as in production.
+
+    python benchmarks/event_backfill_benchmark.py --events 300000 --delivered 0.5
+    python benchmarks/event_backfill_benchmark.py --events 50000 --fetch-workers 1   # serial listing
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+DATA_DIR = tempfile.mkdtemp()
+os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(DATA_DIR, "webhook_queue.db")
+os.environ["WEBHOOK_DEDUP_PATH"] = os.path.join(DATA_DIR, "webhook_dedup.db")
+os.environ["STRIPE_MIRROR_PATH"] = os.path.join(DATA_DIR, "stripe_mirror.db")
+os.environ["EVENT_BACKFILL_PATH"] = os.path.join(DATA_DIR, "event_backfill.db")
+
+import stripe
+
+from event_backfill import EventBackfill
+from fake_stripe import FakeStripe
+
+EVENT_TYPES = [
+    ("invoice.payment_succeeded", "invoice", "in"),
+    ("payment_intent.succeeded", "payment_intent", "pi"),
+    ("customer.subscription.updated", "subscription", "sub"),
+    ("invoice.payment_failed", "invoice", "in"),
+]
+
+
+def day_of_events(count: int, end: int):
+    """`count` events spread evenly over the 24 hours before `end`."""
+    events = []
+    for i in range(count):
+        event_type, object_type, prefix = EVENT_TYPES[i % len(EVENT_TYPES)]
+        events.append({
+            "id": f"evt_backfill_{i:08d}",
+            "object": "event",
+            "type": event_type,
+            "created": end - 86400 + i * 86400 // count,
+            "livemode": False,
+            "data": {"object": {
+                "id": f"{prefix}_{i:08d}",
+                "object": object_type,
+                "customer": f"cus_{i % 5000:06d}",
+                "status": "paid" if object_type == "invoice" else "active",
+            }},
+        })
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--delivered", type=float, default=0.5, help="share already processed via webhooks")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="simulated Event.list latency")
+    parser.add_argument("--fetch-workers", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--window", type=int, default=3600)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    end = int(time.time())
+    events = day_of_events(args.events, end)
+
+    with FakeStripe(latency=args.latency_ms / 1000) as fake:
+        stripe.api_base = fake.url
+        fake.load_events(events)
+        backfill = EventBackfill()
+        delivered = [event["id"] for i, event in enumerate(events) if (i * 7919) % 1000 < args.delivered * 1000]
+        for start in range(0, len(delivered), 10000):
+            backfill.processor.deduplicator.claim_many(delivered[start:start + 10000])
+            backfill.processor.deduplicator.complete_many(delivered[start:start + 10000])
+        # Only handled types are claimed by a webhook; the rest are re-applied to the mirror
+        result = backfill.run(
+            since=end - 86400, until=end,
+            fetch_workers=args.fetch_workers, workers=args.workers, window=args.window,
+        )
+
+    result["delivered_before"] = len(delivered)
+    result["missing_after"] = args.events - len(backfill.processor.deduplicator.known([e["id"] for e in events]))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
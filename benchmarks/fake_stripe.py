@@ -0,0 +1,666 @@
+"""In-memory fake of the Stripe API endpoints this project uses, for offline load tests.
+
+Implements customers, subscriptions (create/retrieve/modify/delete/list),
+products and prices (create/retrieve/modify/list), payment intents,
+billing portal sessions and the events list, honours Idempotency-Key, and
+can inject latency, 5xx errors and 429s. Every mutation also produces a
+signed webhook event, optionally POSTed to a webhook URL.
+
+Embed it in a benchmark:
+
+    with FakeStripe(latency=0.05, error_rate=0.01) as fake:
+        stripe.api_base = fake.url
+
+or run it standalone and point the API at it with STRIPE_API_BASE:
+
+    python benchmarks/fake_stripe.py --port 12111 --latency-ms 50 --rate-limit-rate 0.02
+"""
+import argparse
+import bisect
+import copy
+import fnmatch
+import hashlib
+import hmac
+import itertools
+import json
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+
+_KEY = re.compile(r"([^\[]+)|\[([^\]]*)\]")
+
+
+def sign_payload(payload: str, secret: str, timestamp: int = None) -> str:
+    """Stripe-Signature header value for a webhook payload."""
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def _listify(value):
+    """Turn dicts keyed "0", "1", ... into lists, recursively."""
+    if not isinstance(value, dict):
+        return value
+    value = {k: _listify(v) for k, v in value.items()}
+    if value and all(k.isdigit() or k == "" for k in value):
+        return [value[k] for k in sorted(value, key=lambda k: int(k or 0))]
+    return value
+
+
+def decode_form(pairs: List[Tuple[str, str]]) -> Dict:
+    """Inverse of Stripe's bracketed form encoding: items[0][price]=x -> {"items": [{"price": "x"}]}."""
+    result: Dict = {}
+    for name, value in pairs:
+        parts = [a or b for a, b in _KEY.findall(name)]
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        if parts[-1] == "" and parts[-1] in target:
+            parts[-1] = str(len(target))
+        target[parts[-1]] = value
+    return _listify(result)
+
+
+class FakeStripeError(Exception):
+    def __init__(self, status: int, error_type: str, message: str, code: str = None, param: str = None):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": {"type": error_type, "message": message}}
+        if code:
+            self.body["error"]["code"] = code
+        if param:
+            self.body["error"]["param"] = param
+
+
+def _flag(value: str) -> bool:
+    """Form-encoded boolean; stripe-python sends "True", raw HTTP callers "true"."""
+    return value.lower() == "true"
+
+
+def _missing(kind: str, object_id: str) -> FakeStripeError:
+    return FakeStripeError(
+        404, "invalid_request_error", f"No such {kind}: '{object_id}'", "resource_missing", "id"
+    )
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    fake: "FakeStripe" = None
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode() if length else ""
+        params = decode_form(parse_qsl(url.query if method == "GET" else body, keep_blank_values=True))
+        status, payload, headers = self.fake.handle(
+            method, url.path, params, self.headers.get("Idempotency-Key")
+        )
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_{uuid.uuid4().hex[:14]}")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeStripe:
+    """Threaded fake Stripe server with injectable latency and failures.
+
+    `error_rate` and `rate_limit_rate` are per-request probabilities of a
+    500 or 429; `rate_limit_rps` additionally returns 429 once requests
+    exceed that many per second, like Stripe's own limiter. Injected
+    failures happen before the request is applied, so a retry with the
+    same Idempotency-Key is safe.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        rate_limit_rps: float = None,
+        webhook_secret: str = "whsec_fake",
+        webhook_url: str = None,
+    ):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_rps = rate_limit_rps
+        self.webhook_secret = webhook_secret
+        self.webhook_url = webhook_url
+        self.objects: Dict[str, Dict[str, Dict]] = defaultdict(dict)
+        # Ordered by created; positions and created times index it for Event.list
+        self.events: List[Dict] = []
+        self._event_created: List[int] = []
+        self._event_positions: Dict[str, int] = {}
+        self.counts = defaultdict(int)
+        # Idempotency key -> (request params, status, body), as Stripe keeps them for 24h
+        self._idempotent: Dict[str, Tuple[str, int, Dict]] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._window = (0, 0)
+        self._deliveries: "queue.Queue" = queue.Queue()
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self._server = _Server((host, port), handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeStripe":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if self.webhook_url:
+            threading.Thread(target=self._deliver_webhooks, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._deliveries.put(None)
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeStripe":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": dict(self.counts),
+                "objects": {kind: len(items) for kind, items in self.objects.items()},
+                "events": len(self.events),
+            }
+
+    def create_tier_prices(self, tiers: Dict[str, int], currency: str = "usd", interval: str = "month") -> Dict[str, str]:
+        """Create a product tagged with metadata.tier and one recurring price per tier.
+
+        Returns {tier: price id}; stands in for provisioning the real catalog.
+        """
+        price_ids = {}
+        for tier, unit_amount in tiers.items():
+            product = self._create_product({"name": tier.title(), "metadata": {"tier": tier}})
+            price_ids[tier] = self._create_price({
+                "product": product["id"],
+                "currency": currency,
+                "unit_amount": str(unit_amount),
+                "recurring": {"interval": interval},
+                "lookup_key": f"{tier}_{currency}_{interval}",
+            })["id"]
+        return price_ids
+
+    def load_events(self, events: List[Dict]):
+        """Add pre-built events (e.g. a day of history) without delivering them."""
+        with self._lock:
+            self.events.extend(events)
+            self.events.sort(key=lambda event: event["created"])
+            self._event_created = [event["created"] for event in self.events]
+            self._event_positions = {event["id"]: i for i, event in enumerate(self.events)}
+
+    # -- request handling -------------------------------------------------
+
+    def _injected_failure(self) -> Optional[FakeStripeError]:
+        if self.rate_limit_rps:
+            second = int(time.monotonic())
+            with self._lock:
+                window, seen = self._window
+                seen = seen + 1 if window == second else 1
+                self._window = (second, seen)
+            if seen > self.rate_limit_rps:
+                return FakeStripeError(429, "invalid_request_error", "Too many requests", "rate_limit")
+        roll = random.random()
+        if roll < self.rate_limit_rate:
+            return FakeStripeError(429, "invalid_request_error", "Too many requests", "rate_limit")
+        if roll < self.rate_limit_rate + self.error_rate:
+            return FakeStripeError(500, "api_error", "Injected server error")
+        return None
+
+    def handle(self, method: str, path: str, params: Dict, idempotency_key: str = None):
+        """Serve one API request. Returns (status, body, extra headers)."""
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+        route = re.sub(r"/(cus|sub|pi|bps|prod|price|evt)_\w+", r"/{id}", path)
+        with self._lock:
+            self.counts[f"{method} {route}"] += 1
+
+        failure = self._injected_failure()
+        if failure is not None:
+            with self._lock:
+                self.counts[f"injected_{failure.status}"] += 1
+            return failure.status, failure.body, {}
+
+        fingerprint = json.dumps(params, sort_keys=True, default=str)
+        if idempotency_key and method == "POST":
+            with self._lock:
+                replay = self._idempotent.get(idempotency_key)
+            if replay is not None:
+                if replay[0] != fingerprint:
+                    error = FakeStripeError(
+                        400, "idempotency_error",
+                        f"Keys for idempotent requests can only be used with the same parameters they were "
+                        f"first used with. Try using a key other than '{idempotency_key}' if you meant to "
+                        f"execute a different request.",
+                    )
+                    return error.status, error.body, {}
+                return replay[1], replay[2], {"Idempotent-Replayed": "true"}
+
+        try:
+            status, body = 200, self._route(method, path, params)
+        except FakeStripeError as e:
+            status, body = e.status, e.body
+        if idempotency_key and method == "POST":
+            with self._lock:
+                self._idempotent[idempotency_key] = (fingerprint, status, body)
+        return status, body, {}
+
+    def _route(self, method: str, path: str, params: Dict) -> Dict:
+        parts = path.strip("/").split("/")
+        if parts[:1] != ["v1"]:
+            raise FakeStripeError(404, "invalid_request_error", f"Unrecognized request URL ({path})")
+        if parts[1:2] == ["billing_portal"]:
+            resource, object_id = "/".join(parts[1:3]), None
+        else:
+            resource, object_id = parts[1], parts[2] if len(parts) > 2 else None
+
+        if resource == "customers":
+            if method == "POST" and object_id is None:
+                return self._create_customer(params)
+            if method == "GET" and object_id:
+                return self._get("customer", object_id)
+        elif resource == "subscriptions":
+            if method == "POST" and object_id is None:
+                return self._create_subscription(params)
+            if method == "GET" and object_id is None:
+                return self._list_subscriptions(params)
+            if method == "GET":
+                return self._get("subscription", object_id)
+            if method == "POST":
+                return self._modify_subscription(object_id, params)
+            if method == "DELETE":
+                return self._cancel_subscription(object_id)
+        elif resource in ("products", "prices"):
+            kind = resource[:-1]
+            if method == "POST" and object_id is None:
+                return self._create_product(params) if kind == "product" else self._create_price(params)
+            if method == "GET" and object_id is None:
+                return self._list_products(params) if kind == "product" else self._list_prices(params)
+            if method == "GET":
+                return self._get(kind, object_id)
+            if method == "POST":
+                return self._modify_catalog_object(kind, object_id, params)
+        elif resource == "events" and method == "GET":
+            return self._list_events(params) if object_id is None else self._get_event(object_id)
+        elif resource == "payment_intents" and method == "POST" and object_id is None:
+            return self._create_payment_intent(params)
+        elif resource == "billing_portal/sessions" and method == "POST":
+            return self._create_portal_session(params)
+        raise FakeStripeError(404, "invalid_request_error", f"Unrecognized request URL ({method}: {path})")
+
+    # -- objects ----------------------------------------------------------
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_{next(self._ids):06d}{uuid.uuid4().hex[:8]}"
+
+    def _get(self, kind: str, object_id: str) -> Dict:
+        with self._lock:
+            obj = self.objects[kind].get(object_id)
+        if obj is None:
+            raise _missing(kind, object_id)
+        return obj
+
+    def _store(self, kind: str, obj: Dict, event_type: str) -> Dict:
+        with self._lock:
+            self.objects[kind][obj["id"]] = obj
+        self._emit(event_type, obj)
+        return obj
+
+    def _create_customer(self, params: Dict) -> Dict:
+        customer = {
+            "id": self._new_id("cus"),
+            "object": "customer",
+            "created": int(time.time()),
+            "email": params.get("email"),
+            "name": params.get("name"),
+            "metadata": params.get("metadata") or {},
+            "livemode": False,
+        }
+        return self._store("customer", customer, "customer.created")
+
+    def _create_subscription(self, params: Dict) -> Dict:
+        customer_id = params.get("customer")
+        with self._lock:
+            known = customer_id in self.objects["customer"]
+        if not known:
+            raise FakeStripeError(
+                400, "invalid_request_error", f"No such customer: '{customer_id}'",
+                "resource_missing", "customer",
+            )
+        now = int(time.time())
+        trial_days = int(params.get("trial_period_days") or 0)
+        subscription_id = self._new_id("sub")
+        intent = self._create_payment_intent({"amount": 0, "currency": "usd", "customer": customer_id})
+        subscription = {
+            "id": subscription_id,
+            "object": "subscription",
+            "customer": customer_id,
+            "status": "trialing" if trial_days else "incomplete",
+            "created": now,
+            "current_period_start": now,
+            "current_period_end": now + max(trial_days, 30) * 86400,
+            "cancel_at_period_end": False,
+            "canceled_at": None,
+            "items": {
+                "object": "list",
+                "data": [
+                    {"id": self._new_id("si"), "object": "subscription_item",
+                     "price": {"id": item.get("price"), "object": "price"}}
+                    for item in params.get("items") or []
+                ],
+            },
+            "latest_invoice": self._new_id("in"),
+            "metadata": params.get("metadata") or {},
+        }
+        self._store("subscription", subscription, "customer.subscription.created")
+        if "latest_invoice.payment_intent" in (params.get("expand") or []):
+            invoice = {
+                "id": subscription["latest_invoice"],
+                "object": "invoice",
+                "customer": customer_id,
+                "subscription": subscription_id,
+                "payment_intent": intent,
+            }
+            return dict(subscription, latest_invoice=invoice)
+        return subscription
+
+    def _modify_subscription(self, subscription_id: str, params: Dict) -> Dict:
+        subscription = copy.deepcopy(self._get("subscription", subscription_id))
+        if "cancel_at_period_end" in params:
+            subscription["cancel_at_period_end"] = _flag(params["cancel_at_period_end"])
+        if params.get("metadata"):
+            subscription["metadata"] = {**subscription["metadata"], **params["metadata"]}
+        for change in params.get("items") or []:
+            for item in subscription["items"]["data"]:
+                if item["id"] == change.get("id"):
+                    item["price"] = {"id": change.get("price"), "object": "price"}
+        return self._store("subscription", subscription, "customer.subscription.updated")
+
+    def _cancel_subscription(self, subscription_id: str) -> Dict:
+        subscription = dict(self._get("subscription", subscription_id))
+        subscription["status"] = "canceled"
+        subscription["canceled_at"] = int(time.time())
+        return self._store("subscription", subscription, "customer.subscription.deleted")
+
+    def _list(self, kind: str, params: Dict, match) -> Dict:
+        """One newest-first page of `kind` objects for which match(obj) holds."""
+        limit = min(int(params.get("limit") or 10), 100)
+        with self._lock:
+            matches = [obj for obj in reversed(list(self.objects[kind].values())) if match(obj)]
+        if params.get("starting_after"):
+            ids = [obj["id"] for obj in matches]
+            if params["starting_after"] in ids:
+                matches = matches[ids.index(params["starting_after"]) + 1:]
+        return {
+            "object": "list",
+            "url": f"/v1/{kind}s",
+            "has_more": len(matches) > limit,
+            "data": matches[:limit],
+        }
+
+    def _list_subscriptions(self, params: Dict) -> Dict:
+        status = params.get("status")
+        return self._list("subscription", params, lambda s: (
+            (not params.get("customer") or s["customer"] == params["customer"])
+            and (not params.get("price")
+                 or any(item["price"]["id"] == params["price"] for item in s["items"]["data"]))
+            and (status in ("all", s["status"]) if status else s["status"] != "canceled")
+        ))
+
+    def _create_product(self, params: Dict) -> Dict:
+        product = {
+            "id": params.get("id") or self._new_id("prod"),
+            "object": "product",
+            "name": params.get("name"),
+            "description": params.get("description"),
+            "active": _flag(params.get("active", "true")),
+            "metadata": params.get("metadata") or {},
+            "created": int(time.time()),
+        }
+        return self._store("product", product, "product.created")
+
+    def _claim_lookup_key(self, key: Optional[str], transfer: bool):
+        """Lookup keys are unique; transfer_lookup_key moves one off its current price."""
+        if not key:
+            return
+        with self._lock:
+            holder = next((p for p in self.objects["price"].values() if p.get("lookup_key") == key), None)
+        if holder is None:
+            return
+        if not transfer:
+            raise FakeStripeError(
+                400, "invalid_request_error",
+                f"A price (`{holder['id']}`) already uses the lookup key `{key}`.", param="lookup_key",
+            )
+        self._store("price", dict(holder, lookup_key=None), "price.updated")
+
+    def _create_price(self, params: Dict) -> Dict:
+        self._get("product", params.get("product"))
+        self._claim_lookup_key(params.get("lookup_key"), _flag(params.get("transfer_lookup_key", "false")))
+        recurring = params.get("recurring")
+        price = {
+            "id": self._new_id("price"),
+            "object": "price",
+            "product": params.get("product"),
+            "active": _flag(params.get("active", "true")),
+            "currency": params.get("currency", "usd"),
+            "unit_amount": int(params.get("unit_amount") or 0),
+            "type": "recurring" if recurring else "one_time",
+            "recurring": {
+                "interval": recurring.get("interval", "month"),
+                "interval_count": int(recurring.get("interval_count") or 1),
+            } if recurring else None,
+            "lookup_key": params.get("lookup_key"),
+            "metadata": params.get("metadata") or {},
+            "created": int(time.time()),
+        }
+        return self._store("price", price, "price.created")
+
+    def _modify_catalog_object(self, kind: str, object_id: str, params: Dict) -> Dict:
+        obj = copy.deepcopy(self._get(kind, object_id))
+        for field in ("name", "description", "lookup_key"):
+            if field in params and field in obj:
+                obj[field] = params[field] or None
+        if "active" in params:
+            obj["active"] = _flag(params["active"])
+        if params.get("metadata"):
+            obj["metadata"] = {**obj["metadata"], **params["metadata"]}
+        return self._store(kind, obj, f"{kind}.updated")
+
+    def _list_products(self, params: Dict) -> Dict:
+        return self._list("product", params, lambda p: (
+            "active" not in params or p["active"] == _flag(params["active"])
+        ))
+
+    def _list_prices(self, params: Dict) -> Dict:
+        page = self._list("price", params, lambda p: (
+            ("active" not in params or p["active"] == _flag(params["active"]))
+            and (not params.get("type") or p["type"] == params["type"])
+            and (not params.get("product") or p["product"] == params["product"])
+            and (not params.get("currency") or p["currency"] == params["currency"])
+            and (not params.get("lookup_keys") or p.get("lookup_key") in params["lookup_keys"])
+        ))
+        if "data.product" in (params.get("expand") or []):
+            page["data"] = [dict(p, product=self._get("product", p["product"])) for p in page["data"]]
+        return page
+
+    def _create_payment_intent(self, params: Dict) -> Dict:
+        intent_id = self._new_id("pi")
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(params.get("amount") or 0),
+            "currency": params.get("currency", "usd"),
+            "customer": params.get("customer"),
+            "status": "requires_payment_method",
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:12]}",
+            "created": int(time.time()),
+        }
+        return self._store("payment_intent", intent, "payment_intent.created")
+
+    def _create_portal_session(self, params: Dict) -> Dict:
+        customer_id = params.get("customer")
+        self._get("customer", customer_id)
+        session_id = self._new_id("bps")
+        return {
+            "id": session_id,
+            "object": "billing_portal.session",
+            "customer": customer_id,
+            "return_url": params.get("return_url"),
+            "url": f"https://billing.stripe.test/p/session/{session_id}",
+            "created": int(time.time()),
+        }
+
+    # -- events -----------------------------------------------------------
+
+    def _get_event(self, event_id: str) -> Dict:
+        with self._lock:
+            position = self._event_positions.get(event_id)
+            if position is None:
+                raise _missing("event", event_id)
+            return self.events[position]
+
+    def _list_events(self, params: Dict) -> Dict:
+        """One newest-first page of events, filtered by created[gte/gt/lt/lte] and type."""
+        limit = min(int(params.get("limit") or 10), 100)
+        created = params.get("created") or {}
+        if not isinstance(created, dict):
+            created = {"gte": created, "lte": created}
+        low = int(created["gte"]) if "gte" in created else int(created.get("gt", -2)) + 1
+        high = int(created["lt"]) if "lt" in created else int(created.get("lte", 2 ** 62)) + 1
+        event_type = params.get("type")
+        page, has_more = [], False
+        with self._lock:
+            # Scan down from just below the range's end (or the starting_after event)
+            i = bisect.bisect_left(self._event_created, high) - 1
+            if params.get("starting_after") in self._event_positions:
+                i = min(i, self._event_positions[params["starting_after"]] - 1)
+            while i >= 0 and self.events[i]["created"] >= low:
+                event = self.events[i]
+                if not event_type or fnmatch.fnmatchcase(event["type"], event_type):
+                    if len(page) == limit:
+                        has_more = True
+                        break
+                    page.append(event)
+                i -= 1
+        return {"object": "list", "url": "/v1/events", "has_more": has_more, "data": page}
+
+    # -- webhooks ---------------------------------------------------------
+
+    def _emit(self, event_type: str, obj: Dict):
+        event = {
+            "id": self._new_id("evt"),
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "livemode": False,
+            "data": {"object": obj},
+        }
+        with self._lock:
+            self._event_positions[event["id"]] = len(self.events)
+            self.events.append(event)
+            self._event_created.append(event["created"])
+        if self.webhook_url:
+            self._deliveries.put(event)
+
+    def signed_event(self, event: Dict) -> Tuple[str, str]:
+        """Serialize an event and return (payload, Stripe-Signature header)."""
+        payload = json.dumps(event)
+        return payload, sign_payload(payload, self.webhook_secret)
+
+    def _deliver_webhooks(self):
+        with httpx.Client(timeout=10) as client:
+            while True:
+                event = self._deliveries.get()
+                if event is None:
+                    return
+                payload, header = self.signed_event(event)
+                try:
+                    client.post(
+                        self.webhook_url,
+                        content=payload,
+                        headers={"Content-Type": "application/json", "Stripe-Signature": header},
+                    )
+                except httpx.HTTPError:
+                    with self._lock:
+                        self.counts["webhook_delivery_errors"] += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rps", type=float, default=None)
+    parser.add_argument("--webhook-url", default=None)
+    parser.add_argument("--webhook-secret", default="whsec_fake")
+    args = parser.parse_args()
+
+    fake = FakeStripe(
+        host=args.host,
+        port=args.port,
+        latency=args.latency_ms / 1000,
+        latency_jitter=args.jitter_ms / 1000,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rate_limit_rps=args.rate_limit_rps,
+        webhook_secret=args.webhook_secret,
+        webhook_url=args.webhook_url,
+    ).start()
+    print(f"Fake Stripe listening on {fake.url} (export STRIPE_API_BASE={fake.url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""End-to-end load benchmark for the payment API against the fake Stripe server.
+
+Drives customer creation, subscription creation, payment intents,
+subscription listing and webhook ingestion at a fixed concurrency and
+reports throughput, p50/p95/p99/p999 latency, error rate and CPU/RSS per
+API worker. Results are written as JSON; pass --compare with an earlier
+file to fail on throughput or tail-latency regressions.
+
+    # In-process (ASGI transport, one worker shared with the load generator)
+    python benchmarks/load_benchmark.py --requests 2000 --concurrency 50
+
+    # Real HTTP against `uvicorn --workers 4`, compared with a baseline
+    python benchmarks/load_benchmark.py --workers 4 --compare benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+WEBHOOK_SECRET = "whsec_benchmark"
+DATA_DIR = tempfile.mkdtemp()
+BENCH_ENV = {
+    "STRIPE_SECRET_KEY": "sk_test_benchmark",
+    "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+    "WEBHOOK_QUEUE_PATH": os.path.join(DATA_DIR, "webhook_queue.db"),
+    "WEBHOOK_DEDUP_PATH": os.path.join(DATA_DIR, "webhook_dedup.db"),
+    "STRIPE_MIRROR_PATH": os.path.join(DATA_DIR, "stripe_mirror.db"),
+}
+os.environ.update(BENCH_ENV)
+# Measure the service, not the client-side rate limiter; override to include it
+os.environ.setdefault("STRIPE_READ_RATE", "100000")
+os.environ.setdefault("STRIPE_WRITE_RATE", "100000")
+os.environ.setdefault("STRIPE_MAX_IN_FLIGHT", "1000")
+
+import httpx
+
+from fake_stripe import FakeStripe, sign_payload
+
+SCENARIOS = ("customers", "subscriptions", "payment_intents", "list_subscriptions", "webhooks")
+WEBHOOK_TYPES = ("invoice.payment_succeeded", "customer.subscription.updated", "payment_intent.succeeded")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def build_request(scenario: str, i: int, customer_ids: List[str]) -> Tuple[str, str, Dict]:
+    """(method, path, httpx kwargs) for request number i of a scenario."""
+    customer_id = customer_ids[i % len(customer_ids)]
+    if scenario == "customers":
+        return "POST", "/api/v1/customers", {"json": {"email": f"load{i}@example.com", "name": "Load"}}
+    if scenario == "subscriptions":
+        return "POST", "/api/v1/subscriptions", {"json": {"customer_id": customer_id, "tier": "pro"}}
+    if scenario == "payment_intents":
+        return "POST", "/api/v1/payment-intents", {"json": {"amount": 1000, "customer_id": customer_id}}
+    if scenario == "list_subscriptions":
+        return "GET", f"/api/v1/customers/{customer_id}/subscriptions", {}
+    payload = json.dumps({
+        "id": f"evt_load_{i}_{time.monotonic_ns()}",
+        "object": "event",
+        "type": WEBHOOK_TYPES[i % len(WEBHOOK_TYPES)],
+        "created": int(time.time()),
+        "data": {"object": {"id": f"in_load_{i}", "object": "invoice", "customer": customer_id}},
+    })
+    return "POST", "/api/v1/webhooks/stripe", {
+        "content": payload,
+        "headers": {"stripe-signature": sign_payload(payload, WEBHOOK_SECRET)},
+    }
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))]
+
+
+class ProcessSampler:
+    """CPU time and RSS of a set of processes, read from /proc."""
+
+    def __init__(self, pids: List[int]):
+        self.pids = pids
+
+    @staticmethod
+    def _read(pid: int) -> Dict:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage = {"cpu_seconds": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS}
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"
+                    usage[key] = round(int(line.split()[1]) / 1024, 1)
+        return usage
+
+    def sample(self) -> Dict[int, Dict]:
+        return {pid: self._read(pid) for pid in self.pids}
+
+    @staticmethod
+    def usage(before: Dict[int, Dict], after: Dict[int, Dict], elapsed: float) -> List[Dict]:
+        return [
+            {
+                "pid": pid,
+                "cpu_percent": round((after[pid]["cpu_seconds"] - before[pid]["cpu_seconds"]) / elapsed * 100, 1),
+                "rss_mb": after[pid].get("rss_mb"),
+                "peak_rss_mb": after[pid].get("peak_rss_mb"),
+            }
+            for pid in after
+        ]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: str,
+    total: int,
+    concurrency: int,
+    customer_ids: List[str],
+    sampler: ProcessSampler,
+) -> Dict:
+    """Closed-loop load: `concurrency` callers issue `total` requests between them."""
+    latencies: List[float] = []
+    errors = 0
+    statuses: Dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def caller():
+        nonlocal errors
+        for i in counter:
+            method, path, kwargs = build_request(scenario, i, customer_ids)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if not status.startswith("2"):
+                errors += 1
+
+    before = sampler.sample()
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    after = sampler.sample()
+
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "error_rate": round(errors / total, 4),
+        "status_counts": statuses,
+        "latency_ms": {
+            name: round(percentile(latencies, q) * 1000, 2)
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99), ("p999", 0.999))
+        },
+        "workers": ProcessSampler.usage(before, after, elapsed),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _worker_pids(master: int) -> List[int]:
+    """uvicorn worker processes (the master itself when running one worker)."""
+    with open(f"/proc/{master}/task/{master}/children") as f:
+        children = [int(pid) for pid in f.read().split()]
+    workers = []
+    for pid in children:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            if b"resource_tracker" not in f.read():
+                workers.append(pid)
+    return workers or [master]
+
+
+def start_server(workers: int, stripe_url: str) -> Tuple[subprocess.Popen, str]:
+    """Run the API under uvicorn with N workers, pointed at the fake Stripe."""
+    port = _free_port()
+    env = dict(os.environ, STRIPE_API_BASE=stripe_url)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--app-dir", SRC_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=DATA_DIR,
+        env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                # Give every worker time to finish starting up
+                while len(_worker_pids(server.pid)) < workers and time.monotonic() < deadline:
+                    time.sleep(0.1)
+                return server, base_url
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("API server did not start")
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Regressions of throughput or p99 beyond `tolerance` (a fraction) versus a baseline."""
+    regressions = []
+    if baseline.get("meta", {}).get("mode") != results["meta"]["mode"]:
+        print(f"warning: comparing {results['meta']['mode']} against {baseline.get('meta', {}).get('mode')}")
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        rps_change = current["throughput_rps"] / previous["throughput_rps"] - 1
+        p99_change = current["latency_ms"]["p99"] / max(previous["latency_ms"]["p99"], 0.001) - 1
+        print(f"{scenario:20} rps {rps_change:+.1%}  p99 {p99_change:+.1%}  "
+              f"errors {previous['error_rate']:.2%} -> {current['error_rate']:.2%}")
+        if rps_change < -tolerance:
+            regressions.append(f"{scenario}: throughput {rps_change:+.1%}")
+        if p99_change > tolerance:
+            regressions.append(f"{scenario}: p99 latency {p99_change:+.1%}")
+        if current["error_rate"] > previous["error_rate"] + 0.01:
+            regressions.append(f"{scenario}: error rate {current['error_rate']:.2%}")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--customers", type=int, default=50, help="customers created before the run")
+    parser.add_argument("--workers", type=int, default=0, help="uvicorn workers; 0 runs the app in-process")
+    parser.add_argument("--stripe-latency-ms", type=float, default=30.0)
+    parser.add_argument("--stripe-jitter-ms", type=float, default=10.0)
+    parser.add_argument("--stripe-error-rate", type=float, default=0.0)
+    parser.add_argument("--output", default=None, help="results file (default: benchmarks/results/)")
+    parser.add_argument("--compare", default=None, help="baseline results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    fake = FakeStripe(
+        latency=args.stripe_latency_ms / 1000,
+        latency_jitter=args.stripe_jitter_ms / 1000,
+        error_rate=args.stripe_error_rate,
+    ).start()
+    fake.create_tier_prices({"starter": 4900, "pro": 19900, "enterprise": 49900})
+    server = None
+    if args.workers:
+        server, base_url = start_server(args.workers, fake.url)
+        sampler = ProcessSampler(_worker_pids(server.pid))
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency),
+            timeout=60,
+        )
+    else:
+        os.environ["STRIPE_API_BASE"] = fake.url
+        import api
+        api.webhook_queue.start()
+        # ASGITransport skips startup events, so load the price catalog here
+        await api.processor.sync_price_catalog()
+        # Load generator and fake Stripe share this process
+        sampler = ProcessSampler([os.getpid()])
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench", timeout=60)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "mode": f"uvicorn x{args.workers}" if args.workers else "in-process",
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    try:
+        async with client:
+            setup = await asyncio.gather(*(
+                client.post("/api/v1/customers", json={"email": f"seed{i}@example.com", "name": "Seed"})
+                for i in range(args.customers)
+            ))
+            customer_ids = [r.json()["customer_id"] for r in setup if r.status_code == 201]
+            if not customer_ids:
+                raise RuntimeError("could not create seed customers")
+            for scenario in scenarios:
+                result = await run_scenario(client, scenario, args.requests, args.concurrency, customer_ids, sampler)
+                results["scenarios"][scenario] = result
+                print(f"{scenario:20} {result['throughput_rps']:8.1f} rps  "
+                      f"p50 {result['latency_ms']['p50']:7.2f}ms  p99 {result['latency_ms']['p99']:7.2f}ms  "
+                      f"p999 {result['latency_ms']['p999']:7.2f}ms  errors {result['error_rate']:.2%}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        else:
+            api.webhook_queue.stop()
+            await api.processor.aclose()
+        fake.stop()
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"load-{results['meta']['git_commit'] or 'local'}-{stamp}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
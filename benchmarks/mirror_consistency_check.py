@@ -0,0 +1,83 @@
+"""Read-your-writes check for subscription reads served from the local mirror.
+
+Runs against the fake Stripe server with webhook delivery off, so only
+the processor's own writes can update the mirror. For the sync and async
+processors, with and without STRIPE_MIRROR_FALLBACK, it seeds a customer's
+listing, then creates, updates and cancels a subscription and checks that
+each following get_customer_subscriptions() reflects the change. Exits
+non-zero on any mismatch.
+
+    python benchmarks/mirror_consistency_check.py
+"""
+import asyncio
+import inspect
+import json
+import os
+import sys
+import tempfile
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+DATA_DIR = tempfile.mkdtemp()
+os.environ["WEBHOOK_DEDUP_PATH"] = os.path.join(DATA_DIR, "webhook_dedup.db")
+os.environ["STRIPE_MIRROR_PATH"] = os.path.join(DATA_DIR, "stripe_mirror.db")
+
+import stripe
+
+from async_payment_processor import AsyncPaymentProcessor
+from fake_stripe import FakeStripe
+from mirror import SQLiteMirrorStore
+from payment_processor import PaymentProcessor
+
+
+async def _await(value):
+    return await value if inspect.isawaitable(value) else value
+
+
+async def check(processor: PaymentProcessor, label: str) -> List[str]:
+    """Run the write/read sequence; returns the failed steps."""
+    failures = []
+
+    async def listed(step: str, expected: Dict[str, str]):
+        subscriptions = await _await(processor.get_customer_subscriptions(customer_id))
+        found = {s['id']: s['items']['data'][0]['price']['id'] for s in subscriptions}
+        if found != expected:
+            failures.append(f"{label}: after {step} expected {expected}, got {found}")
+
+    customer = await _await(processor.create_customer(f"{label}@example.com", label))
+    customer_id = customer["customer_id"]
+    await listed("seed", {})
+
+    created = await _await(processor.create_subscription(customer_id, "price_basic"))
+    await listed("create", {created["subscription_id"]: "price_basic"})
+
+    await _await(processor.update_subscription(created["subscription_id"], "price_pro"))
+    await listed("update", {created["subscription_id"]: "price_pro"})
+
+    await _await(processor.cancel_subscription(created["subscription_id"], immediate=True))
+    await listed("cancel", {})
+    return failures
+
+
+async def main():
+    results = {}
+    with FakeStripe() as fake:
+        stripe.api_base = fake.url
+        for processor_class in (PaymentProcessor, AsyncPaymentProcessor):
+            for fallback in (True, False):
+                label = f"{processor_class.__name__}-fallback-{str(fallback).lower()}"
+                processor = processor_class()
+                processor.mirror = SQLiteMirrorStore(os.path.join(DATA_DIR, f"{label}.db"))
+                processor.mirror_fallback = fallback
+                results[label] = await check(processor, label)
+                if hasattr(processor, "aclose"):
+                    await processor.aclose()
+
+    print(json.dumps(results, indent=2))
+    if any(results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+"""Cold-start benchmark for the payment API.
+
+Starts the API under uvicorn against the fake Stripe server several times
+and reports, from process launch, the median time until /health first
+answers, until the first Stripe-backed request (a customer creation)
+succeeds and until the price catalog is loaded. Also breaks down
+`import api` by top-level package with `python -X importtime`, and shows
+whether the Stripe SDK and httpx were imported by it.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --latency-ms 200 --top 20
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+
+from fake_stripe import FakeStripe
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+DATA_DIR = tempfile.mkdtemp()
+BENCH_ENV = {
+    "STRIPE_SECRET_KEY": "sk_test_benchmark",
+    "STRIPE_WEBHOOK_SECRET": "whsec_benchmark",
+    "WEBHOOK_QUEUE_PATH": os.path.join(DATA_DIR, "webhook_queue.db"),
+    "WEBHOOK_DEDUP_PATH": os.path.join(DATA_DIR, "webhook_dedup.db"),
+    "STRIPE_MIRROR_PATH": os.path.join(DATA_DIR, "stripe_mirror.db"),
+}
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+POLL_INTERVAL = 0.005
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(check, deadline: float) -> bool:
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(POLL_INTERVAL)
+    return False
+
+
+def cold_start(stripe_url: str) -> Dict[str, float]:
+    """Launch one server and time its way to serving; returns milliseconds since launch."""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, **BENCH_ENV, STRIPE_API_BASE=stripe_url)
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--app-dir", SRC_DIR,
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=DATA_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = started + 30
+    timings = {}
+    try:
+        with httpx.Client(base_url=base_url, timeout=5) as client:
+            if not _wait_for(lambda: client.get("/health").status_code == 200, deadline):
+                raise RuntimeError("API server did not start")
+            timings["first_request_ms"] = (time.monotonic() - started) * 1000
+            response = client.post("/api/v1/customers", json={"email": "cold@example.com", "name": "Cold Start"})
+            response.raise_for_status()
+            timings["first_stripe_call_ms"] = (time.monotonic() - started) * 1000
+            if not _wait_for(lambda: client.get("/health").json()["price_catalog"]["loaded"], deadline):
+                raise RuntimeError("Price catalog did not load")
+            timings["catalog_loaded_ms"] = (time.monotonic() - started) * 1000
+    finally:
+        server.terminate()
+        server.wait()
+    return timings
+
+
+def import_breakdown(module: str, top: int) -> Dict:
+    """Self time of `import module` grouped by top-level package, slowest first."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=DATA_DIR,
+        env=dict(os.environ, **BENCH_ENV, PYTHONPATH=SRC_DIR),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    packages: Dict[str, int] = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        root = name.split(".")[0]
+        packages[root] = packages.get(root, 0) + int(self_us)
+        if root == module and not indent:
+            total = int(cumulative_us)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_ms": round(total / 1000, 1),
+        "packages_ms": {name: round(us / 1000, 1) for name, us in slowest},
+        "stripe_imported": "stripe" in packages,
+        "httpx_imported": "httpx" in packages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="simulated Stripe latency")
+    parser.add_argument("--module", default="api", help="module whose import time is broken down")
+    parser.add_argument("--top", type=int, default=15, help="packages listed in the breakdown")
+    args = parser.parse_args()
+
+    runs = []
+    with FakeStripe(latency=args.latency_ms / 1000) as fake:
+        for _ in range(args.runs):
+            runs.append(cold_start(fake.url))
+
+    result = {
+        "runs": args.runs,
+        "median_ms": {key: round(statistics.median(run[key] for run in runs), 1) for key in runs[0]},
+        "max_ms": {key: round(max(run[key] for run in runs), 1) for key in runs[0]},
+        "imports": import_breakdown(args.module, args.top),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
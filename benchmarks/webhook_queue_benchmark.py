@@ -0,0 +1,112 @@
+"""Burst benchmark for webhook acknowledge-then-process ingestion.
+
+Posts a burst of signed events to /api/v1/webhooks/stripe while the queue
+workers drain in the background, then reports acknowledgement latency,
+peak queue depth and drain throughput.
+
+    python benchmarks/webhook_queue_benchmark.py --events 10000 --workers 4
+    python benchmarks/webhook_queue_benchmark.py --events 10000 --batch-size 1   # no micro-batching
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+WEBHOOK_SECRET = "whsec_benchmark"
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_benchmark")
+os.environ["STRIPE_WEBHOOK_SECRET"] = WEBHOOK_SECRET
+DATA_DIR = tempfile.mkdtemp()
+os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(DATA_DIR, "webhook_queue.db")
+os.environ["WEBHOOK_DEDUP_PATH"] = os.path.join(DATA_DIR, "webhook_dedup.db")
+
+import httpx
+
+import api
+from fake_stripe import sign_payload
+
+EVENT_TYPES = [
+    "invoice.payment_succeeded",
+    "customer.subscription.updated",
+    "payment_intent.succeeded",
+    "customer.subscription.created",
+]
+
+
+def signed_event(i: int):
+    """Build a payload and matching Stripe-Signature header."""
+    payload = json.dumps({
+        "id": f"evt_{i}",
+        "object": "event",
+        "type": EVENT_TYPES[i % len(EVENT_TYPES)],
+        "created": int(time.time()),
+        "data": {"object": {"id": f"obj_{i}", "customer": f"cus_{i % 500}"}},
+    })
+    return payload, sign_payload(payload, WEBHOOK_SECRET)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, help="max events per micro-batch (default WEBHOOK_BATCH_SIZE)")
+    args = parser.parse_args()
+
+    queue = api.webhook_queue
+    queue.workers = args.workers
+    if args.batch_size:
+        queue.batch_size = args.batch_size
+    queue.start()
+
+    latencies = []
+    peak_depth = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+    transport = httpx.ASGITransport(app=api.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def deliver(i):
+            payload, header = signed_event(i)
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/v1/webhooks/stripe",
+                    content=payload,
+                    headers={"stripe-signature": header},
+                )
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(deliver(i) for i in range(args.events)))
+        ack_elapsed = time.perf_counter() - start
+
+    while True:
+        stats = queue.stats()
+        peak_depth = max(peak_depth, stats["depth"])
+        if stats["depth"] == 0:
+            break
+        await asyncio.sleep(0.05)
+    drain_elapsed = time.perf_counter() - start
+    queue.stop()
+
+    latencies.sort()
+    print(json.dumps({
+        "events": args.events,
+        "workers": args.workers,
+        "batch_size": queue.batch_size,
+        "ack_per_second": round(args.events / ack_elapsed, 1),
+        "ack_p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "ack_p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "depth_after_burst": peak_depth,
+        "drained_per_second": round(args.events / drain_elapsed, 1),
+        "failed": stats["failed"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,301 @@
+"""Replay recorded or synthetic Stripe events to size webhook workers.
+
+Reads events from a JSONL file (one Stripe event object per line) or
+generates a month-end renewal storm, signs each with STRIPE_WEBHOOK_SECRET
+and replays it at a target rate (or as fast as possible) either
+
+  * directly into PaymentProcessor.verify_webhook + handle_webhook_event
+    on N worker threads, timing verification and handling separately, or
+  * through POST /api/v1/webhooks/stripe, in-process or against --url,
+    timing the acknowledgement and, in-process, the queue drain.
+
+It also reports how duplicates and out-of-order deliveries were handled:
+duplicates skipped by the deduplicator and whether the mirror ended up
+holding the newest version of every object.
+
+    python benchmarks/webhook_replay.py --generate 20000 --duplicate-rate 0.05 --reorder-rate 0.2
+    python benchmarks/webhook_replay.py --events recorded.jsonl --mode api --rate 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_replay")
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_replay")
+DATA_DIR = tempfile.mkdtemp()
+os.environ["WEBHOOK_QUEUE_PATH"] = os.path.join(DATA_DIR, "webhook_queue.db")
+os.environ["WEBHOOK_DEDUP_PATH"] = os.path.join(DATA_DIR, "webhook_dedup.db")
+os.environ["STRIPE_MIRROR_PATH"] = os.path.join(DATA_DIR, "stripe_mirror.db")
+
+import httpx
+
+from fake_stripe import sign_payload
+
+WEBHOOK_SECRET = os.environ["STRIPE_WEBHOOK_SECRET"]
+
+
+def renewal_storm(subscriptions: int, failure_rate: float = 0.05, seed: int = 7) -> List[Dict]:
+    """Event sequence Stripe emits when `subscriptions` renew at once."""
+    rng = random.Random(seed)
+    now = int(time.time())
+    events = []
+
+    def event(event_type: str, obj: Dict, created: int):
+        events.append({
+            "id": f"evt_replay_{len(events):08d}",
+            "object": "event",
+            "type": event_type,
+            "created": created,
+            "livemode": False,
+            "data": {"object": obj},
+        })
+
+    for n in range(subscriptions):
+        customer = f"cus_replay_{n % max(1, subscriptions // 2):06d}"
+        subscription = f"sub_replay_{n:06d}"
+        invoice = {"id": f"in_replay_{n:06d}", "object": "invoice", "customer": customer,
+                   "subscription": subscription, "status": "open"}
+        intent = {"id": f"pi_replay_{n:06d}", "object": "payment_intent", "customer": customer,
+                  "amount": rng.choice((4900, 19900, 49900)), "currency": "usd"}
+        t = now + n // 50
+        event("invoice.created", invoice, t)
+        event("invoice.finalized", dict(invoice), t + 1)
+        if rng.random() < failure_rate:
+            event("payment_intent.payment_failed", dict(intent, status="requires_payment_method"), t + 2)
+            event("invoice.payment_failed", dict(invoice, status="open", attempt_count=1), t + 3)
+            status = "past_due"
+        else:
+            event("payment_intent.succeeded", dict(intent, status="succeeded"), t + 2)
+            event("invoice.payment_succeeded", dict(invoice, status="paid"), t + 3)
+            status = "active"
+        event("customer.subscription.updated", {
+            "id": subscription, "object": "subscription", "customer": customer, "status": status,
+            "current_period_end": t + 30 * 86400,
+        }, t + 4)
+    return events
+
+
+def load_events(path: str) -> List[Dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def disorder(events: List[Dict], duplicate_rate: float, reorder_rate: float, seed: int = 11) -> List[Dict]:
+    """Simulate at-least-once delivery: re-send some events and locally shuffle others."""
+    rng = random.Random(seed)
+    stream = list(events)
+    for event in events:
+        if rng.random() < duplicate_rate:
+            stream.insert(rng.randrange(len(stream) + 1), event)
+    for i in range(len(stream) - 1):
+        if rng.random() < reorder_rate:
+            j = min(len(stream) - 1, i + rng.randint(1, 10))
+            stream[i], stream[j] = stream[j], stream[i]
+    return stream
+
+
+def paced(count: int, rate: float) -> Iterator[int]:
+    """Yield indexes 0..count-1, sleeping to hold `rate` per second (0 = unpaced)."""
+    start = time.perf_counter()
+    for i in range(count):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        yield i
+
+
+def summarize_ms(samples: List[float]) -> Dict:
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    return {
+        "mean": round(statistics.fmean(samples) * 1000, 3),
+        "p50": round(samples[len(samples) // 2] * 1000, 3),
+        "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+    }
+
+
+def expected_mirror_state(events: List[Dict]) -> Dict[Tuple[str, str], Dict]:
+    """Newest version of each mirrored object, by event creation time."""
+    from mirror import MIRRORED_TYPES
+
+    newest: Dict[Tuple[str, str], Tuple[int, Dict]] = {}
+    for event in events:
+        obj = event["data"]["object"]
+        if obj.get("object") not in MIRRORED_TYPES:
+            continue
+        key = (obj["object"], obj["id"])
+        if key not in newest or event.get("created", 0) > newest[key][0]:
+            newest[key] = (event.get("created", 0), obj)
+    return {key: obj for key, (_, obj) in newest.items()}
+
+
+def ordering_report(processor, events: List[Dict]) -> Dict:
+    """How many mirrored objects ended at their newest version despite reordering."""
+    expected = expected_mirror_state(events)
+    stale = sum(
+        1 for (object_type, object_id), obj in expected.items()
+        if processor.mirror.get(object_type, object_id) != obj
+    )
+    return {"mirrored_objects": len(expected), "stale_objects": stale}
+
+
+def replay_direct(stream: List[Dict], rate: float, workers: int) -> Dict:
+    """Sign and feed events straight into the processor on `workers` threads."""
+    from payment_processor import PaymentProcessor
+
+    processor = PaymentProcessor()
+    verify_times: List[float] = []
+    handle_times: List[float] = []
+    counts = {"handled": 0, "duplicates": 0, "rejected": 0, "errors": 0}
+    lock = threading.Lock()
+
+    def deliver(event: Dict):
+        payload = json.dumps(event)
+        header = sign_payload(payload, WEBHOOK_SECRET)
+        t0 = time.perf_counter()
+        verified = processor.verify_webhook(payload.encode(), header)
+        t1 = time.perf_counter()
+        outcome = "rejected"
+        if verified is not None:
+            try:
+                result = processor.handle_webhook_event(verified)
+                outcome = "duplicates" if result.get("duplicate") else "handled"
+            except Exception:
+                outcome = "errors"
+        t2 = time.perf_counter()
+        with lock:
+            verify_times.append(t1 - t0)
+            if verified is not None:
+                handle_times.append(t2 - t1)
+            counts[outcome] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        for future in [pool.submit(deliver, stream[i]) for i in paced(len(stream), rate)]:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "events_per_second": round(len(stream) / elapsed, 1),
+        "verify_ms": summarize_ms(verify_times),
+        "handle_ms": summarize_ms(handle_times),
+        "verify_share": round(sum(verify_times) / max(sum(verify_times) + sum(handle_times), 1e-9), 3),
+        **counts,
+        "ordering": ordering_report(processor, stream),
+    }
+
+
+async def replay_api(stream: List[Dict], rate: float, concurrency: int, url: Optional[str]) -> Dict:
+    """POST signed events to the webhook endpoint, in-process unless `url` is given."""
+    app_module = None
+    if url:
+        client = httpx.AsyncClient(base_url=url, timeout=30)
+    else:
+        import api as app_module
+        app_module.webhook_queue.start()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app_module.app), base_url="http://replay")
+
+    ack_times: List[float] = []
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(event: Dict):
+        payload = json.dumps(event)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/api/v1/webhooks/stripe",
+                content=payload,
+                headers={"stripe-signature": sign_payload(payload, WEBHOOK_SECRET)},
+            )
+            ack_times.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    async with client:
+        tasks = []
+        for i in range(len(stream)):
+            if rate:
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(deliver(stream[i])))
+        await asyncio.gather(*tasks)
+    ack_elapsed = time.perf_counter() - start
+
+    report = {
+        "acks_per_second": round(len(stream) / ack_elapsed, 1),
+        "ack_ms": summarize_ms(ack_times),
+        "status_counts": statuses,
+    }
+    if app_module is not None:
+        queue = app_module.webhook_queue
+        while queue.stats()["depth"]:
+            await asyncio.sleep(0.05)
+        drain_elapsed = time.perf_counter() - start
+        queue.stop()
+        report.update({
+            "drained_per_second": round(len(stream) / drain_elapsed, 1),
+            "queue_failed": queue.stats()["failed"],
+            "dedup": app_module.processor.deduplicator.stats(),
+            "ordering": ordering_report(app_module.processor, stream),
+        })
+        await app_module.processor.aclose()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--events", help="JSONL file of recorded Stripe events")
+    source.add_argument("--generate", type=int, default=5000, help="subscriptions renewing in the synthetic storm (5 events each)")
+    parser.add_argument("--save", help="write the (generated) event stream to this JSONL file and exit")
+    parser.add_argument("--duplicate-rate", type=float, default=0.02)
+    parser.add_argument("--reorder-rate", type=float, default=0.1)
+    parser.add_argument("--mode", choices=("direct", "api"), default="direct")
+    parser.add_argument("--rate", type=float, default=0, help="events per second; 0 = as fast as possible")
+    parser.add_argument("--workers", type=int, default=4, help="handler threads in direct mode")
+    parser.add_argument("--concurrency", type=int, default=100, help="in-flight requests in api mode")
+    parser.add_argument("--url", help="replay against a running API instead of in-process")
+    args = parser.parse_args()
+
+    events = load_events(args.events) if args.events else renewal_storm(args.generate)
+    if args.save:
+        with open(args.save, "w") as f:
+            f.writelines(json.dumps(event) + "\n" for event in events)
+        print(f"Wrote {len(events)} events to {args.save}")
+        return
+    stream = disorder(events, args.duplicate_rate, args.reorder_rate)
+    type_mix: Dict[str, int] = {}
+    for event in stream:
+        type_mix[event["type"]] = type_mix.get(event["type"], 0) + 1
+
+    if args.mode == "direct":
+        report = replay_direct(stream, args.rate, args.workers)
+    else:
+        report = asyncio.run(replay_api(stream, args.rate, args.concurrency, args.url))
+
+    print(json.dumps({
+        "mode": args.mode,
+        "events": len(stream),
+        "unique_events": len({event["id"] for event in stream}),
+        "type_mix": type_mix,
+        "target_rate": args.rate or "max",
+        **report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Webhook verification throughput: stripe.Webhook.construct_event vs the HMAC fast path.
+
+Signs a set of realistic invoice/subscription events and verifies them on
+one thread (so the numbers are events/sec per core) with
+
+  * stripe.Webhook.construct_event (verify, then build a StripeObject tree)
+  * WebhookVerifier with the stdlib json parser
+  * WebhookVerifier with orjson, if installed
+  * WebhookVerifier during a secret rotation (event signed with the second secret)
+  * WebhookVerifier rejecting a bad signature (nothing is parsed)
+
+    python benchmarks/webhook_verify_benchmark.py --events 20000 --line-items 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import stripe
+
+import webhook_signature
+from fake_stripe import sign_payload
+from webhook_signature import WebhookSignatureError, WebhookVerifier
+
+SECRET = "whsec_benchmark"
+OLD_SECRET = "whsec_benchmark_old"
+
+
+def make_payloads(count: int, line_items: int):
+    """Signed invoice.payment_succeeded payloads of roughly production size."""
+    now = int(time.time())
+    payloads = []
+    for i in range(count):
+        event = {
+            "id": f"evt_{i:08d}",
+            "object": "event",
+            "api_version": "2023-10-16",
+            "type": "invoice.payment_succeeded",
+            "created": now,
+            "livemode": False,
+            "data": {"object": {
+                "id": f"in_{i:08d}",
+                "object": "invoice",
+                "customer": f"cus_{i % 1000:06d}",
+                "subscription": f"sub_{i:08d}",
+                "status": "paid",
+                "amount_paid": 19900,
+                "currency": "usd",
+                "metadata": {"traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"},
+                "lines": {"object": "list", "has_more": False, "data": [
+                    {"id": f"il_{i}_{n}", "object": "line_item", "amount": 19900, "currency": "usd",
+                     "description": "1 x Pro (at $199.00 / month)",
+                     "period": {"start": now, "end": now + 30 * 86400},
+                     "price": {"id": "price_pro_usd_month", "object": "price", "unit_amount": 19900,
+                               "recurring": {"interval": "month", "interval_count": 1}}}
+                    for n in range(line_items)
+                ]},
+            }},
+        }
+        payload = json.dumps(event).encode()
+        payloads.append((payload, sign_payload(payload.decode(), SECRET)))
+    return payloads
+
+
+def measure(name: str, verify, payloads) -> dict:
+    start = time.perf_counter()
+    for payload, header in payloads:
+        verify(payload, header)
+    elapsed = time.perf_counter() - start
+    return {"name": name, "events_per_second": round(len(payloads) / elapsed), "us_per_event": round(elapsed / len(payloads) * 1e6, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--line-items", type=int, default=5, help="invoice lines per event (payload size)")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.events, args.line_items)
+    verifier = WebhookVerifier([SECRET])
+    rotating = WebhookVerifier([OLD_SECRET, SECRET])
+    # Flip the last hex digit; overwriting with a constant leaves signatures that already end in it valid
+    tampered = [(payload, header[:-1] + ("1" if header[-1] == "0" else "0")) for payload, header in payloads]
+
+    def reject(payload, header):
+        try:
+            verifier.construct_event(payload, header)
+        except WebhookSignatureError:
+            return
+        raise AssertionError("tampered signature accepted")
+
+    results = [measure("stripe.Webhook.construct_event",
+                       lambda p, h: stripe.Webhook.construct_event(p, h, SECRET), payloads)]
+    fast_loads = webhook_signature.loads
+    webhook_signature.loads = json.loads
+    results.append(measure("fast path (json)", verifier.construct_event, payloads))
+    webhook_signature.loads = fast_loads
+    if webhook_signature.orjson is not None:
+        results.append(measure("fast path (orjson)", verifier.construct_event, payloads))
+    results.append(measure("fast path, 2 secrets", rotating.construct_event, payloads))
+    results.append(measure("fast path, bad signature", reject, tampered))
+
+    baseline = results[0]["events_per_second"]
+    print(f"{args.events} events, {len(payloads[0][0])} byte payloads, one thread\n")
+    for result in results:
+        print(f"{result['name']:34} {result['events_per_second']:9,} events/s  "
+              f"{result['us_per_event']:7.1f} us/event  x{result['events_per_second'] / baseline:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,78 @@
 """FastAPI server for payment processing."""
-from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, EmailStr
-from typing import Optional
+from fastapi import APIRouter, Depends, FastAPI, Request, HTTPException, Header, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field
+from typing import Dict, List, Optional
+import asyncio
+import hmac
+import json
 import logging
+import math
+import os
+import uuid
 
-from payment_processor import PaymentProcessor, SubscriptionTier
+from async_payment_processor import AsyncPaymentProcessor
+from errors import StripeCallRejected
+from lazy_modules import stripe
+from metrics import REGISTRY, RequestMetricsMiddleware
+from payment_processor import SubscriptionTier
+from webhook_queue import WebhookQueue
+import tracing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Payment Processing API", version="1.0.0")
-processor = PaymentProcessor()
+app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+processor = AsyncPaymentProcessor()
+webhook_queue = WebhookQueue(
+    processor.handle_webhook_event,
+    batch_handler=processor.handle_webhook_events,
+    is_batched=processor.webhooks.is_batched,
+)
+
+REGISTRY.gauge(
+    "webhook_queue_depth", "Webhook events pending or being processed.", (),
+    lambda: {(): webhook_queue.stats()["depth"]},
+)
+REGISTRY.gauge(
+    "stripe_in_flight", "Stripe calls currently holding a governor slot.", (),
+    lambda: {(): processor.governor.in_flight},
+)
+REGISTRY.gauge(
+    "stripe_circuit_open", "1 while the Stripe resource's circuit breaker is open.", ("resource",),
+    lambda: {(name,): int(state["state"] == "open") for name, state in processor.breakers.stats().items()},
+)
+
+@app.exception_handler(StripeCallRejected)
+async def stripe_call_rejected(request: Request, exc: StripeCallRejected):
+    """Fast-fail locally refused Stripe calls with a retry hint."""
+    return JSONResponse(
+        content={"detail": str(exc)},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
 
 class CustomerCreate(BaseModel):
     email: EmailStr
     name: str
 
+CUSTOMER_BATCH_MAX_SIZE = int(os.getenv('CUSTOMER_BATCH_MAX_SIZE', 1000))
+
+class CustomerBatchItem(CustomerCreate):
+    metadata: Optional[Dict[str, str]] = None
+    idempotency_key: Optional[str] = None
+
+class CustomerBatchCreate(BaseModel):
+    customers: List[CustomerBatchItem] = Field(..., min_length=1, max_length=CUSTOMER_BATCH_MAX_SIZE)
+
 class SubscriptionCreate(BaseModel):
     customer_id: str
     tier: SubscriptionTier
+    currency: Optional[str] = None
+    interval: Optional[str] = None
     trial_days: Optional[int] = None
 
 class PaymentIntentCreate(BaseModel):
@@ -30,7 +83,7 @@ class PaymentIntentCreate(BaseModel):
 @app.post("/api/v1/customers")
 async def create_customer(customer: CustomerCreate):
     """Create new customer."""
-    result = processor.create_customer(
+    result = await processor.create_customer(
         email=customer.email,
         name=customer.name,
         metadata={"source": "api"}
@@ -41,13 +94,56 @@ async def create_customer(customer: CustomerCreate):
     else:
         raise HTTPException(status_code=400, detail=result["error"])
 
+@app.post("/api/v1/customers:batch")
+async def create_customers_batch(
+    batch: CustomerBatchCreate,
+    idempotency_key: Optional[str] = Header(None, alias="idempotency-key")
+):
+    """Create customers in parallel, streaming one NDJSON result per item as it completes.
+    
+    Every item gets an idempotency key: its own, `<batch key>:<index>` when the
+    request has an Idempotency-Key header, or a generated one. Keys are
+    echoed back, so a retried batch or item never creates duplicates.
+    """
+    items = [
+        {
+            "email": customer.email,
+            "name": customer.name,
+            "metadata": {"source": "api_batch", **(customer.metadata or {})},
+            "idempotency_key": customer.idempotency_key
+                or (f"{idempotency_key}:{index}" if idempotency_key else str(uuid.uuid4())),
+        }
+        for index, customer in enumerate(batch.customers)
+    ]
+    
+    async def lines():
+        succeeded = 0
+        async for result in processor.create_customers(items):
+            succeeded += result["success"]
+            yield json.dumps(result) + "\n"
+        yield json.dumps({"summary": {
+            "total": len(items), "succeeded": succeeded, "failed": len(items) - succeeded,
+        }}) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/api/v1/subscriptions")
 async def create_subscription(subscription: SubscriptionCreate):
-    """Create new subscription."""
-    # TODO: Get price_id from tier (need to create products in Stripe first)
-    price_id = f"price_{subscription.tier.value}"  # Placeholder
+    """Create new subscription at the tier's price (plan currency and interval unless given)."""
+    price_id = processor.price_id_for(subscription.tier, subscription.currency, subscription.interval)
+    if price_id is None and not processor.catalog.loaded:
+        # Right after startup the catalog is still loading in the background
+        try:
+            await asyncio.wait_for(price_catalog_loaded.wait(), PRICE_CATALOG_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        price_id = processor.price_id_for(subscription.tier, subscription.currency, subscription.interval)
+    if price_id is None:
+        if not processor.catalog.loaded:
+            raise HTTPException(status_code=503, detail="Price catalog not loaded yet")
+        raise HTTPException(status_code=400, detail="No active price for this tier, currency and interval")
     
-    result = processor.create_subscription(
+    result = await processor.create_subscription(
         customer_id=subscription.customer_id,
         price_id=price_id,
         trial_days=subscription.trial_days
@@ -61,7 +157,7 @@ async def create_subscription(subscription: SubscriptionCreate):
 @app.delete("/api/v1/subscriptions/{subscription_id}")
 async def cancel_subscription(subscription_id: str, immediate: bool = False):
     """Cancel subscription."""
-    result = processor.cancel_subscription(subscription_id, immediate)
+    result = await processor.cancel_subscription(subscription_id, immediate)
     
     if result["success"]:
         return result
@@ -71,7 +167,7 @@ async def cancel_subscription(subscription_id: str, immediate: bool = False):
 @app.post("/api/v1/payment-intents")
 async def create_payment_intent(payment: PaymentIntentCreate):
     """Create one-time payment."""
-    result = processor.create_payment_intent(
+    result = await processor.create_payment_intent(
         amount=payment.amount,
         currency=payment.currency,
         customer_id=payment.customer_id
@@ -98,29 +194,215 @@ async def stripe_webhook(
     if not event:
         raise HTTPException(status_code=400, detail="Invalid signature")
     
-    result = processor.handle_webhook_event(event)
-    return result
+    # Persist and acknowledge now; queue workers run the handlers
+    webhook_queue.enqueue(event['id'], event['type'], payload)
+    return {"success": True, "queued": True}
+
+@app.get("/api/v1/webhooks/stats")
+async def webhook_stats():
+    """Webhook queue depth/drain rate, duplicate delivery hit rate and registered handlers."""
+    return {
+        "queue": webhook_queue.stats(),
+        "dedup": processor.deduplicator.stats(),
+        "handlers": processor.webhooks.stats(),
+    }
+
+# Dead letters carry full event payloads (customer PII) and can be mass-replayed or
+# discarded, so they are only served to callers presenting this token
+WEBHOOK_ADMIN_TOKEN = os.getenv('WEBHOOK_ADMIN_TOKEN')
+
+async def require_webhook_admin(admin_token: Optional[str] = Header(None, alias="x-admin-token")):
+    """Reject callers without the admin token; the endpoints are off while none is configured."""
+    if not WEBHOOK_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token or not hmac.compare_digest(
+        admin_token.encode("utf-8", "replace"), WEBHOOK_ADMIN_TOKEN.encode("utf-8")
+    ):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+dead_letters = APIRouter(prefix="/api/v1/webhooks/dead-letters", dependencies=[Depends(require_webhook_admin)])
+
+@dead_letters.get("")
+async def list_dead_letters(
+    status: Optional[str] = Query(None, pattern="^(failed|dead)$"),
+    event_type: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Failed events awaiting redrive ('failed') or out of attempts ('dead')."""
+    return {"dead_letters": webhook_queue.dead_letters(status, event_type, limit)}
+
+@dead_letters.get("/{row_id}")
+async def get_dead_letter(row_id: int):
+    """One dead letter with its event payload."""
+    entry = webhook_queue.dead_letter(row_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return entry
+
+@dead_letters.post("/replay")
+async def replay_dead_letters(
+    status: Optional[str] = Query(None, pattern="^(failed|dead)$"),
+    event_type: Optional[str] = None,
+):
+    """Re-queue every matching dead letter now."""
+    return {"success": True, "replayed": webhook_queue.replay(event_type=event_type, status=status)}
+
+@dead_letters.post("/{row_id}/replay")
+async def replay_dead_letter(row_id: int):
+    """Re-queue one dead letter now."""
+    if not webhook_queue.replay(row_id):
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return {"success": True, "replayed": 1}
+
+@dead_letters.delete("/{row_id}")
+async def discard_dead_letter(row_id: int):
+    """Drop a dead letter without processing it."""
+    if not webhook_queue.discard(row_id):
+        raise HTTPException(status_code=404, detail="Dead letter not found")
+    return {"success": True}
+
+app.include_router(dead_letters)
 
 @app.get("/api/v1/customers/{customer_id}/subscriptions")
 async def get_customer_subscriptions(customer_id: str):
     """Get customer subscriptions."""
-    subscriptions = processor.get_customer_subscriptions(customer_id)
+    subscriptions = await processor.get_customer_subscriptions(customer_id)
     return {"subscriptions": subscriptions}
 
+@app.get("/api/v1/customers/{customer_id}")
+async def get_customer(customer_id: str):
+    """Get customer (served from the local mirror)."""
+    customer = await processor.get_customer(customer_id)
+    if customer is None:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    return customer
+
+@app.get("/api/v1/subscriptions/{subscription_id}")
+async def get_subscription(subscription_id: str):
+    """Get subscription (served from the local mirror)."""
+    subscription = await processor.get_subscription(subscription_id)
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+    return subscription
+
+@app.get("/api/v1/customers/{customer_id}/invoices")
+async def get_customer_invoices(customer_id: str):
+    """Get customer invoices from the local mirror."""
+    # SQLite reads block, so keep them off the event loop
+    return {"invoices": await run_in_threadpool(processor.get_customer_invoices, customer_id)}
+
+@app.get("/api/v1/customers/{customer_id}/payment-intents")
+async def get_customer_payment_intents(customer_id: str):
+    """Get customer payment intents from the local mirror."""
+    return {"payment_intents": await run_in_threadpool(processor.get_customer_payment_intents, customer_id)}
+
+@app.get("/api/v1/customers/{customer_id}/subscriptions/stream")
+async def stream_customer_subscriptions(
+    customer_id: str,
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    page_size: int = Query(100, ge=1, le=100)
+):
+    """Stream all customer subscriptions from Stripe as NDJSON, one page at a time."""
+    async def lines():
+        try:
+            async for subscription in processor.iter_customer_subscriptions(
+                customer_id, status=status, limit=limit, page_size=page_size
+            ):
+                yield json.dumps(subscription) + "\n"
+        except (stripe.error.StripeError, StripeCallRejected) as e:
+            logger.error(f"Subscription stream failed: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
 @app.post("/api/v1/customers/{customer_id}/portal")
 async def create_portal_session(customer_id: str, return_url: str):
     """Create customer portal session."""
-    result = processor.create_portal_session(customer_id, return_url)
+    result = await processor.create_portal_session(customer_id, return_url)
     
     if result["success"]:
         return result
     else:
         raise HTTPException(status_code=400, detail=result["error"])
 
+PRICE_CATALOG_REFRESH_SECONDS = float(os.getenv('PRICE_CATALOG_REFRESH_SECONDS', 3600))
+# Retry interval while the catalog has never loaded
+PRICE_CATALOG_RETRY_SECONDS = 30
+# How long a subscription request waits for the first catalog load before a 503
+PRICE_CATALOG_WAIT_SECONDS = float(os.getenv('PRICE_CATALOG_WAIT_SECONDS', 5))
+price_catalog_loaded = asyncio.Event()
+
+async def sync_price_catalog():
+    try:
+        await processor.sync_price_catalog()
+        price_catalog_loaded.set()
+    except Exception as e:
+        logger.error(f"Price catalog sync failed: {e}")
+
+async def refresh_price_catalog():
+    """Load the catalog, then periodically re-sync it in case a price or product webhook was missed."""
+    # Import the Stripe SDK off the event loop so requests are served meanwhile
+    await asyncio.get_running_loop().run_in_executor(None, stripe.load)
+    await sync_price_catalog()
+    while True:
+        loaded = processor.catalog.loaded
+        await asyncio.sleep(PRICE_CATALOG_REFRESH_SECONDS if loaded else PRICE_CATALOG_RETRY_SECONDS)
+        await sync_price_catalog()
+
+@app.on_event("startup")
+async def start_webhook_workers():
+    """Start draining queued webhook events."""
+    # Coroutine handlers share this loop, and so the async processor's HTTP client
+    processor.webhooks.bind_loop(asyncio.get_running_loop())
+    webhook_queue.start()
+
+@app.on_event("startup")
+async def load_price_catalog():
+    """Index Stripe prices in the background so tier lookups never call Stripe.
+
+    Serving starts without waiting; subscription requests that arrive
+    before the first load wait for it (up to PRICE_CATALOG_WAIT_SECONDS).
+    """
+    app.state.price_catalog_refresh = asyncio.create_task(refresh_price_catalog())
+
+@app.on_event("shutdown")
+async def close_processor():
+    """Stop webhook workers and release pooled Stripe connections."""
+    app.state.price_catalog_refresh.cancel()
+    webhook_queue.stop()
+    await processor.aclose()
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
-    return {"status": "healthy", "service": "payment-api"}
+    """Health check endpoint; "degraded" while a Stripe circuit breaker is open or prices are not loaded."""
+    degraded = processor.breakers.any_open() or not processor.catalog.loaded
+    return {
+        "status": "degraded" if degraded else "healthy",
+        "service": "payment-api",
+        "stripe_http_pool": processor.http_pool_stats(),
+        "stripe_governor": processor.governor.stats(),
+        "stripe_retries": processor.retrier.stats(),
+        "stripe_circuit_breakers": processor.breakers.stats(),
+        "price_catalog": processor.catalog.stats(),
+    }
+
+# Spans hold request paths with customer/subscription IDs and exception messages
+@app.get("/api/v1/traces", dependencies=[Depends(require_webhook_admin)])
+async def recent_spans(
+    trace_id: Optional[str] = None,
+    min_duration_ms: float = 0,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """Recently finished spans from the in-process exporter, newest first."""
+    exporter = tracing.tracer.exporter
+    spans = exporter.find(trace_id, min_duration_ms, limit) if exporter else []
+    return {"spans": spans}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: Stripe call latency/outcomes, request latency and queue gauges."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
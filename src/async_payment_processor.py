@@ -0,0 +1,415 @@
+"""Async Stripe payment processor for use inside the FastAPI event loop."""
+import uuid
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from errors import StripeCallRejected
+from http_client import PoolConfig, PoolStats
+from lazy_modules import httpx, stripe
+from metrics import record_stripe_call
+from payment_processor import TRACED_METADATA_OPERATIONS, PaymentProcessor, sdk_attribute
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Stripe operations used by the processor: name -> (HTTP method, path, result class).
+# Classes are SDK names resolved on first use, so importing this module doesn't load stripe.
+OPERATIONS = {
+    "Customer.create": ("post", "/v1/customers", "Customer"),
+    "Customer.retrieve": ("get", "/v1/customers/{id}", "Customer"),
+    "Subscription.create": ("post", "/v1/subscriptions", "Subscription"),
+    "Subscription.retrieve": ("get", "/v1/subscriptions/{id}", "Subscription"),
+    "Subscription.modify": ("post", "/v1/subscriptions/{id}", "Subscription"),
+    "Subscription.delete": ("delete", "/v1/subscriptions/{id}", "Subscription"),
+    "Subscription.list": ("get", "/v1/subscriptions", "ListObject"),
+    "PaymentIntent.create": ("post", "/v1/payment_intents", "PaymentIntent"),
+    "Price.list": ("get", "/v1/prices", "ListObject"),
+    "billing_portal.Session.create": ("post", "/v1/billing_portal/sessions", "billing_portal.Session"),
+}
+
+
+def _encode_params(params: Dict, prefix: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """Flatten params into Stripe's bracketed form encoding."""
+    items = params.items() if isinstance(params, dict) else enumerate(params)
+    for key, value in items:
+        name = f"{prefix}[{key}]" if prefix else str(key)
+        if value is None:
+            continue
+        if isinstance(value, (dict, list, tuple)):
+            yield from _encode_params(value, name)
+        elif isinstance(value, bool):
+            yield name, "true" if value else "false"
+        else:
+            yield name, str(value)
+
+
+class AsyncPaymentProcessor(PaymentProcessor):
+    """Non-blocking variant of PaymentProcessor.
+
+    Stripe calls are awaitable and share one httpx.AsyncClient, so a single
+    event loop can keep many Stripe requests in flight. Webhook verification
+    and event handling are CPU-only and inherited unchanged.
+    """
+
+    def __init__(self, pool_config: PoolConfig = None):
+        super().__init__(pool_config)
+        self.async_http_stats = PoolStats(self.pool_config.max_connections)
+        # Created by the first _call, along with the headers every request sends
+        self._client = None
+        self._requestor = None
+        self._headers: Dict[str, str] = {}
+
+    def _open_client(self):
+        self._requestor = stripe.APIRequestor()
+        self._headers = {
+            "Authorization": f"Bearer {stripe.api_key}",
+            "Stripe-Version": stripe.api_version,
+        }
+        self._client = httpx.AsyncClient(base_url=stripe.api_base, **self.pool_config.client_kwargs())
+        return self._client
+
+    def http_pool_stats(self) -> Dict:
+        """Connection pool counters for both the sync and async clients."""
+        stats = super().http_pool_stats()
+        stats["async"] = self.async_http_stats.snapshot()
+        return stats
+
+    async def aclose(self):
+        """Close the underlying HTTP clients."""
+        if self._client is not None:
+            await self._client.aclose()
+        if self.http_client is not None:
+            self.http_client.close()
+
+    async def _call(self, operation: str, id: str = None, idempotency_key: str = None, **params) -> Any:
+        """Issue a Stripe API request and convert the response to Stripe objects.
+
+        Each attempt passes the resource's circuit breaker, holds a governor
+        slot and is bounded by the retrier's deadline; POSTs reuse one
+        idempotency key across retries. Created objects carry the trace
+        context in their metadata unless the caller supplied the key.
+        """
+        method, path, klass = OPERATIONS[operation]
+        klass = sdk_attribute(klass)
+        if id is not None:
+            path = path.format(id=id)
+
+        client = self._client or self._open_client()
+        headers = self._headers
+        if method == "post":
+            headers = {**headers, "Idempotency-Key": idempotency_key or str(uuid.uuid4())}
+
+        async def attempt():
+            request = client.build_request(
+                method,
+                path,
+                headers=headers,
+                timeout=self.pool_config.timeout_for_deadline(),
+                extensions={"trace": self.async_http_stats.atrace},
+                **request_kwargs,
+            )
+            self.breakers.check(operation)
+            async with self.governor.aslot(operation):
+                with self.breakers.guard(operation):
+                    try:
+                        with self.async_http_stats.track(), tracing.span(
+                            "stripe.http", tracing.CLIENT, **{"http.method": method.upper(), "http.url": path}
+                        ) as http_span:
+                            response = await client.send(request)
+                            http_span.set_attribute("http.status_code", response.status_code)
+                            http_span.set_attribute("stripe.request_id", response.headers.get("request-id"))
+                    except (httpx.TimeoutException, httpx.NetworkError) as e:
+                        raise stripe.error.APIConnectionError(
+                            f"Error communicating with Stripe: {e}", should_retry=True
+                        )
+                    except httpx.HTTPError as e:
+                        raise stripe.error.APIConnectionError(f"Error communicating with Stripe: {e}")
+
+                    with tracing.span("stripe.decode"):
+                        resp = self._requestor.interpret_response(
+                            response.text, response.status_code, response.headers
+                        )
+                        return klass.construct_from(resp.data, stripe.api_key, last_response=resp)
+
+        start = time.perf_counter()
+        outcome = "ok"
+        with tracing.span(f"stripe {operation}", tracing.CLIENT, **{"stripe.operation": operation}):
+            # A caller-supplied key may be re-sent later, so its params must not vary per call
+            if operation in TRACED_METADATA_OPERATIONS and not idempotency_key:
+                params["metadata"] = tracing.with_traceparent(params.get("metadata"))
+            encoded = list(_encode_params(params))
+            request_kwargs = {"data": dict(encoded)} if method == "post" else {"params": encoded}
+            try:
+                return await self.retrier.acall(operation, attempt)
+            except Exception as e:
+                outcome = type(e).__name__
+                raise
+            finally:
+                record_stripe_call(operation, outcome, time.perf_counter() - start)
+
+    async def create_customer(
+        self,
+        email: str,
+        name: str,
+        metadata: Dict = None,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
+        """Create Stripe customer."""
+        try:
+            customer = await self._call(
+                "Customer.create",
+                idempotency_key=idempotency_key,
+                email=email,
+                name=name,
+                metadata=metadata or {},
+            )
+            logger.info(f"Customer created: {customer.id}")
+            return {"success": True, "customer_id": customer.id, "customer": customer}
+        except stripe.error.StripeError as e:
+            logger.error(f"Customer creation failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def _create_batch_customer(self, index: int, item: Dict) -> Dict:
+        try:
+            result = await self.create_customer(
+                item["email"], item["name"], item.get("metadata"), item.get("idempotency_key")
+            )
+        except StripeCallRejected as e:
+            result = {"success": False, "error": str(e), "retry_after": e.retry_after}
+        except Exception as e:
+            logger.exception(f"Batch customer {index} failed: {e}")
+            result = {"success": False, "error": "Internal error"}
+        return self._batch_result(index, item, result)
+
+    async def create_customers(self, customers: List[Dict], concurrency: int = None) -> AsyncIterator[Dict]:
+        """Create many customers concurrently, yielding each item's result as it completes."""
+        pending = iter(enumerate(customers))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker():
+            for index, item in pending:
+                results.put_nowait(await self._create_batch_customer(index, item))
+
+        workers = [
+            asyncio.ensure_future(worker())
+            for _ in range(min(concurrency or self.batch_concurrency, len(customers)))
+        ]
+        try:
+            for _ in range(len(customers)):
+                yield await results.get()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def sync_price_catalog(self) -> int:
+        """Reload the price catalog from Stripe's active recurring prices."""
+        prices, starting_after = [], None
+        while True:
+            page = await self._call("Price.list", **self._price_list_params(starting_after))
+            prices.extend(page.data)
+            if not page.has_more or not page.data:
+                break
+            starting_after = page.data[-1].id
+        count = self.catalog.replace(prices)
+        logger.info(f"Price catalog synced: {count} prices")
+        return count
+
+    async def create_subscription(
+        self,
+        customer_id: str,
+        price_id: str,
+        trial_days: Optional[int] = None
+    ) -> Dict:
+        """Create subscription for customer."""
+        try:
+            params = {
+                "customer": customer_id,
+                "items": [{"price": price_id}],
+                "payment_behavior": "default_incomplete",
+                "expand": ["latest_invoice.payment_intent"],
+            }
+
+            if trial_days:
+                params["trial_period_days"] = trial_days
+
+            as_of = int(time.time())
+            subscription = await self._call("Subscription.create", **params)
+            self._record_subscription(subscription, as_of)
+
+            return {
+                "success": True,
+                "subscription_id": subscription.id,
+                "client_secret": subscription.latest_invoice.payment_intent.client_secret,
+                "status": subscription.status
+            }
+        except stripe.error.StripeError as e:
+            logger.error(f"Subscription creation failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def cancel_subscription(
+        self,
+        subscription_id: str,
+        immediate: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
+        """Cancel subscription."""
+        try:
+            as_of = int(time.time())
+            if immediate:
+                subscription = await self._call(
+                    "Subscription.delete", subscription_id, idempotency_key=idempotency_key
+                )
+            else:
+                subscription = await self._call(
+                    "Subscription.modify",
+                    subscription_id,
+                    cancel_at_period_end=True,
+                    idempotency_key=idempotency_key
+                )
+            self._record_subscription(subscription, as_of)
+
+            return {
+                "success": True,
+                "subscription_id": subscription.id,
+                "status": subscription.status,
+                "canceled_at": subscription.canceled_at
+            }
+        except stripe.error.StripeError as e:
+            logger.error(f"Subscription cancellation failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def update_subscription(
+        self,
+        subscription_id: str,
+        new_price_id: str,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
+        """Upgrade/downgrade subscription."""
+        try:
+            subscription = await self._call("Subscription.retrieve", subscription_id)
+
+            as_of = int(time.time())
+            updated = await self._call(
+                "Subscription.modify",
+                subscription_id,
+                items=[{
+                    "id": subscription['items'].data[0].id,
+                    "price": new_price_id,
+                }],
+                proration_behavior="create_prorations",
+                idempotency_key=idempotency_key
+            )
+            self._record_subscription(updated, as_of)
+
+            return {
+                "success": True,
+                "subscription_id": updated.id,
+                "status": updated.status
+            }
+        except stripe.error.StripeError as e:
+            logger.error(f"Subscription update failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def create_payment_intent(self, amount: int, currency: str = "usd", customer_id: str = None) -> Dict:
+        """Create one-time payment intent."""
+        try:
+            params = {
+                "amount": amount,
+                "currency": currency,
+                "automatic_payment_methods": {"enabled": True},
+            }
+
+            if customer_id:
+                params["customer"] = customer_id
+
+            intent = await self._call("PaymentIntent.create", **params)
+
+            return {
+                "success": True,
+                "client_secret": intent.client_secret,
+                "payment_intent_id": intent.id
+            }
+        except stripe.error.StripeError as e:
+            logger.error(f"Payment intent creation failed: {e}")
+            return {"success": False, "error": str(e)}
+
+    async def get_customer_subscriptions(self, customer_id: str) -> List[Dict]:
+        """Get all subscriptions for customer (mirror, seeded from Stripe on the first read)."""
+        mirrored = self._mirrored_subscriptions(customer_id, partial=not self.mirror_fallback)
+        if mirrored is not None:
+            return mirrored
+        try:
+            as_of = time.time()
+            listed = [s async for s in self.iter_customer_subscriptions(customer_id, status="all")]
+            return self._seed_subscriptions(customer_id, listed, as_of)
+        except stripe.error.StripeError as e:
+            logger.error(f"Failed to fetch subscriptions: {e}")
+            return []
+
+    async def iter_customer_subscriptions(
+        self,
+        customer_id: str,
+        status: Optional[str] = None,
+        limit: Optional[int] = None,
+        page_size: int = 100
+    ) -> AsyncIterator[Dict]:
+        """Lazily yield every subscription for customer, prefetching the next page."""
+        params = self._subscription_list_params(customer_id, status, limit, page_size)
+        yielded = 0
+        next_page = None
+        try:
+            page = await self._call("Subscription.list", **params)
+            while True:
+                next_page = None
+                if page.has_more and page.data and (limit is None or yielded + len(page.data) < limit):
+                    next_page = asyncio.ensure_future(
+                        self._call("Subscription.list", starting_after=page.data[-1].id, **params)
+                    )
+                for subscription in page.data:
+                    if limit is not None and yielded >= limit:
+                        return
+                    yield subscription
+                    yielded += 1
+                if next_page is None:
+                    return
+                page = await next_page
+        finally:
+            if next_page is not None and not next_page.done():
+                next_page.cancel()
+
+    async def get_customer(self, customer_id: str) -> Optional[Dict]:
+        """Get customer from the local mirror, falling back to Stripe."""
+        customer = self.mirror.get("customer", customer_id)
+        if customer is not None or not self.mirror_fallback:
+            return customer
+        try:
+            return await self._call("Customer.retrieve", customer_id)
+        except stripe.error.StripeError as e:
+            logger.error(f"Failed to fetch customer: {e}")
+            return None
+
+    async def get_subscription(self, subscription_id: str) -> Optional[Dict]:
+        """Get subscription from the local mirror, falling back to Stripe."""
+        subscription = self.mirror.get("subscription", subscription_id)
+        if subscription is not None or not self.mirror_fallback:
+            return subscription
+        try:
+            return await self._call("Subscription.retrieve", subscription_id)
+        except stripe.error.StripeError as e:
+            logger.error(f"Failed to fetch subscription: {e}")
+            return None
+
+    async def create_portal_session(self, customer_id: str, return_url: str) -> Dict:
+        """Create customer portal session for managing subscriptions."""
+        try:
+            session = await self._call(
+                "billing_portal.Session.create",
+                customer=customer_id,
+                return_url=return_url,
+            )
+            return {"success": True, "url": session.url}
+        except stripe.error.StripeError as e:
+            logger.error(f"Portal session creation failed: {e}")
+            return {"success": False, "error": str(e)}
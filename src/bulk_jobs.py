@@ -0,0 +1,429 @@
+"""Resumable bulk cancellation and price migration jobs over many subscriptions.
+
+A job pairs an action with a selector:
+
+  * cancel  - cancel_subscription, at period end or immediately
+  * migrate - update_subscription to a new price
+
+  * tier / price     - every live subscription on that price (a tier
+                       resolves through the price catalog)
+  * customers file   - every live subscription of the customer ids listed
+                       one per line
+
+Selection is checkpointed page by page into SQLite, then the selected
+subscriptions are worked through on a thread pool throttled to the job's
+rate (on top of the shared Stripe governor). Each outcome is recorded as it
+lands, so a crashed or interrupted job resumes where it stopped, and every
+item reuses one idempotency key until it fails, so a call in flight at the
+crash is never applied twice; failed items retried later get a new key.
+
+    python src/bulk_jobs.py create cancel --tier starter
+    python src/bulk_jobs.py create migrate --price price_old --to-price price_new --rate 20
+    python src/bulk_jobs.py run 3
+    python src/bulk_jobs.py status 3
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from errors import StripeCallRejected
+from payment_processor import PaymentProcessor, SubscriptionTier
+from rate_limit import TokenBucket
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("cancel", "migrate")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action TEXT NOT NULL,
+    selector TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'selecting',
+    selection_cursor TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS bulk_job_items (
+    job_id INTEGER NOT NULL,
+    subscription_id TEXT NOT NULL,
+    customer_id TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    completed_at REAL,
+    PRIMARY KEY (job_id, subscription_id)
+);
+CREATE INDEX IF NOT EXISTS idx_bulk_job_items_status ON bulk_job_items (job_id, status, subscription_id);
+CREATE INDEX IF NOT EXISTS idx_bulk_job_items_completed ON bulk_job_items (job_id, completed_at);
+"""
+
+# Pending items loaded from SQLite per query while a job runs
+ITEM_CHUNK = 500
+
+
+def read_customer_ids(path: str) -> List[str]:
+    """Customer ids from a file, one per line; blank lines and # comments are skipped."""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class BulkJobs:
+    """Creates, runs and reports on bulk subscription jobs stored in SQLite."""
+
+    def __init__(self, processor: PaymentProcessor = None, path: str = None):
+        self.processor = processor or PaymentProcessor()
+        self.path = path or os.getenv('BULK_JOBS_PATH', 'bulk_jobs.db')
+        self.db = SQLiteStore(self.path, SCHEMA)
+        self.default_workers = int(os.getenv('BULK_JOB_WORKERS', 8))
+        # Leaves most of the governor's write budget to live traffic
+        self.default_rate = float(os.getenv('BULK_JOB_RATE', 25))
+
+    # -- definition and selection -------------------------------------------
+
+    def price_for_tier(self, tier: str, currency: str = None, interval: str = None) -> str:
+        """Catalog price id for a tier (plan currency and interval unless given)."""
+        if not self.processor.catalog.loaded:
+            self.processor.sync_price_catalog()
+        price_id = self.processor.price_id_for(SubscriptionTier(tier), currency, interval)
+        if price_id is None:
+            raise ValueError(f"No active price for tier {tier}")
+        return price_id
+
+    def create(self, action: str, selector: Dict, params: Dict = None) -> int:
+        """Record a job and select its subscriptions. Returns the job id."""
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown bulk action: {action}")
+        if action == "migrate" and not (params or {}).get("price_id"):
+            raise ValueError("migrate jobs need a target price_id")
+        if len([key for key in ("tier", "price", "customers_file") if selector.get(key)]) != 1:
+            raise ValueError("Selector needs exactly one of tier, price or customers_file")
+        # Freeze tiers and customer lists now so a resumed job selects the same subscriptions
+        if selector.get("tier"):
+            selector = {"tier": selector["tier"], "price": self.price_for_tier(
+                selector["tier"], selector.get("currency"), selector.get("interval")
+            )}
+        elif selector.get("customers_file"):
+            selector = {"customers": read_customer_ids(selector["customers_file"])}
+
+        job_id = self.db.execute(
+            "INSERT INTO bulk_jobs (action, selector, params, created_at) VALUES (?, ?, ?, ?)",
+            (action, json.dumps(selector), json.dumps(params or {}), time.time()),
+        ).lastrowid
+        logger.info(f"Bulk job {job_id} created: {action} by {', '.join(selector)}")
+        self.select(job_id)
+        return job_id
+
+    def _job(self, job_id: int) -> Dict:
+        row = self.db.execute(
+            "SELECT action, selector, params, status, selection_cursor, created_at, started_at, finished_at "
+            "FROM bulk_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No such bulk job: {job_id}")
+        return {
+            "id": job_id,
+            "action": row[0],
+            "selector": json.loads(row[1]),
+            "params": json.loads(row[2]),
+            "status": row[3],
+            "selection_cursor": json.loads(row[4]) if row[4] else {},
+            "created_at": row[5],
+            "started_at": row[6],
+            "finished_at": row[7],
+        }
+
+    def _set_status(self, job_id: int, status: str, **columns):
+        assignments = "".join(f", {column} = ?" for column in columns)
+        self.db.execute(
+            f"UPDATE bulk_jobs SET status = ?{assignments} WHERE id = ?",
+            (status, *columns.values(), job_id),
+        )
+
+    def _pages(self, selector: Dict, cursor: Dict) -> Iterator[Tuple[List, Dict]]:
+        """(subscriptions, cursor after them) for each page the selector matches, from `cursor` on."""
+        if "customers" in selector:
+            customers = selector["customers"]
+            index = cursor.get("customer_index", 0)
+            starting_after = cursor.get("starting_after")
+            while index < len(customers):
+                page = self.processor.list_subscriptions_page(starting_after, customer=customers[index])
+                if page.has_more and page.data:
+                    starting_after = page.data[-1].id
+                else:
+                    index, starting_after = index + 1, None
+                yield page.data, {"customer_index": index, "starting_after": starting_after}
+        else:
+            price = selector["price"]
+            starting_after = cursor.get("starting_after")
+            while True:
+                page = self.processor.list_subscriptions_page(starting_after, price=price)
+                if not page.data:
+                    return
+                starting_after = page.data[-1].id
+                yield page.data, {"starting_after": starting_after}
+                if not page.has_more:
+                    return
+
+    def select(self, job_id: int) -> int:
+        """Enumerate the job's subscriptions, resuming from the last saved page. Returns the total."""
+        job = self._job(job_id)
+        if job["status"] == "selecting":
+            for subscriptions, cursor in self._pages(job["selector"], job["selection_cursor"]):
+                with self.db.transaction() as conn:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO bulk_job_items (job_id, subscription_id, customer_id) VALUES (?, ?, ?)",
+                        [(job_id, s.id, s.get("customer")) for s in subscriptions],
+                    )
+                    conn.execute(
+                        "UPDATE bulk_jobs SET selection_cursor = ? WHERE id = ?",
+                        (json.dumps(cursor), job_id),
+                    )
+            self._set_status(job_id, "ready")
+        total = self._counts(job_id)["total"]
+        logger.info(f"Bulk job {job_id} selected {total} subscriptions")
+        return total
+
+    # -- execution -----------------------------------------------------------
+
+    def _pending(self, job_id: int) -> Iterator[Tuple[str, int]]:
+        """(subscription id, finished attempts) of pending items in key order, read a chunk at a time."""
+        last = ""
+        while True:
+            rows = self.db.execute(
+                "SELECT subscription_id, attempts FROM bulk_job_items "
+                "WHERE job_id = ? AND status = 'pending' AND subscription_id > ? "
+                "ORDER BY subscription_id LIMIT ?",
+                (job_id, last, ITEM_CHUNK),
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def _apply(self, job: Dict, subscription_id: str, attempts: int = 0) -> Dict:
+        # Same key for in-run retries and resumes, so Stripe replays instead of re-applying. Stripe
+        # also caches failures for 24h, so an item put back by retry_failed() gets a fresh key.
+        key = f"bulk-job-{job['id']}-{subscription_id}"
+        if attempts:
+            key = f"{key}-retry-{attempts}"
+        if job["action"] == "cancel":
+            return self.processor.cancel_subscription(
+                subscription_id, immediate=job["params"].get("immediate", False), idempotency_key=key
+            )
+        return self.processor.update_subscription(subscription_id, job["params"]["price_id"], idempotency_key=key)
+
+    def _finish_item(self, job_id: int, subscription_id: str, error: Optional[str]):
+        self.db.execute(
+            "UPDATE bulk_job_items SET status = ?, error = ?, attempts = attempts + 1, completed_at = ? "
+            "WHERE job_id = ? AND subscription_id = ?",
+            ("failed" if error else "done", error, time.time(), job_id, subscription_id),
+        )
+
+    def run(
+        self,
+        job_id: int,
+        workers: int = None,
+        rate: float = None,
+        stop: threading.Event = None,
+        report_interval: float = 10.0,
+    ) -> Dict:
+        """Work through the job's pending subscriptions until done or `stop` is set.
+
+        Locally rejected calls (rate limiter, open circuit) are retried after
+        their Retry-After hint; Stripe errors mark the item failed. Returns
+        the final progress().
+        """
+        job = self._job(job_id)
+        if job["status"] == "selecting":
+            self.select(job_id)
+        stop = stop or threading.Event()
+        workers = workers or self.default_workers
+        bucket = TokenBucket(rate or self.default_rate, capacity=1)
+        bucket_lock = threading.Lock()
+        items = self._pending(job_id)
+        items_lock = threading.Lock()
+        self._set_status(job_id, "running", started_at=time.time(), finished_at=None)
+
+        def throttle() -> bool:
+            """Wait for the job's next token; False if stopped meanwhile."""
+            while not stop.is_set():
+                with bucket_lock:
+                    delay = bucket.take(time.monotonic())
+                if not delay:
+                    return True
+                stop.wait(delay)
+            return False
+
+        def worker():
+            while not stop.is_set():
+                with items_lock:
+                    subscription_id, attempts = next(items, (None, 0))
+                if subscription_id is None:
+                    return
+                # An item left unfinished by a stop stays pending for the next run
+                while throttle():
+                    try:
+                        result = self._apply(job, subscription_id, attempts)
+                    except StripeCallRejected as e:
+                        stop.wait(e.retry_after)
+                        continue
+                    except Exception as e:
+                        logger.exception(f"Bulk job {job_id} item {subscription_id} failed: {e}")
+                        result = {"success": False, "error": str(e)}
+                    self._finish_item(job_id, subscription_id, None if result["success"] else result["error"])
+                    break
+
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"bulk-job-{job_id}")
+        futures = [pool.submit(worker) for _ in range(workers)]
+        next_report = time.monotonic() + report_interval
+        try:
+            while not all(future.done() for future in futures):
+                time.sleep(0.2)
+                if time.monotonic() >= next_report:
+                    self._log_progress(job_id)
+                    next_report += report_interval
+        except KeyboardInterrupt:
+            logger.warning(f"Bulk job {job_id} interrupted; finishing in-flight items")
+            stop.set()
+        finally:
+            pool.shutdown(wait=True)
+
+        if self._counts(job_id).get("pending", 0) == 0:
+            self._set_status(job_id, "completed", finished_at=time.time())
+        else:
+            self._set_status(job_id, "paused", finished_at=time.time())
+        progress = self.progress(job_id)
+        self._log_progress(job_id, progress)
+        return progress
+
+    def retry_failed(self, job_id: int) -> int:
+        """Put failed items back to pending for the next run. Returns how many."""
+        return self.db.execute(
+            "UPDATE bulk_job_items SET status = 'pending' WHERE job_id = ? AND status = 'failed'",
+            (job_id,),
+        ).rowcount
+
+    # -- reporting -----------------------------------------------------------
+
+    def _counts(self, job_id: int) -> Dict:
+        counts = dict(self.db.execute(
+            "SELECT status, COUNT(*) FROM bulk_job_items WHERE job_id = ? GROUP BY status",
+            (job_id,),
+        ).fetchall())
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def progress(self, job_id: int, window: float = 60.0) -> Dict:
+        """Counts, recent throughput and ETA, readable from any process while the job runs."""
+        job = self._job(job_id)
+        counts = self._counts(job_id)
+        # Rate over the last `window` seconds of the current or most recent run
+        end = job["finished_at"] or time.time()
+        throughput = 0.0
+        if job["started_at"]:
+            since = max(job["started_at"], end - window)
+            recent = self.db.execute(
+                "SELECT COUNT(*) FROM bulk_job_items WHERE job_id = ? AND completed_at BETWEEN ? AND ?",
+                (job_id, since, end),
+            ).fetchone()[0]
+            throughput = recent / max(end - since, 1e-9)
+        pending = counts.get("pending", 0)
+        return {
+            "job_id": job_id,
+            "action": job["action"],
+            "status": job["status"],
+            "total": counts["total"],
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": pending,
+            "throughput_per_second": round(throughput, 2),
+            "eta_seconds": round(pending / throughput, 1) if throughput and job["status"] == "running" else None,
+            "elapsed_seconds": round(end - job["started_at"], 1) if job["started_at"] else 0.0,
+        }
+
+    def _log_progress(self, job_id: int, progress: Dict = None):
+        p = progress or self.progress(job_id)
+        eta = f"{p['eta_seconds']}s" if p["eta_seconds"] is not None else "n/a"
+        logger.info(
+            f"Bulk job {job_id} {p['status']}: {p['done'] + p['failed']}/{p['total']} "
+            f"({p['failed']} failed), {p['throughput_per_second']}/s, ETA {eta}"
+        )
+
+    def failures(self, job_id: int, limit: int = 100) -> List[Dict]:
+        rows = self.db.execute(
+            "SELECT subscription_id, customer_id, attempts, error FROM bulk_job_items "
+            "WHERE job_id = ? AND status = 'failed' ORDER BY subscription_id LIMIT ?",
+            (job_id, limit),
+        ).fetchall()
+        return [
+            {"subscription_id": row[0], "customer_id": row[1], "attempts": row[2], "error": row[3]}
+            for row in rows
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk subscription cancellation and migration jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="define a job and select its subscriptions")
+    create.add_argument("action", choices=ACTIONS)
+    selector = create.add_mutually_exclusive_group(required=True)
+    selector.add_argument("--tier", help="subscriptions on this tier's price")
+    selector.add_argument("--price", help="subscriptions on this price id")
+    selector.add_argument("--customers-file", help="file of customer ids, one per line")
+    target = create.add_mutually_exclusive_group()
+    target.add_argument("--to-tier", help="migrate: target tier")
+    target.add_argument("--to-price", help="migrate: target price id")
+    create.add_argument("--currency", help="currency of the --tier/--to-tier price (default: the plan's)")
+    create.add_argument("--interval", help="interval of the --tier/--to-tier price (default: the plan's)")
+    create.add_argument("--immediate", action="store_true", help="cancel: now instead of at period end")
+    create.add_argument("--run", action="store_true", help="start running right after selection")
+
+    for name, help in (("run", "run or resume a job"), ("status", "show progress and failures")):
+        command = commands.add_parser(name, help=help)
+        command.add_argument("job_id", type=int)
+    for command in (create, commands.choices["run"]):
+        command.add_argument("--workers", type=int)
+        command.add_argument("--rate", type=float, help="operations per second")
+    commands.choices["run"].add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "create" and args.action == "migrate" and not (args.to_tier or args.to_price):
+        parser.error("migrate needs --to-tier or --to-price")
+    jobs = BulkJobs()
+    if args.command == "create":
+        params = {"immediate": args.immediate} if args.action == "cancel" else {
+            "price_id": args.to_price or jobs.price_for_tier(args.to_tier, args.currency, args.interval)
+        }
+        selection = {
+            "tier": args.tier, "price": args.price, "customers_file": args.customers_file,
+            "currency": args.currency, "interval": args.interval,
+        }
+        job_id = jobs.create(args.action, {k: v for k, v in selection.items() if v}, params)
+        print(json.dumps(jobs.progress(job_id), indent=2))
+        if not args.run:
+            return
+    else:
+        job_id = args.job_id
+
+    if args.command == "status":
+        print(json.dumps({**jobs.progress(job_id), "failures": jobs.failures(job_id)}, indent=2))
+        return
+    if getattr(args, "retry_failed", False):
+        logger.info(f"Retrying {jobs.retry_failed(job_id)} failed items")
+    print(json.dumps(jobs.run(job_id, args.workers, args.rate), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Provision PricingPlan.PLANS into Stripe products and prices, changing only what differs.
+
+Each tier is one product tagged `metadata.tier` and one active recurring
+price carrying the lookup key `<tier>_<currency>_<interval>`. A sync reads
+the current products and the prices behind those lookup keys in a couple
+of list calls, then works out a plan:
+
+  * create the product if the tier has none, or rename/re-describe it
+  * create the price if no price holds the lookup key
+  * if the price under the key no longer matches the plan (amount,
+    currency, interval or product), create a new one with
+    transfer_lookup_key and archive the old one; Stripe prices are
+    immutable, so this is how a price changes
+  * with prune, archive products (and their prices) for tiers removed
+    from the plans
+
+Tiers are applied in parallel; steps within a tier run in order. Writes
+use idempotency keys derived from their content, so re-running a deploy
+that died half-way never creates duplicates.
+
+    python src/catalog_sync.py --dry-run
+    python src/catalog_sync.py --prune
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from payment_processor import PaymentProcessor, PricingPlan
+from price_catalog import lookup_key
+
+logger = logging.getLogger(__name__)
+
+# Stripe accepts at most 10 lookup keys per Price.list call
+LOOKUP_KEYS_PER_LIST = 10
+
+
+def desired_catalog() -> Dict[str, Dict]:
+    """Product and price spec per tier, from PricingPlan.PLANS."""
+    desired = {}
+    for tier, plan in PricingPlan.PLANS.items():
+        desired[tier.value] = {
+            "name": plan["name"],
+            "description": ", ".join(plan["features"]),
+            "lookup_key": lookup_key(tier.value, plan["currency"], plan["interval"]),
+            "unit_amount": plan["price"],
+            "currency": plan["currency"],
+            "interval": plan["interval"],
+        }
+    return desired
+
+
+def _idempotency_key(action: str, spec: Dict) -> str:
+    digest = hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:32]
+    return f"catalog-sync-{action}-{digest}"
+
+
+def _product_id(price: Dict) -> Optional[str]:
+    product = price.get("product")
+    return product.get("id") if isinstance(product, dict) else product
+
+
+class CatalogSync:
+    """Diffs the local plans against Stripe and applies the difference."""
+
+    def __init__(self, processor: PaymentProcessor = None, workers: int = None):
+        self.processor = processor or PaymentProcessor()
+        self.workers = workers or int(os.getenv('CATALOG_SYNC_WORKERS', 8))
+
+    def _list_all(self, operation: str, **params) -> List[Any]:
+        items, starting_after = [], None
+        while True:
+            page = self.processor._call(operation, limit=100, starting_after=starting_after, **params)
+            items.extend(page.data)
+            if not page.has_more or not page.data:
+                return items
+            starting_after = page.data[-1].id
+
+    def current_state(self, desired: Dict[str, Dict]) -> Dict:
+        """Active tier products by tier, and prices by lookup key."""
+        products: Dict[str, Dict] = {}
+        for product in self._list_all("Product.list", active=True):
+            tier = (product.get("metadata") or {}).get("tier")
+            # Keep the oldest product per tier if duplicates exist
+            if tier and (tier not in products or product["created"] < products[tier]["created"]):
+                products[tier] = product
+        keys = [spec["lookup_key"] for spec in desired.values()]
+        prices: Dict[str, Dict] = {}
+        for i in range(0, len(keys), LOOKUP_KEYS_PER_LIST):
+            for price in self._list_all("Price.list", lookup_keys=keys[i:i + LOOKUP_KEYS_PER_LIST]):
+                prices[price["lookup_key"]] = price
+        return {"products": products, "prices": prices}
+
+    def plan(self, prune: bool = False) -> Dict[str, List[Dict]]:
+        """Per-tier list of steps needed to match PricingPlan.PLANS; empty when in sync."""
+        desired = desired_catalog()
+        current = self.current_state(desired)
+        steps: Dict[str, List[Dict]] = {}
+        for tier, spec in desired.items():
+            product = current["products"].get(tier)
+            price = current["prices"].get(spec["lookup_key"])
+            tier_steps = []
+            if product is None:
+                tier_steps.append({"action": "create_product"})
+            elif (product.get("name"), product.get("description")) != (spec["name"], spec["description"]):
+                tier_steps.append({"action": "update_product", "product": product["id"]})
+            product_id = product["id"] if product else None
+            if price is None:
+                tier_steps.append({"action": "create_price", "product": product_id})
+            elif not price.get("active") or self._price_differs(price, spec, product):
+                tier_steps.append({"action": "create_price", "product": product_id, "replaces": price["id"]})
+                if price.get("active"):
+                    tier_steps.append({"action": "archive_price", "price": price["id"]})
+            if tier_steps:
+                steps[tier] = tier_steps
+        if prune:
+            for tier, product in current["products"].items():
+                if tier not in desired:
+                    steps[tier] = [{"action": "archive_product", "product": product["id"]}]
+        return steps
+
+    @staticmethod
+    def _price_differs(price: Dict, spec: Dict, product: Optional[Dict]) -> bool:
+        return (
+            price.get("unit_amount") != spec["unit_amount"]
+            or price.get("currency") != spec["currency"]
+            or (price.get("recurring") or {}).get("interval") != spec["interval"]
+            or product is None
+            or _product_id(price) != product["id"]
+        )
+
+    def _apply_tier(self, tier: str, steps: List[Dict], spec: Optional[Dict]) -> List[str]:
+        """Run one tier's steps in order; returns a line per change made."""
+        done = []
+        product_id = None
+        for step in steps:
+            action = step["action"]
+            if action == "create_product":
+                fields = {"name": spec["name"], "description": spec["description"], "metadata": {"tier": tier}}
+                product_id = self.processor._call(
+                    "Product.create", idempotency_key=_idempotency_key(action, fields), **fields
+                ).id
+                done.append(f"created product {product_id}")
+            elif action == "update_product":
+                self.processor._call(
+                    "Product.modify", step["product"], name=spec["name"], description=spec["description"]
+                )
+                done.append(f"updated product {step['product']}")
+            elif action == "create_price":
+                fields = {
+                    "product": step["product"] or product_id,
+                    "unit_amount": spec["unit_amount"],
+                    "currency": spec["currency"],
+                    "recurring": {"interval": spec["interval"]},
+                    "lookup_key": spec["lookup_key"],
+                    "transfer_lookup_key": "replaces" in step,
+                    "metadata": {"tier": tier},
+                }
+                # Include the replaced price so reverting to an earlier spec gets a fresh key
+                key = _idempotency_key(action, {**fields, "replaces": step.get("replaces")})
+                price_id = self.processor._call("Price.create", idempotency_key=key, **fields).id
+                done.append(f"created price {price_id} ({spec['lookup_key']})")
+            elif action == "archive_price":
+                self.processor._call("Price.modify", step["price"], active=False)
+                done.append(f"archived price {step['price']}")
+            elif action == "archive_product":
+                for price in self._list_all("Price.list", product=step["product"], active=True):
+                    self.processor._call("Price.modify", price.id, active=False)
+                    done.append(f"archived price {price.id}")
+                self.processor._call("Product.modify", step["product"], active=False)
+                done.append(f"archived product {step['product']}")
+        return done
+
+    def sync(self, dry_run: bool = False, prune: bool = False) -> Dict:
+        """Plan and, unless dry_run, apply the changes. Returns the plan and what was done per tier."""
+        steps = self.plan(prune)
+        result = {"in_sync": not steps, "plan": steps, "applied": {}, "errors": {}}
+        if dry_run or not steps:
+            return result
+
+        desired = desired_catalog()
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(steps))) as pool:
+            futures = {
+                tier: pool.submit(self._apply_tier, tier, tier_steps, desired.get(tier))
+                for tier, tier_steps in steps.items()
+            }
+            for tier, future in futures.items():
+                try:
+                    result["applied"][tier] = future.result()
+                except Exception as e:
+                    logger.error(f"Catalog sync failed for tier {tier}: {e}")
+                    result["errors"][tier] = str(e)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync PricingPlan.PLANS into Stripe products and prices")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without changing Stripe")
+    parser.add_argument("--prune", action="store_true", help="archive products for tiers no longer in the plans")
+    parser.add_argument("--workers", type=int, help="tiers applied in parallel")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    syncer = CatalogSync(workers=args.workers)
+    result = syncer.sync(dry_run=args.dry_run, prune=args.prune)
+    if not args.dry_run:
+        # Confirm every plan now resolves the way the API will resolve it
+        syncer.processor.sync_price_catalog()
+        result["missing_prices"] = ["/".join(key) for key in syncer.processor.catalog.missing()]
+    print(json.dumps(result, indent=2))
+    if result["errors"] or result.get("missing_prices"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
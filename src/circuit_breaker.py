@@ -0,0 +1,200 @@
+"""Per-resource circuit breakers around Stripe API calls."""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+from errors import CircuitOpenError
+from lazy_modules import stripe
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_failure(error: Exception) -> bool:
+    """Errors that indicate Stripe degradation rather than a bad request."""
+    if isinstance(error, stripe.error.APIConnectionError):
+        return True
+    status = getattr(error, "http_status", None)
+    return status is not None and (status >= 500 or status == 429)
+
+
+def resource_for(operation: str) -> str:
+    """Breaker name for an operation: "Customer.create" -> "Customer"."""
+    if operation.startswith("billing_portal."):
+        return "billing_portal"
+    return operation.split(".", 1)[0]
+
+
+class CircuitBreaker:
+    """Count-based sliding-window breaker with failure-rate and slow-call thresholds.
+
+    Opens when, over the last `window` calls (once `min_calls` have been
+    seen), the failure rate or the share of calls slower than
+    `slow_call_seconds` crosses its threshold. After `open_seconds` it
+    admits `half_open_probes` trial calls; all must succeed to close.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = None,
+        slow_call_seconds: float = None,
+        slow_call_rate: float = None,
+        window: int = None,
+        min_calls: int = None,
+        open_seconds: float = None,
+        half_open_probes: int = None,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate or float(os.getenv('STRIPE_BREAKER_FAILURE_RATE', 0.5))
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('STRIPE_BREAKER_SLOW_CALL_SECONDS', 5.0))
+        self.slow_call_rate = slow_call_rate or float(os.getenv('STRIPE_BREAKER_SLOW_CALL_RATE', 0.8))
+        self.min_calls = min_calls or int(os.getenv('STRIPE_BREAKER_MIN_CALLS', 10))
+        self.open_seconds = open_seconds or float(os.getenv('STRIPE_BREAKER_OPEN_SECONDS', 30))
+        self.half_open_probes = half_open_probes or int(os.getenv('STRIPE_BREAKER_HALF_OPEN_PROBES', 3))
+        self._calls = deque(maxlen=window or int(os.getenv('STRIPE_BREAKER_WINDOW', 50)))
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _retry_after(self, now: float) -> float:
+        return max(self._opened_at + self.open_seconds - now, 1.0)
+
+    def _reject(self, now: float):
+        self.rejected += 1
+        raise CircuitOpenError(
+            f"Stripe {self.name} circuit is open; failing fast",
+            retry_after=self._retry_after(now),
+        )
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.times_opened += 1
+
+    def check(self):
+        """Fail fast if open, without claiming a half-open probe slot."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now < self._opened_at + self.open_seconds:
+                self._reject(now)
+
+    def before_call(self) -> bool:
+        """Admit a call or raise CircuitOpenError. Returns True if it is a half-open probe."""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN:
+                if now < self._opened_at + self.open_seconds:
+                    self._reject(now)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self._reject(now)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def record(self, probe: bool, failed: bool, duration: float):
+        """Record the outcome of an admitted call."""
+        now = time.monotonic()
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            if probe:
+                if self.state != HALF_OPEN:
+                    return
+                self._probes_in_flight -= 1
+                if failed or slow:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self.state = CLOSED
+                return
+
+            if self.state != CLOSED:
+                return
+            self._calls.append((failed, slow))
+            if len(self._calls) >= self.min_calls:
+                failures = sum(1 for f, _ in self._calls if f)
+                slow_calls = sum(1 for _, s in self._calls if s)
+                if (failures / len(self._calls) >= self.failure_rate
+                        or slow_calls / len(self._calls) >= self.slow_call_rate):
+                    self._open(now)
+
+    def abandon(self, probe: bool):
+        """Release an admitted call that never reached Stripe."""
+        if probe:
+            with self._lock:
+                if self.state == HALF_OPEN:
+                    self._probes_in_flight -= 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for f, _ in self._calls if f)
+            slow_calls = sum(1 for _, s in self._calls if s)
+            snapshot = {
+                "state": self.state,
+                "window_calls": calls,
+                "failure_rate": failures / calls if calls else 0.0,
+                "slow_call_rate": slow_calls / calls if calls else 0.0,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+            if self.state == OPEN:
+                snapshot["retry_after_seconds"] = round(self._retry_after(time.monotonic()), 1)
+            return snapshot
+
+
+class BreakerRegistry:
+    """One CircuitBreaker per Stripe resource, created on first use."""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def for_operation(self, operation: str) -> CircuitBreaker:
+        name = resource_for(operation)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name))
+        return breaker
+
+    def check(self, operation: str):
+        """Fail fast if the operation's breaker is open."""
+        self.for_operation(operation).check()
+
+    @contextmanager
+    def guard(self, operation: str):
+        """Admit, time and record one attempt against Stripe."""
+        breaker = self.for_operation(operation)
+        probe = breaker.before_call()
+        start = time.monotonic()
+        try:
+            yield
+        except stripe.error.StripeError as e:
+            breaker.record(probe, is_failure(e), time.monotonic() - start)
+            raise
+        except BaseException:
+            breaker.abandon(probe)
+            raise
+        else:
+            breaker.record(probe, False, time.monotonic() - start)
+
+    def any_open(self) -> bool:
+        return any(b.state == OPEN for b in list(self._breakers.values()))
+
+    def stats(self) -> Dict:
+        return {name: breaker.snapshot() for name, breaker in list(self._breakers.items())}
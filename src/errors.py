@@ -0,0 +1,23 @@
+"""Errors raised when a Stripe call is refused locally, before reaching Stripe."""
+
+
+class StripeCallRejected(Exception):
+    """Base for local fast-fail rejections; the API maps these to HTTP errors."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitExceeded(StripeCallRejected):
+    """The client-side rate limiter could not grant a slot within the wait budget."""
+
+    status_code = 429
+
+
+class CircuitOpenError(StripeCallRejected):
+    """The circuit breaker for this Stripe resource is open; the call was not attempted."""
+
+    status_code = 503
@@ -0,0 +1,238 @@
+"""Backfill missed webhooks from the Stripe Events API.
+
+Walks stripe.Event.list from a persisted cursor up to now and feeds every
+event the dedup index has not seen through the webhook handlers, so an
+outage of the webhook endpoint costs minutes of catch-up instead of lost
+events.
+
+The range is split into `window` second slices that are listed in
+parallel (`created[gte]`/`created[lt]`, paging within a slice), and the
+events of each page are handled on a bounded pool, grouped by type through
+PaymentProcessor.handle_webhook_events so batch handlers and one-transaction
+mirror/dedup writes apply as for queued webhooks. The cursor only
+advances over the contiguous run of finished slices, so an interrupted
+backfill resumes without gaps; re-listed events are skipped by the dedup
+index. Each run also re-reads `overlap` seconds before the cursor to pick
+up events that became visible late. Events whose handlers fail are put on
+the webhook queue, where the dead-letter redrive retries them.
+
+    python src/event_backfill.py run --since-hours 24
+    python src/event_backfill.py follow --interval 60
+    python src/event_backfill.py status
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from payment_processor import PaymentProcessor
+from sqlite_store import SQLiteStore
+from webhook_queue import WebhookQueue
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS event_backfill_cursor (
+    name TEXT PRIMARY KEY,
+    cursor INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+# Stripe keeps events for 30 days
+MAX_LOOKBACK = 30 * 86400
+
+
+class EventBackfill:
+    """Replays Stripe events newer than a persisted cursor through the webhook handlers."""
+
+    def __init__(
+        self,
+        processor: PaymentProcessor = None,
+        path: str = None,
+        queue: WebhookQueue = None,
+        name: str = "default",
+    ):
+        self.processor = processor or PaymentProcessor()
+        self.path = path or os.getenv('EVENT_BACKFILL_PATH', 'event_backfill.db')
+        self.db = SQLiteStore(self.path, SCHEMA)
+        # Only enqueued to; the API's workers drain it
+        self.queue = queue or WebhookQueue(self.processor.handle_webhook_event)
+        self.name = name
+        self.fetch_workers = int(os.getenv('EVENT_BACKFILL_FETCH_WORKERS', 8))
+        self.workers = int(os.getenv('EVENT_BACKFILL_WORKERS', 16))
+        self.window = int(os.getenv('EVENT_BACKFILL_WINDOW', 3600))
+        self.overlap = int(os.getenv('EVENT_BACKFILL_OVERLAP', 300))
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    def cursor(self) -> Optional[int]:
+        """Created timestamp up to which every event has been handled."""
+        row = self.db.execute(
+            "SELECT cursor FROM event_backfill_cursor WHERE name = ?", (self.name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _save_cursor(self, cursor: int):
+        self.db.execute(
+            """
+            INSERT INTO event_backfill_cursor (name, cursor, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET cursor = excluded.cursor, updated_at = excluded.updated_at
+            WHERE excluded.cursor > event_backfill_cursor.cursor
+            """,
+            (self.name, cursor, time.time()),
+        )
+
+    def status(self) -> Dict:
+        """Cursor position and how far it trails now."""
+        cursor = self.cursor()
+        return {
+            "cursor": cursor,
+            "lag_seconds": round(time.time() - cursor) if cursor else None,
+        }
+
+    def _count(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self._counts[key] = self._counts.get(key, 0) + value
+
+    def _handle(self, events: List[Dict]):
+        """Handle events of one type; failures go to the webhook queue for redrive."""
+        try:
+            results = self.processor.handle_webhook_events(events)
+        except Exception as e:
+            results = [{"success": False, "error": str(e)}] * len(events)
+        failed = [event for event, result in zip(events, results) if not result.get("success")]
+        for event in failed:
+            self.queue.enqueue(event['id'], event['type'], json.dumps(event))
+        if failed:
+            logger.error(f"{len(failed)} backfilled {events[0]['type']} events failed, queued for redrive")
+        self._count(processed=len(events) - len(failed), failed=len(failed))
+
+    def _backfill_window(self, start: int, end: int, handlers: ThreadPoolExecutor):
+        """List and handle every event created in [start, end), one page at a time."""
+        starting_after = None
+        while True:
+            page = self.processor._call(
+                "Event.list", created={"gte": start, "lt": end}, limit=100, starting_after=starting_after
+            )
+            events = [event.to_dict_recursive() for event in page.data]
+            known = self.processor.deduplicator.known([event['id'] for event in events])
+            fresh = [event for event in events if event['id'] not in known]
+            self._count(pages=1, listed=len(events), skipped=len(events) - len(fresh))
+            by_type: Dict[str, List[Dict]] = {}
+            for event in fresh:
+                by_type.setdefault(event['type'], []).append(event)
+            wait([handlers.submit(self._handle, group) for group in by_type.values()])
+            if not page.has_more or not events:
+                return
+            starting_after = events[-1]['id']
+
+    def _windows(self, start: int, end: int, window: int) -> List[Tuple[int, int]]:
+        return [(t, min(t + window, end)) for t in range(start, end, window)]
+
+    def run(
+        self,
+        since: int = None,
+        until: int = None,
+        fetch_workers: int = None,
+        workers: int = None,
+        window: int = None,
+    ) -> Dict:
+        """Backfill from `since` (default: cursor minus the overlap) to `until` (default: now)."""
+        now = int(time.time())
+        end = until or now
+        cursor = self.cursor()
+        if since is None:
+            if cursor is None:
+                raise ValueError("No saved cursor; pass since for the first run")
+            since = cursor - self.overlap
+        since = max(since, now - MAX_LOOKBACK)
+        windows = self._windows(since, end, window or self.window)
+        self._counts = {}
+        started = time.monotonic()
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as handlers, \
+                ThreadPoolExecutor(max_workers=fetch_workers or self.fetch_workers) as fetchers:
+            futures = [fetchers.submit(self._backfill_window, start, stop, handlers) for start, stop in windows]
+            advancing = True
+            for (start, stop), future in zip(windows, futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Backfill of events created {start}-{stop} failed: {e}")
+                    errors.append({"start": start, "end": stop, "error": str(e)})
+                    # Later windows still run, but the cursor must not skip this one
+                    advancing = False
+                if advancing:
+                    self._save_cursor(stop)
+                    logger.info(f"Backfilled to {stop}; lag {now - stop}s, {self._counts}")
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            **self.status(),
+            "since": since,
+            "until": end,
+            "windows": len(windows),
+            "pages": counts.get("pages", 0),
+            "listed": counts.get("listed", 0),
+            "skipped_known": counts.get("skipped", 0),
+            "processed": counts.get("processed", 0),
+            "failed_queued": counts.get("failed", 0),
+            "events_per_second": round(counts.get("listed", 0) / elapsed, 1) if elapsed else 0.0,
+            "elapsed_seconds": round(elapsed, 2),
+            "errors": errors,
+        }
+
+    def follow(self, interval: float = 60.0, since: int = None, stop: threading.Event = None, **options):
+        """Gap-fill until stopped: a run every `interval` seconds, continuing from the saved cursor."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            result = self.run(since=since, **options)
+            since = None
+            logger.info(f"Backfill pass: {result['processed']} processed, lag {result['lag_seconds']}s")
+            stop.wait(interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill missed webhooks from the Stripe Events API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="one pass from the cursor (or --since) to now")
+    follow = commands.add_parser("follow", help="a pass every --interval seconds")
+    follow.add_argument("--interval", type=float, default=60.0)
+    commands.add_parser("status", help="show the cursor and lag")
+    run.add_argument("--until", type=int, help="unix timestamp to stop at (default now)")
+    for command in (run, follow):
+        since = command.add_mutually_exclusive_group()
+        since.add_argument("--since", type=int, help="unix timestamp to start from")
+        since.add_argument("--since-hours", type=float, help="start this many hours ago")
+        command.add_argument("--fetch-workers", type=int, help="time windows listed in parallel")
+        command.add_argument("--workers", type=int, help="events handled in parallel")
+        command.add_argument("--window", type=int, help="seconds of events per listing window")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backfill = EventBackfill()
+    if args.command == "status":
+        print(json.dumps(backfill.status(), indent=2))
+        return
+    since = args.since or (int(time.time() - args.since_hours * 3600) if args.since_hours else None)
+    options = {"since": since, "fetch_workers": args.fetch_workers, "workers": args.workers, "window": args.window}
+    if args.command == "follow":
+        backfill.follow(args.interval, **options)
+        return
+    result = backfill.run(until=args.until, **options)
+    print(json.dumps(result, indent=2))
+    if result["errors"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
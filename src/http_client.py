@@ -0,0 +1,133 @@
+"""Pool settings and counters for the Stripe HTTP clients."""
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+from lazy_modules import httpx, stripe
+from retry import time_remaining
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class PoolConfig:
+    """Connection pool settings, overridable through STRIPE_HTTP_* env vars."""
+
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        http2: bool = True,
+    ):
+        self.max_connections = max_connections
+        # httpcore scans every pooled connection per queued request, so very large
+        # idle pools cost more CPU than the handshakes they save
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+
+    @classmethod
+    def from_env(cls) -> "PoolConfig":
+        """Build config from environment variables, falling back to defaults."""
+        return cls(
+            max_connections=int(os.getenv('STRIPE_HTTP_MAX_CONNECTIONS', 100)),
+            max_keepalive_connections=int(os.getenv('STRIPE_HTTP_MAX_KEEPALIVE', 20)),
+            keepalive_expiry=float(os.getenv('STRIPE_HTTP_KEEPALIVE_EXPIRY', 30.0)),
+            connect_timeout=float(os.getenv('STRIPE_HTTP_CONNECT_TIMEOUT', 5.0)),
+            read_timeout=float(os.getenv('STRIPE_HTTP_READ_TIMEOUT', 30.0)),
+            http2=os.getenv('STRIPE_HTTP2', 'true').lower() == 'true',
+        )
+
+    def client_kwargs(self) -> Dict:
+        """Keyword arguments shared by httpx.Client and httpx.AsyncClient."""
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            "http2": self.http2,
+            "verify": stripe.ca_bundle_path,
+        }
+
+
+    def timeout_for_deadline(self):
+        """Per-request timeout capped to the current call deadline, if any."""
+        remaining = time_remaining()
+        if remaining is None:
+            return httpx.USE_CLIENT_DEFAULT
+        if remaining <= 0:
+            raise stripe.error.APIConnectionError("Stripe call deadline exceeded")
+        return httpx.Timeout(
+            min(self.read_timeout, remaining),
+            connect=min(self.connect_timeout, remaining),
+        )
+
+
+class PoolStats:
+    """Request, connection-reuse and saturation counters for one pool."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated_requests = 0
+
+    @contextmanager
+    def track(self):
+        """Count one request for the duration of the block."""
+        with self._lock:
+            self.requests += 1
+            if self.in_flight >= self.max_connections:
+                self.saturated_requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def trace(self, event_name: str, info: Dict):
+        """httpcore trace hook; only new connections are of interest."""
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    async def atrace(self, event_name: str, info: Dict):
+        """Async variant of trace() for httpx.AsyncClient."""
+        self.trace(event_name, info)
+
+    def snapshot(self) -> Dict:
+        """Current counters plus derived reuse/saturation ratios."""
+        with self._lock:
+            requests = self.requests
+            reused = max(requests - self.connections_opened, 0)
+            return {
+                "max_connections": self.max_connections,
+                "requests": requests,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "connection_reuse_ratio": reused / requests if requests else 0.0,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "saturated_requests": self.saturated_requests,
+                "pool_utilization": self.in_flight / self.max_connections,
+            }
@@ -0,0 +1,79 @@
+"""Heavy third-party modules behind lazy, thread-safe module proxies.
+
+Importing stripe and httpx takes a few hundred milliseconds of a cold
+start, and neither is needed until the first Stripe call. Modules use
+`from lazy_modules import stripe` instead of `import stripe`; the real
+import happens on first attribute access, after which callbacks
+registered with when_loaded() run (stripe's api_key/api_base come from the
+environment this way). Code that only runs once a module is loaded, such
+as a class subclassing stripe.HTTPClient, lives in its own module and
+imports the real thing.
+"""
+import importlib
+import os
+import threading
+from types import ModuleType
+from typing import Callable
+
+
+class LazyModule:
+    """Stands in for a module until an attribute is first read or set."""
+
+    def __init__(self, name: str):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_loading", None)
+        object.__setattr__(self, "_callbacks", [])
+        object.__setattr__(self, "_lock", threading.RLock())
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> ModuleType:
+        """Import the module (once) and run the when_loaded callbacks."""
+        module = self._module
+        if module is not None:
+            return module
+        with self._lock:
+            if self._module is None:
+                # A callback touching the proxy re-enters here on the same thread
+                if self._loading is not None:
+                    return self._loading
+                object.__setattr__(self, "_loading", importlib.import_module(self._name))
+                try:
+                    for callback in self._callbacks:
+                        callback(self._loading)
+                    object.__setattr__(self, "_module", self._loading)
+                finally:
+                    object.__setattr__(self, "_loading", None)
+            return self._module
+
+    def when_loaded(self, callback: Callable[[ModuleType], None]):
+        """Run callback(module) once the module is imported, or now if it already is."""
+        with self._lock:
+            if self._module is None:
+                self._callbacks.append(callback)
+                return
+        callback(self._module)
+
+    def __getattr__(self, attr: str):
+        return getattr(self._module or self.load(), attr)
+
+    def __setattr__(self, attr: str, value):
+        setattr(self._module or self.load(), attr, value)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def _configure_stripe(module: ModuleType):
+    module.api_key = os.getenv('STRIPE_SECRET_KEY')
+    # Override to point at a local stand-in such as benchmarks/fake_stripe.py
+    module.api_base = os.getenv('STRIPE_API_BASE', module.api_base)
+
+
+stripe = LazyModule("stripe")
+stripe.when_loaded(_configure_stripe)
+httpx = LazyModule("httpx")
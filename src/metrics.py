@@ -0,0 +1,229 @@
+"""In-process metrics with Prometheus text exposition.
+
+Counters and histograms keep one shard per thread, so recording is a
+thread-local lookup and a few list updates with no lock. Shards are only
+merged when /metrics is scraped.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Sharded:
+    """Per-thread series storage; folded together at scrape time."""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, Dict]] = []
+        self._retired: Dict[LabelValues, List[float]] = {}
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _merged(self) -> Dict[LabelValues, List[float]]:
+        """Sum all shards, folding those of finished threads into one retired shard."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    self._fold(self._retired, shard)
+            self._shards = live
+            merged: Dict[LabelValues, List[float]] = {}
+            self._fold(merged, self._retired)
+            for _, shard in live:
+                self._fold(merged, shard)
+        return merged
+
+    @staticmethod
+    def _fold(into: Dict, shard: Dict):
+        for labels, values in list(shard.items()):
+            total = into.setdefault(labels, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+
+
+class Counter(_Sharded):
+    """Monotonic counter; exposed as `<name>_total`."""
+
+    def inc(self, labels: LabelValues = (), amount: float = 1):
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = [0]
+        values[0] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name}_total {self.help}", f"# TYPE {self.name}_total counter"]
+        for labels, (value,) in sorted(self._merged().items()):
+            lines.append(f"{self.name}_total{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Sharded):
+    """Cumulative-bucket latency histogram."""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels: LabelValues, value: float):
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            values = shard[labels] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        bounds = [_number(b) for b in self.buckets] + ["+Inf"]
+        for labels, values in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time: fn() -> {label values: value}."""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], fn: Callable[[], Dict[LabelValues, float]]):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self.fn().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together for /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...], fn) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STRIPE_CALL_SECONDS = REGISTRY.histogram(
+    "stripe_call_duration_seconds",
+    "Duration of Stripe API calls including retries.",
+    ("operation",),
+)
+STRIPE_CALLS = REGISTRY.counter(
+    "stripe_calls",
+    "Stripe API calls by outcome; outcome is \"ok\" or the error class.",
+    ("operation", "outcome"),
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Duration of API requests by route template and status code.",
+    ("method", "route", "status"),
+)
+
+WEBHOOK_HANDLER_SECONDS = REGISTRY.histogram(
+    "webhook_handler_duration_seconds",
+    "Duration of webhook handler calls (a batch counts as one call).",
+    ("handler", "event_type"),
+)
+WEBHOOK_HANDLER_CALLS = REGISTRY.counter(
+    "webhook_handler_calls",
+    "Webhook handler calls by outcome; outcome is \"ok\", \"failed\", \"timeout\" or the error class.",
+    ("handler", "event_type", "outcome"),
+)
+
+
+def record_stripe_call(operation: str, outcome: str, seconds: float):
+    STRIPE_CALL_SECONDS.observe((operation,), seconds)
+    STRIPE_CALLS.inc((operation, outcome))
+
+
+def record_webhook_handler(handler: str, event_type: str, outcome: str, seconds: float):
+    WEBHOOK_HANDLER_SECONDS.observe((handler, event_type), seconds)
+    WEBHOOK_HANDLER_CALLS.inc((handler, event_type, outcome))
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware timing each HTTP request by route template and status."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the scope; templates keep label cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe((scope["method"], route, str(status)), time.perf_counter() - start)
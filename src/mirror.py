@@ -0,0 +1,180 @@
+"""Webhook-fed local mirror of Stripe customers, subscriptions, invoices and payment intents."""
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+MIRRORED_TYPES = ("customer", "subscription", "invoice", "payment_intent")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stripe_objects (
+    object_type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    customer_id TEXT,
+    data TEXT NOT NULL,
+    event_created INTEGER NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (object_type, id)
+);
+CREATE INDEX IF NOT EXISTS idx_stripe_objects_customer ON stripe_objects (object_type, customer_id);
+-- seeded_at is when the covering listing started; expired_at voids listings started before it
+CREATE TABLE IF NOT EXISTS mirror_coverage (
+    object_type TEXT NOT NULL,
+    customer_id TEXT NOT NULL,
+    seeded_at REAL NOT NULL,
+    expired_at REAL,
+    PRIMARY KEY (object_type, customer_id)
+);
+"""
+
+
+class MirrorStore:
+    """Storage interface for the local Stripe mirror.
+
+    Implementations must make upsert() last-writer-wins on
+    `event_created`, so late or out-of-order webhooks never overwrite
+    newer state. Webhooks only cover objects that changed, so a
+    customer's list is authoritative only once seed() has stored a full
+    listing from Stripe (is_complete()), until that listing is older
+    than the caller's max age or expire() voids it.
+    """
+
+    def upsert(self, object_type: str, obj: Dict, event_created: int, deleted: bool = False) -> bool:
+        raise NotImplementedError
+
+    def get(self, object_type: str, object_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def list_for_customer(self, object_type: str, customer_id: str) -> List[Dict]:
+        raise NotImplementedError
+
+    def seed(self, object_type: str, customer_id: str, objects: List[Dict], as_of: float):
+        """Store a full Stripe listing taken at `as_of` and mark the customer complete for the type."""
+        raise NotImplementedError
+
+    def is_complete(self, object_type: str, customer_id: str, max_age: float = None) -> bool:
+        """Whether a listing taken within `max_age` seconds (any age if None) still covers the customer."""
+        raise NotImplementedError
+
+    def expire(self, object_type: str, customer_id: str):
+        """Void the customer's coverage so the next read lists from Stripe again."""
+        raise NotImplementedError
+
+    def apply_event(self, event: Dict) -> bool:
+        """Upsert the event's data.object if it is a mirrored type."""
+        row = _mirrored_object(event)
+        return self.upsert(*row) if row else False
+
+    def apply_events(self, events: List[Dict]) -> List[bool]:
+        """apply_event() for a batch; backends may override to write in one transaction."""
+        return [self.apply_event(event) for event in events]
+
+
+def _mirrored_object(event: Dict) -> Optional[tuple]:
+    """(object_type, obj, event_created, deleted) for a mirrored event, else None."""
+    obj = event['data']['object']
+    object_type = obj.get('object')
+    if object_type not in MIRRORED_TYPES:
+        return None
+    deleted = object_type == "customer" and event['type'] == "customer.deleted"
+    return object_type, obj, event.get('created', 0), deleted
+
+
+def _customer_id(object_type: str, obj: Dict) -> Optional[str]:
+    if object_type == "customer":
+        return obj['id']
+    customer = obj.get('customer')
+    if isinstance(customer, dict):
+        return customer.get('id')
+    return customer
+
+
+class SQLiteMirrorStore(MirrorStore):
+    """Default mirror backend: one SQLite table keyed by (object type, id)."""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv('STRIPE_MIRROR_PATH', 'stripe_mirror.db')
+        self.db = SQLiteStore(self.path, SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(mirror_coverage)")}
+        if "expired_at" not in columns:
+            self.db.execute("ALTER TABLE mirror_coverage ADD COLUMN expired_at REAL")
+
+    def apply_events(self, events: List[Dict]) -> List[bool]:
+        """Apply a batch of events in a single transaction."""
+        applied = []
+        with self.db.transaction():
+            for event in events:
+                row = _mirrored_object(event)
+                applied.append(self.upsert(*row) if row else False)
+        return applied
+
+    def upsert(self, object_type: str, obj: Dict, event_created: int, deleted: bool = False) -> bool:
+        cursor = self.db.execute(
+            """
+            INSERT INTO stripe_objects (object_type, id, customer_id, data, event_created, deleted)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (object_type, id) DO UPDATE SET
+                customer_id = excluded.customer_id,
+                data = excluded.data,
+                event_created = excluded.event_created,
+                deleted = excluded.deleted
+            WHERE excluded.event_created >= stripe_objects.event_created
+            """,
+            (object_type, obj['id'], _customer_id(object_type, obj), json.dumps(obj),
+             int(event_created), int(deleted)),
+        )
+        if cursor.rowcount == 0:
+            logger.info(f"Stale {object_type} update ignored: {obj['id']}")
+        return cursor.rowcount == 1
+
+    def get(self, object_type: str, object_id: str) -> Optional[Dict]:
+        row = self.db.execute(
+            "SELECT data FROM stripe_objects WHERE object_type = ? AND id = ? AND deleted = 0",
+            (object_type, object_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_for_customer(self, object_type: str, customer_id: str) -> List[Dict]:
+        rows = self.db.execute(
+            "SELECT data FROM stripe_objects WHERE object_type = ? AND customer_id = ? AND deleted = 0",
+            (object_type, customer_id),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def seed(self, object_type: str, customer_id: str, objects: List[Dict], as_of: float):
+        # Webhooks for changes after the listing started still win over the snapshot
+        with self.db.transaction():
+            for obj in objects:
+                self.upsert(object_type, obj, as_of)
+            self.db.execute(
+                """
+                INSERT INTO mirror_coverage (object_type, customer_id, seeded_at) VALUES (?, ?, ?)
+                ON CONFLICT (object_type, customer_id) DO UPDATE SET seeded_at = excluded.seeded_at
+                WHERE excluded.seeded_at > mirror_coverage.seeded_at
+                """,
+                (object_type, customer_id, as_of),
+            )
+
+    def is_complete(self, object_type: str, customer_id: str, max_age: float = None) -> bool:
+        cutoff = time.time() - max_age if max_age is not None else 0
+        return self.db.execute(
+            """
+            SELECT 1 FROM mirror_coverage WHERE object_type = ? AND customer_id = ?
+            AND seeded_at >= ? AND (expired_at IS NULL OR seeded_at > expired_at)
+            """,
+            (object_type, customer_id, cutoff),
+        ).fetchone() is not None
+
+    def expire(self, object_type: str, customer_id: str):
+        self.db.execute(
+            """
+            INSERT INTO mirror_coverage (object_type, customer_id, seeded_at, expired_at) VALUES (?, ?, 0, ?)
+            ON CONFLICT (object_type, customer_id) DO UPDATE SET expired_at = excluded.expired_at
+            """,
+            (object_type, customer_id, time.time()),
+        )
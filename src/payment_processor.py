@@ -1,13 +1,38 @@
 """Production Stripe Payment Processor with webhooks and subscription management."""
 import os
-import stripe
 import logging
-from typing import Dict, Optional, List
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, reduce
+from typing import Any, Dict, Iterator, Optional, List
 from datetime import datetime
 from enum import Enum
 
+from circuit_breaker import BreakerRegistry
+from errors import StripeCallRejected
+from http_client import PoolConfig
+from lazy_modules import stripe
+from metrics import record_stripe_call
+from mirror import MirrorStore, SQLiteMirrorStore
+from price_catalog import PriceCatalog, PriceKey
+from rate_limit import StripeGovernor, classify
+from retry import Retrier
+from webhook_dedup import EventDeduplicator, EventInProgress
+from webhook_registry import WebhookHandler, WebhookHandlerError, WebhookRegistry
+from webhook_signature import WebhookSignatureError, WebhookVerifier
+import tracing
+
 logger = logging.getLogger(__name__)
-stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+
+# Operations whose created objects accept metadata, used to carry the trace context
+TRACED_METADATA_OPERATIONS = {"Customer.create", "Subscription.create", "PaymentIntent.create"}
+
+@lru_cache(maxsize=None)
+def sdk_attribute(path: str) -> Any:
+    """Resolve a dotted SDK name such as "billing_portal.Session.create" once."""
+    return reduce(getattr, path.split("."), stripe)
 
 class SubscriptionTier(Enum):
     STARTER = "starter"
@@ -20,36 +45,139 @@ class PricingPlan:
         SubscriptionTier.STARTER: {
             "name": "Starter",
             "price": 4900,  # $49.00 in cents
+            "currency": "usd",
             "interval": "month",
             "features": ["10GB data", "5 pipelines", "Email support"]
         },
         SubscriptionTier.PRO: {
             "name": "Pro",
             "price": 19900,  # $199.00
+            "currency": "usd",
             "interval": "month",
             "features": ["100GB data", "Unlimited pipelines", "Priority support"]
         },
         SubscriptionTier.ENTERPRISE: {
             "name": "Enterprise",
             "price": 49900,  # $499.00
+            "currency": "usd",
             "interval": "month",
             "features": ["Unlimited data", "Custom integrations", "Dedicated support"]
         }
     }
+    
+    @classmethod
+    def price_key(cls, tier: SubscriptionTier, currency: str = None, interval: str = None) -> PriceKey:
+        """Catalog key for a tier, defaulting to the plan's own currency and interval."""
+        plan = cls.PLANS[tier]
+        return (tier.value, (currency or plan["currency"]).lower(), interval or plan["interval"])
 
 class PaymentProcessor:
     """Handles all Stripe payment operations."""
     
-    def __init__(self):
-        self.webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET')
+    def __init__(self, pool_config: PoolConfig = None, mirror: MirrorStore = None):
+        self.webhook_verifier = WebhookVerifier()
+        # One keep-alive pool for every SDK call, so TCP+TLS setup stays off the hot path.
+        # The SDK only has a process-wide client, so the latest processor owns it. Both
+        # are created when stripe is first used, keeping the SDK import off startup.
+        self.pool_config = pool_config or PoolConfig.from_env()
+        self.http_client = None
+        stripe.when_loaded(self._install_http_client)
+        self.deduplicator = EventDeduplicator()
+        # Event ID -> timed-out handlers still running for it; their claims stay held meanwhile
+        self._late_handlers: Dict[str, int] = {}
+        self._late_lock = threading.Lock()
+        # Local copy of Stripe objects maintained from webhooks; reads fall back to Stripe on a miss
+        self.mirror = mirror or SQLiteMirrorStore()
+        self.mirror_fallback = os.getenv('STRIPE_MIRROR_FALLBACK', 'true').lower() == 'true'
+        # Bounds staleness from missed webhooks: older subscription listings are re-read from Stripe
+        self.mirror_max_age = float(os.getenv('SUBSCRIPTION_MIRROR_MAX_AGE', 300))
+        self.governor = StripeGovernor()
+        self.retrier = Retrier()
+        self.breakers = BreakerRegistry()
+        self.batch_concurrency = int(os.getenv('CUSTOMER_BATCH_CONCURRENCY', 16))
+        self.catalog = PriceCatalog(PricingPlan.price_key(tier) for tier in PricingPlan.PLANS)
+        # Built once; other consumers subscribe with self.webhooks.register()
+        self.webhooks = WebhookRegistry()
+        self._register_webhook_handlers()
+    
+    def _register_webhook_handlers(self):
+        """Subscribe the built-in handlers; those with a batch form are micro-batched by WebhookQueue."""
+        register = self.webhooks.register
+        register('payment_intent.succeeded', self._handle_payment_succeeded)
+        register('payment_intent.payment_failed', self._handle_payment_failed)
+        register('customer.subscription.created', self._handle_subscription_created)
+        register('customer.subscription.updated', self._handle_subscription_updated,
+                 batch=self._handle_subscription_updated_batch)
+        register('customer.subscription.deleted', self._handle_subscription_deleted)
+        register('invoice.payment_succeeded', self._handle_invoice_paid, batch=self._handle_invoice_paid_batch)
+        register('invoice.payment_failed', self._handle_invoice_failed)
+        register('price.created', self._handle_price_changed)
+        register('price.updated', self._handle_price_changed)
+        register('price.deleted', self._handle_price_deleted)
+        register('product.created', self._handle_product_changed)
+        register('product.updated', self._handle_product_changed)
+        register('product.deleted', self._handle_product_deleted)
+    
+    def _install_http_client(self, sdk):
+        from stripe_http_client import PooledHTTPClient
+        self.http_client = PooledHTTPClient(self.pool_config)
+        sdk.default_http_client = self.http_client
+    
+    def http_pool_stats(self) -> Dict:
+        """Connection pool counters for the Stripe HTTP client (None until first used)."""
+        return {"sync": self.http_client.stats.snapshot() if self.http_client else None}
+    
+    def _call(self, operation: str, *args, **params) -> Any:
+        """Invoke a Stripe SDK operation such as "Customer.create".
+        
+        Each attempt passes the resource's circuit breaker and holds a
+        governor slot; transient failures are retried with backoff.
+        Mutating calls reuse one idempotency key across attempts so a retry
+        can never apply the change twice. Created objects carry the trace
+        context in their metadata so the resulting webhooks can be linked
+        back to this call, unless the caller supplied the idempotency key.
+        """
+        method = sdk_attribute(operation)
+        caller_key = params.get("idempotency_key")
+        if classify(operation)[0] == "write":
+            params["idempotency_key"] = caller_key or str(uuid.uuid4())
+        
+        def attempt():
+            # Cheap open-circuit check first so fast-fails never queue for a slot
+            self.breakers.check(operation)
+            with self.governor.slot(operation):
+                with self.breakers.guard(operation), tracing.span("stripe.http", tracing.CLIENT):
+                    return method(*args, **params)
+        
+        start = time.perf_counter()
+        outcome = "ok"
+        with tracing.span(f"stripe {operation}", tracing.CLIENT, **{"stripe.operation": operation}):
+            # A caller-supplied key may be re-sent later, so its params must not vary per call
+            if operation in TRACED_METADATA_OPERATIONS and not caller_key:
+                params["metadata"] = tracing.with_traceparent(params.get("metadata"))
+            try:
+                return self.retrier.call(operation, attempt)
+            except Exception as e:
+                outcome = type(e).__name__
+                raise
+            finally:
+                record_stripe_call(operation, outcome, time.perf_counter() - start)
     
-    def create_customer(self, email: str, name: str, metadata: Dict = None) -> Dict:
+    def create_customer(
+        self,
+        email: str,
+        name: str,
+        metadata: Dict = None,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
         """Create Stripe customer."""
         try:
-            customer = stripe.Customer.create(
+            customer = self._call(
+                "Customer.create",
                 email=email,
                 name=name,
                 metadata=metadata or {},
+                idempotency_key=idempotency_key,
             )
             logger.info(f"Customer created: {customer.id}")
             return {"success": True, "customer_id": customer.id, "customer": customer}
@@ -57,6 +185,79 @@ class PaymentProcessor:
             logger.error(f"Customer creation failed: {e}")
             return {"success": False, "error": str(e)}
     
+    def _batch_result(self, index: int, item: Dict, result: Dict) -> Dict:
+        """One per-item line of a batch: index, outcome and the key to retry with."""
+        line = {"index": index, "success": result["success"], "idempotency_key": item.get("idempotency_key")}
+        if result["success"]:
+            line["customer_id"] = result["customer_id"]
+        else:
+            line["error"] = result["error"]
+            if "retry_after" in result:
+                line["retry_after"] = result["retry_after"]
+        return line
+    
+    def _create_batch_customer(self, index: int, item: Dict) -> Dict:
+        try:
+            result = self.create_customer(
+                item["email"], item["name"], item.get("metadata"), item.get("idempotency_key")
+            )
+        except StripeCallRejected as e:
+            result = {"success": False, "error": str(e), "retry_after": e.retry_after}
+        except Exception as e:
+            logger.exception(f"Batch customer {index} failed: {e}")
+            result = {"success": False, "error": "Internal error"}
+        return self._batch_result(index, item, result)
+    
+    def create_customers(self, customers: List[Dict], concurrency: int = None) -> Iterator[Dict]:
+        """Create many customers in parallel, yielding each item's result as it completes.
+        
+        Items are dicts with email, name and optional metadata and
+        idempotency_key. At most `concurrency` creations are in flight;
+        the governor still applies Stripe rate limits to each call.
+        """
+        pool = ThreadPoolExecutor(max_workers=concurrency or self.batch_concurrency)
+        try:
+            futures = [
+                pool.submit(self._create_batch_customer, index, item)
+                for index, item in enumerate(customers)
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def price_id_for(
+        self,
+        tier: SubscriptionTier,
+        currency: Optional[str] = None,
+        interval: Optional[str] = None
+    ) -> Optional[str]:
+        """Stripe price id for a tier from the local catalog; never calls Stripe."""
+        return self.catalog.price_id(*PricingPlan.price_key(tier, currency, interval))
+    
+    def _price_list_params(self, starting_after: Optional[str]) -> Dict:
+        params = {"active": True, "type": "recurring", "expand": ["data.product"], "limit": 100}
+        if starting_after:
+            params["starting_after"] = starting_after
+        return params
+    
+    def sync_price_catalog(self) -> int:
+        """Reload the price catalog from Stripe's active recurring prices.
+        
+        Returns the number of indexed prices; StripeError propagates and
+        leaves the previous catalog in place.
+        """
+        prices, starting_after = [], None
+        while True:
+            page = self._call("Price.list", **self._price_list_params(starting_after))
+            prices.extend(page.data)
+            if not page.has_more or not page.data:
+                break
+            starting_after = page.data[-1].id
+        count = self.catalog.replace(prices)
+        logger.info(f"Price catalog synced: {count} prices")
+        return count
+    
     def create_subscription(
         self,
         customer_id: str,
@@ -75,7 +276,9 @@ class PaymentProcessor:
             if trial_days:
                 params["trial_period_days"] = trial_days
             
-            subscription = stripe.Subscription.create(**params)
+            as_of = int(time.time())
+            subscription = self._call("Subscription.create", **params)
+            self._record_subscription(subscription, as_of)
             
             return {
                 "success": True,
@@ -87,16 +290,27 @@ class PaymentProcessor:
             logger.error(f"Subscription creation failed: {e}")
             return {"success": False, "error": str(e)}
     
-    def cancel_subscription(self, subscription_id: str, immediate: bool = False) -> Dict:
+    def cancel_subscription(
+        self,
+        subscription_id: str,
+        immediate: bool = False,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
         """Cancel subscription."""
         try:
+            as_of = int(time.time())
             if immediate:
-                subscription = stripe.Subscription.delete(subscription_id)
+                subscription = self._call(
+                    "Subscription.delete", subscription_id, idempotency_key=idempotency_key
+                )
             else:
-                subscription = stripe.Subscription.modify(
+                subscription = self._call(
+                    "Subscription.modify",
                     subscription_id,
-                    cancel_at_period_end=True
+                    cancel_at_period_end=True,
+                    idempotency_key=idempotency_key
                 )
+            self._record_subscription(subscription, as_of)
             
             return {
                 "success": True,
@@ -108,19 +322,28 @@ class PaymentProcessor:
             logger.error(f"Subscription cancellation failed: {e}")
             return {"success": False, "error": str(e)}
     
-    def update_subscription(self, subscription_id: str, new_price_id: str) -> Dict:
+    def update_subscription(
+        self,
+        subscription_id: str,
+        new_price_id: str,
+        idempotency_key: Optional[str] = None
+    ) -> Dict:
         """Upgrade/downgrade subscription."""
         try:
-            subscription = stripe.Subscription.retrieve(subscription_id)
+            subscription = self._call("Subscription.retrieve", subscription_id)
             
-            updated = stripe.Subscription.modify(
+            as_of = int(time.time())
+            updated = self._call(
+                "Subscription.modify",
                 subscription_id,
                 items=[{
                     "id": subscription['items'].data[0].id,
                     "price": new_price_id,
                 }],
-                proration_behavior="create_prorations"
+                proration_behavior="create_prorations",
+                idempotency_key=idempotency_key
             )
+            self._record_subscription(updated, as_of)
             
             return {
                 "success": True,
@@ -143,7 +366,7 @@ class PaymentProcessor:
             if customer_id:
                 params["customer"] = customer_id
             
-            intent = stripe.PaymentIntent.create(**params)
+            intent = self._call("PaymentIntent.create", **params)
             
             return {
                 "success": True,
@@ -155,39 +378,161 @@ class PaymentProcessor:
             return {"success": False, "error": str(e)}
     
     def verify_webhook(self, payload: bytes, sig_header: str) -> Optional[Dict]:
-        """Verify and parse Stripe webhook."""
+        """Verify and parse Stripe webhook into a plain dict (parsed only once the signature checks out)."""
         try:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, self.webhook_secret
-            )
-            return event
+            return self.webhook_verifier.construct_event(payload, sig_header)
+        except WebhookSignatureError as e:
+            logger.error(f"Invalid webhook signature: {e}")
+            return None
         except ValueError as e:
             logger.error(f"Invalid webhook payload: {e}")
             return None
-        except stripe.error.SignatureVerificationError as e:
-            logger.error(f"Invalid webhook signature: {e}")
-            return None
     
     def handle_webhook_event(self, event: Dict) -> Dict:
         """Process webhook event."""
         event_type = event['type']
+        obj = event['data']['object']
+        attributes = {"stripe.event_id": event['id'], "stripe.event_type": event_type}
+        with tracing.span(f"webhook {event_type}", tracing.CONSUMER, **attributes) as event_span:
+            # Link back to the API request whose Stripe call created this object
+            event_span.add_link((obj.get('metadata') or {}).get(tracing.METADATA_KEY))
+            self.mirror.apply_event(event)
+            
+            handlers = self.webhooks.handlers_for(event_type)
+            if handlers:
+                # Stripe delivers at least once; an event is marked processed only after its
+                # handlers succeed, and a live claim elsewhere raises EventInProgress to retry later
+                if not self.deduplicator.claim(event['id']):
+                    logger.info(f"Duplicate event skipped: {event['id']}")
+                    event_span.set_attribute("webhook.duplicate", True)
+                    return {"success": True, "duplicate": True, "message": "Event already processed"}
+                # A retry runs only the handlers that have not succeeded yet
+                done = self.deduplicator.handlers_done([event['id']]).get(event['id'], set())
+                handlers = tuple(h for h in handlers if h.name not in done)
+                try:
+                    if handlers:
+                        result = self.webhooks.dispatch(event, handlers, late=self._hold_claims)
+                    else:
+                        result = {"success": True, "message": "Event handlers already succeeded"}
+                except WebhookHandlerError as e:
+                    self.deduplicator.record_handlers([(event['id'], name) for name in e.succeeded])
+                    self._release_claims([event['id']])
+                    raise
+                except Exception:
+                    self._release_claims([event['id']])
+                    raise
+                self.deduplicator.complete(event['id'])
+                return result
+            else:
+                logger.info(f"Unhandled event type: {event_type}")
+                return {"success": True, "message": "Event received but not processed"}
+    
+    def handle_webhook_events(self, events: List[Dict]) -> List[Dict]:
+        """Process a batch of events of one type; returns a result per event.
         
-        handlers = {
-            'payment_intent.succeeded': self._handle_payment_succeeded,
-            'payment_intent.payment_failed': self._handle_payment_failed,
-            'customer.subscription.created': self._handle_subscription_created,
-            'customer.subscription.updated': self._handle_subscription_updated,
-            'customer.subscription.deleted': self._handle_subscription_deleted,
-            'invoice.payment_succeeded': self._handle_invoice_paid,
-            'invoice.payment_failed': self._handle_invoice_failed,
-        }
+        Mirror writes and dedup claims go to storage in one transaction each,
+        then the batch goes through the registry, where batch handlers get
+        all objects in one call. Types without a batch handler run through
+        handle_webhook_event() one by one. Succeeded events are marked
+        processed; a failed event gets {"success": False, "error": ...} and
+        its dedup claim is released so a retry runs the handlers that did
+        not succeed. Events claimed by another worker fail without running,
+        to be retried.
+        """
+        event_type = events[0]['type']
+        if any(event['type'] != event_type for event in events):
+            raise ValueError("A webhook batch must contain a single event type")
+        if not self.webhooks.is_batched(event_type):
+            return [self._handle_webhook_event_safely(event) for event in events]
         
-        handler = handlers.get(event_type)
-        if handler:
-            return handler(event['data']['object'])
-        else:
-            logger.info(f"Unhandled event type: {event_type}")
-            return {"success": True, "message": "Event received but not processed"}
+        attributes = {"stripe.event_type": event_type, "webhook.batch_size": len(events)}
+        with tracing.span(f"webhook {event_type} batch", tracing.CONSUMER, **attributes) as batch_span:
+            for event in events:
+                metadata = event['data']['object'].get('metadata') or {}
+                batch_span.add_link(metadata.get(tracing.METADATA_KEY), **{"stripe.event_id": event['id']})
+            self.mirror.apply_events(events)
+            
+            claimed = self.deduplicator.claim_many([event['id'] for event in events])
+            results = [{"success": True, "duplicate": True, "message": "Event already processed"}] * len(events)
+            fresh = [i for i, is_new in enumerate(claimed) if is_new]
+            duplicates = claimed.count(False)
+            if duplicates:
+                logger.info(f"Duplicate events skipped: {duplicates} {event_type}")
+                batch_span.set_attribute("webhook.duplicates", duplicates)
+            for i, is_new in enumerate(claimed):
+                if is_new is None:
+                    results[i] = {"success": False, "error": str(EventInProgress(events[i]['id']))}
+            if not fresh:
+                return results
+            
+            # Retried events skip the handlers that already succeeded, so group them by what is left
+            done = self.deduplicator.handlers_done([events[i]['id'] for i in fresh])
+            groups: Dict[frozenset, List[int]] = {}
+            for i in fresh:
+                groups.setdefault(frozenset(done.get(events[i]['id'], ())), []).append(i)
+            all_handlers = self.webhooks.handlers_for(event_type)
+            try:
+                for skip, indices in groups.items():
+                    handlers = tuple(h for h in all_handlers if h.name not in skip)
+                    if not handlers:
+                        for i in indices:
+                            results[i] = {"success": True, "message": "Event handlers already succeeded"}
+                        continue
+                    handled = self.webhooks.dispatch_batch(
+                        [events[i] for i in indices], handlers, late=self._hold_claims
+                    )
+                    for i, result in zip(indices, handled):
+                        results[i] = result
+            except Exception:
+                self._release_claims([events[i]['id'] for i in fresh])
+                raise
+            self.deduplicator.record_handlers([
+                (events[i]['id'], name) for i in fresh for name in results[i].get('succeeded_handlers', ())
+            ])
+            self.deduplicator.complete_many([events[i]['id'] for i in fresh if results[i].get('success')])
+            self._release_claims([events[i]['id'] for i in fresh if not results[i].get('success')])
+            return results
+    
+    def _hold_claims(self, handler: WebhookHandler, events: List[Dict], outcome):
+        """Keep the claims of events whose timed-out handler is still running.
+        
+        A redelivery meanwhile gets EventInProgress instead of starting a
+        second copy. Once the handler ends its successes are recorded and
+        the claims released, so the retry runs only what is still missing.
+        """
+        event_ids = [event['id'] for event in events]
+        with self._late_lock:
+            for event_id in event_ids:
+                # The dispatching thread holds the claim too until it calls _release_claims()
+                self._late_handlers[event_id] = self._late_handlers.get(event_id, 1) + 1
+        outcome.add_done_callback(lambda f: self._late_handler_finished(handler, event_ids, f.result()))
+    
+    def _late_handler_finished(self, handler: WebhookHandler, event_ids: List[str], succeeded: List[bool]):
+        logger.info(f"Timed-out webhook handler {handler.name} finished for {len(event_ids)} event(s)")
+        self.deduplicator.record_handlers(
+            [(event_id, handler.name) for event_id, ok in zip(event_ids, succeeded) if ok]
+        )
+        self._release_claims(event_ids)
+    
+    def _release_claims(self, event_ids: List[str]):
+        """Release failed claims once nothing holds them, neither dispatch nor a late handler."""
+        released = []
+        with self._late_lock:
+            for event_id in event_ids:
+                holders = self._late_handlers.get(event_id, 1) - 1
+                if holders:
+                    self._late_handlers[event_id] = holders
+                else:
+                    self._late_handlers.pop(event_id, None)
+                    released.append(event_id)
+        self.deduplicator.release_many(released)
+    
+    def _handle_webhook_event_safely(self, event: Dict) -> Dict:
+        try:
+            return self.handle_webhook_event(event)
+        except Exception as e:
+            logger.error(f"Webhook event {event['id']} failed: {e}")
+            return {"success": False, "error": str(e)}
     
     def _handle_payment_succeeded(self, payment_intent: Dict) -> Dict:
         """Handle successful payment."""
@@ -211,6 +556,11 @@ class PaymentProcessor:
         logger.info(f"Subscription updated: {subscription['id']}")
         return {"success": True, "action": "update_resources"}
     
+    def _handle_subscription_updated_batch(self, subscriptions: List[Dict]) -> List[Dict]:
+        """Handle a batch of subscription updates."""
+        logger.info(f"Subscriptions updated: {len(subscriptions)}")
+        return [{"success": True, "action": "update_resources"} for _ in subscriptions]
+    
     def _handle_subscription_deleted(self, subscription: Dict) -> Dict:
         """Handle subscription cancellation."""
         logger.info(f"Subscription deleted: {subscription['id']}")
@@ -219,26 +569,191 @@ class PaymentProcessor:
     def _handle_invoice_paid(self, invoice: Dict) -> Dict:
         """Handle successful invoice payment."""
         logger.info(f"Invoice paid: {invoice['id']}")
+        # A paid renewal moves the subscription's period and status
+        self._expire_subscriptions(invoice.get('customer'))
         return {"success": True, "action": "extend_subscription"}
     
+    def _handle_invoice_paid_batch(self, invoices: List[Dict]) -> List[Dict]:
+        """Handle a batch of successful invoice payments, e.g. a renewal run."""
+        logger.info(f"Invoices paid: {len(invoices)}")
+        for customer_id in {invoice.get('customer') for invoice in invoices}:
+            self._expire_subscriptions(customer_id)
+        return [{"success": True, "action": "extend_subscription"} for _ in invoices]
+    
     def _handle_invoice_failed(self, invoice: Dict) -> Dict:
         """Handle failed invoice payment."""
         logger.warning(f"Invoice payment failed: {invoice['id']}")
         return {"success": True, "action": "notify_payment_failure"}
     
+    def _handle_price_changed(self, price: Dict) -> Dict:
+        """Keep the price catalog current."""
+        self.catalog.apply_price(price)
+        return {"success": True, "action": "update_price_catalog"}
+    
+    def _handle_price_deleted(self, price: Dict) -> Dict:
+        """Drop a deleted price from the catalog."""
+        self.catalog.apply_price(price, deleted=True)
+        return {"success": True, "action": "update_price_catalog"}
+    
+    def _handle_product_changed(self, product: Dict) -> Dict:
+        """Re-tier the product's prices in the catalog."""
+        self.catalog.apply_product(product)
+        return {"success": True, "action": "update_price_catalog"}
+    
+    def _handle_product_deleted(self, product: Dict) -> Dict:
+        """Retire the product's prices from the catalog."""
+        self.catalog.apply_product(product, deleted=True)
+        return {"success": True, "action": "update_price_catalog"}
+    
+    def _expire_subscriptions(self, customer_id: Optional[str]):
+        """Have the customer's next subscription read list from Stripe again."""
+        if customer_id:
+            self.mirror.expire("subscription", customer_id)
+    
+    def _record_subscription(self, subscription: Any, as_of: int):
+        """Write a subscription returned by our own Stripe call into the mirror.
+        
+        Reads see the change before its webhook arrives, in partial mode too.
+        `as_of` is taken before the call, so webhooks for later changes still win.
+        """
+        obj = subscription.to_dict_recursive()
+        # Store the shape webhooks deliver; the expanded invoice carries a client secret
+        if isinstance(obj.get('latest_invoice'), dict):
+            obj['latest_invoice'] = obj['latest_invoice']['id']
+        self.mirror.upsert("subscription", obj, as_of)
+    
+    def _mirrored_subscriptions(self, customer_id: str, partial: bool = False) -> Optional[List[Dict]]:
+        """Subscriptions from the local mirror, or None unless a recent enough listing covers the customer.
+        
+        With partial=True whatever the mirror holds is returned, for when
+        Stripe must not be called.
+        """
+        if not partial and not self.mirror.is_complete("subscription", customer_id, self.mirror_max_age):
+            return None
+        subscriptions = self.mirror.list_for_customer("subscription", customer_id)
+        # Match Stripe's list default, which omits canceled subscriptions
+        return [s for s in subscriptions if s.get('status') != 'canceled']
+    
+    def _seed_subscriptions(self, customer_id: str, subscriptions: List[Any], as_of: float) -> List[Dict]:
+        """Store a full listing in the mirror so later reads are served locally."""
+        objects = [s.to_dict_recursive() for s in subscriptions]
+        self.mirror.seed("subscription", customer_id, objects, as_of)
+        return [s for s in objects if s.get('status') != 'canceled']
+    
     def get_customer_subscriptions(self, customer_id: str) -> List[Dict]:
-        """Get all subscriptions for customer."""
+        """Get all subscriptions for customer (mirror, seeded from Stripe on the first read)."""
+        mirrored = self._mirrored_subscriptions(customer_id, partial=not self.mirror_fallback)
+        if mirrored is not None:
+            return mirrored
         try:
-            subscriptions = stripe.Subscription.list(customer=customer_id)
-            return subscriptions.data
+            as_of = time.time()
+            # status=all so subscriptions canceled since their last webhook are corrected too
+            return self._seed_subscriptions(
+                customer_id, list(self.iter_customer_subscriptions(customer_id, status="all")), as_of
+            )
         except stripe.error.StripeError as e:
             logger.error(f"Failed to fetch subscriptions: {e}")
             return []
     
+    def _subscription_list_params(
+        self,
+        customer_id: str,
+        status: Optional[str],
+        limit: Optional[int],
+        page_size: int
+    ) -> Dict:
+        """Shared Subscription.list params for the paginated iterators."""
+        page_size = max(1, min(page_size, 100))  # Stripe caps list pages at 100
+        if limit is not None:
+            page_size = min(page_size, limit)
+        params = {"customer": customer_id, "limit": page_size}
+        if status:
+            params["status"] = status
+        return params
+    
+    def iter_customer_subscriptions(
+        self,
+        customer_id: str,
+        status: Optional[str] = None,
+        limit: Optional[int] = None,
+        page_size: int = 100
+    ) -> Iterator[Dict]:
+        """Lazily yield every subscription for customer, following pagination cursors.
+        
+        The next page is fetched in the background while the current one is
+        consumed. Stops after `limit` subscriptions if given; StripeError
+        propagates to the caller.
+        """
+        params = self._subscription_list_params(customer_id, status, limit, page_size)
+        yielded = 0
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = self._call("Subscription.list", **params)
+            while True:
+                next_page = None
+                if page.has_more and page.data and (limit is None or yielded + len(page.data) < limit):
+                    next_page = executor.submit(
+                        self._call, "Subscription.list", starting_after=page.data[-1].id, **params
+                    )
+                for subscription in page.data:
+                    if limit is not None and yielded >= limit:
+                        return
+                    yield subscription
+                    yielded += 1
+                if next_page is None:
+                    return
+                page = next_page.result()
+    
+    def list_subscriptions_page(
+        self,
+        starting_after: Optional[str] = None,
+        page_size: int = 100,
+        **filters
+    ) -> Any:
+        """One page of Subscription.list across customers, filtered by price, customer or status.
+        
+        Callers follow `has_more` and pass the last id back as `starting_after`;
+        StripeError propagates.
+        """
+        params = {"limit": max(1, min(page_size, 100)), **filters}
+        if starting_after:
+            params["starting_after"] = starting_after
+        return self._call("Subscription.list", **params)
+    
+    def get_customer(self, customer_id: str) -> Optional[Dict]:
+        """Get customer from the local mirror, falling back to Stripe."""
+        customer = self.mirror.get("customer", customer_id)
+        if customer is not None or not self.mirror_fallback:
+            return customer
+        try:
+            return self._call("Customer.retrieve", customer_id)
+        except stripe.error.StripeError as e:
+            logger.error(f"Failed to fetch customer: {e}")
+            return None
+    
+    def get_subscription(self, subscription_id: str) -> Optional[Dict]:
+        """Get subscription from the local mirror, falling back to Stripe."""
+        subscription = self.mirror.get("subscription", subscription_id)
+        if subscription is not None or not self.mirror_fallback:
+            return subscription
+        try:
+            return self._call("Subscription.retrieve", subscription_id)
+        except stripe.error.StripeError as e:
+            logger.error(f"Failed to fetch subscription: {e}")
+            return None
+    
+    def get_customer_invoices(self, customer_id: str) -> List[Dict]:
+        """Get mirrored invoices for customer."""
+        return self.mirror.list_for_customer("invoice", customer_id)
+    
+    def get_customer_payment_intents(self, customer_id: str) -> List[Dict]:
+        """Get mirrored payment intents for customer."""
+        return self.mirror.list_for_customer("payment_intent", customer_id)
+    
     def create_portal_session(self, customer_id: str, return_url: str) -> Dict:
         """Create customer portal session for managing subscriptions."""
         try:
-            session = stripe.billing_portal.Session.create(
+            session = self._call(
+                "billing_portal.Session.create",
                 customer=customer_id,
                 return_url=return_url,
             )
@@ -0,0 +1,128 @@
+"""In-memory index of Stripe price ids by (tier, currency, interval).
+
+Filled from Stripe's active recurring prices at startup and kept current by
+price.* and product.* webhooks, so resolving a tier to a price on the
+request path is a dict lookup rather than a Price.list call. A price
+belongs to a tier through `metadata.tier` on the price or its product.
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (tier, currency, interval), e.g. ("pro", "usd", "month")
+PriceKey = Tuple[str, str, str]
+
+
+def lookup_key(tier: str, currency: str, interval: str) -> str:
+    """Stripe lookup key of the canonical price for a (tier, currency, interval)."""
+    return f"{tier}_{currency}_{interval}"
+
+
+class PriceCatalog:
+    """Thread-safe price index; lookups read an immutable dict and take no lock."""
+
+    def __init__(self, expected: Iterable[PriceKey] = ()):
+        self.expected = list(expected)
+        self._lock = threading.Lock()
+        self._prices: Dict[str, Dict] = {}
+        # product id -> {"tier": ..., "active": ...}
+        self._products: Dict[str, Dict] = {}
+        self._index: Dict[PriceKey, str] = {}
+        self.loaded_at: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def price_id(self, tier: str, currency: str, interval: str) -> Optional[str]:
+        """Active price for the key, or None."""
+        return self._index.get((tier, currency.lower(), interval))
+
+    def replace(self, prices: Iterable[Dict]) -> int:
+        """Swap in a full snapshot of active prices, each with `product` expanded. Returns the index size."""
+        products, summaries = {}, {}
+        for price in prices:
+            product = price.get("product")
+            if isinstance(product, dict):
+                products[product["id"]] = self._product_summary(product)
+                product = product["id"]
+            summary = self._price_summary(price, product)
+            if summary:
+                summaries[summary["id"]] = summary
+        with self._lock:
+            self._prices = summaries
+            self._products = products
+            self._rebuild()
+            self.loaded_at = time.time()
+            return len(self._index)
+
+    def apply_price(self, price: Dict, deleted: bool = False):
+        """Index a created or updated price, or drop a deleted or archived one."""
+        product = price.get("product")
+        if isinstance(product, dict):
+            product = product["id"]
+        summary = None if deleted else self._price_summary(price, product)
+        with self._lock:
+            if summary:
+                self._prices[summary["id"]] = summary
+            else:
+                self._prices.pop(price["id"], None)
+            self._rebuild()
+
+    def apply_product(self, product: Dict, deleted: bool = False):
+        """Re-tier or retire a product's prices."""
+        summary = self._product_summary(product)
+        if deleted:
+            summary["active"] = False
+        with self._lock:
+            self._products[product["id"]] = summary
+            self._rebuild()
+
+    @staticmethod
+    def _product_summary(product: Dict) -> Dict:
+        return {"tier": (product.get("metadata") or {}).get("tier"), "active": product.get("active", True)}
+
+    @staticmethod
+    def _price_summary(price: Dict, product_id: Optional[str]) -> Optional[Dict]:
+        recurring = price.get("recurring")
+        if not price.get("active", True) or not recurring:
+            return None
+        return {
+            "id": price["id"],
+            "product": product_id,
+            "tier": (price.get("metadata") or {}).get("tier"),
+            "currency": price["currency"],
+            "interval": recurring["interval"],
+            "lookup_key": price.get("lookup_key"),
+            "created": price.get("created") or 0,
+        }
+
+    def _rebuild(self):
+        """Recompute the index from prices and products; callers hold the lock.
+
+        When several active prices share a key, the one carrying the
+        canonical lookup key wins, then the newest.
+        """
+        best: Dict[PriceKey, Tuple[Tuple, str]] = {}
+        for price in self._prices.values():
+            product = self._products.get(price["product"], {})
+            tier = price["tier"] or product.get("tier")
+            if not tier or not product.get("active", True):
+                continue
+            key = (tier, price["currency"], price["interval"])
+            rank = (price["lookup_key"] == lookup_key(*key), price["created"])
+            if key not in best or rank > best[key][0]:
+                best[key] = (rank, price["id"])
+        self._index = {key: price_id for key, (_, price_id) in best.items()}
+
+    def missing(self) -> List[PriceKey]:
+        """Expected keys with no active price."""
+        return [key for key in self.expected if key not in self._index]
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self.loaded,
+            "age_seconds": round(time.time() - self.loaded_at, 1) if self.loaded else None,
+            "prices": len(self._index),
+            "missing": ["/".join(key) for key in self.missing()],
+        }
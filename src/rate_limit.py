@@ -0,0 +1,221 @@
+"""Client-side rate limiting and concurrency control for Stripe API calls."""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from errors import RateLimitExceeded
+
+# Lower value = served first when calls are queued
+PRIORITY_CRITICAL = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+
+CRITICAL_OPERATIONS = {"PaymentIntent.create"}
+READ_ACTIONS = {"retrieve", "list", "search"}
+
+# Poll interval while waiting for an in-flight slot or a higher-priority caller
+SLOT_POLL_INTERVAL = 0.002
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Take one token. Returns 0 on success, else seconds until one is available.
+
+        Not thread-safe; callers hold the governor lock.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Called for every Stripe call and slot; the set of operations is small and fixed
+@lru_cache(maxsize=None)
+def classify(operation: str) -> Tuple[str, int]:
+    """Map an operation like "Subscription.list" to (bucket name, priority)."""
+    if operation in CRITICAL_OPERATIONS:
+        return "write", PRIORITY_CRITICAL
+    if operation.rsplit(".", 1)[-1] in READ_ACTIONS:
+        return "read", PRIORITY_READ
+    return "write", PRIORITY_WRITE
+
+
+class _Waiter:
+    """One caller's progress through the governor: a bucket token, then an in-flight slot."""
+
+    __slots__ = ("bucket", "priority", "has_token", "queued")
+
+    def __init__(self, bucket: str, priority: int):
+        self.bucket = bucket
+        self.priority = priority
+        self.has_token = False
+        self.queued = False
+
+
+class StripeGovernor:
+    """Read/write token buckets plus a max-in-flight limit shared by all Stripe calls.
+
+    Callers that cannot start immediately wait up to `max_wait` seconds,
+    with higher-priority operations (payment intent creation, then other
+    writes) served first: a caller yields to higher-priority waiters for
+    the same bucket's tokens and, once it holds a token, to higher-priority
+    waiters for an in-flight slot. Writes starved by a drained write
+    bucket therefore never hold up reads. If a slot cannot be granted in
+    time the call fails fast with RateLimitExceeded instead of reaching
+    Stripe.
+    """
+
+    def __init__(
+        self,
+        read_rate: float = None,
+        write_rate: float = None,
+        max_in_flight: int = None,
+        max_wait: float = None,
+    ):
+        self.buckets = {
+            "read": TokenBucket(read_rate or float(os.getenv('STRIPE_READ_RATE', 80))),
+            "write": TokenBucket(write_rate or float(os.getenv('STRIPE_WRITE_RATE', 80))),
+        }
+        self.max_in_flight = max_in_flight or int(os.getenv('STRIPE_MAX_IN_FLIGHT', 50))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv('STRIPE_MAX_QUEUE_WAIT', 2.0))
+        self._lock = threading.Lock()
+        self._waiting = [0, 0, 0]
+        # Queued callers by priority: still waiting for a token (per bucket), or holding one
+        self._token_waiters = {name: [0, 0, 0] for name in self.buckets}
+        self._slot_waiters = [0, 0, 0]
+        self.in_flight = 0
+        self.acquired = 0
+        self.queued = 0
+        self.rejected = [0, 0, 0]
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _try_acquire(self, waiter: _Waiter) -> float:
+        """Claim a token, then a slot. Returns 0 on success, else a suggested delay."""
+        priority = waiter.priority
+        with self._lock:
+            if not waiter.has_token:
+                if any(self._token_waiters[waiter.bucket][:priority]):
+                    return SLOT_POLL_INTERVAL
+                delay = self.buckets[waiter.bucket].take(time.monotonic())
+                if delay:
+                    return delay
+                waiter.has_token = True
+                if waiter.queued:
+                    self._token_waiters[waiter.bucket][priority] -= 1
+                    self._slot_waiters[priority] += 1
+            if any(self._slot_waiters[:priority]) or self.in_flight >= self.max_in_flight:
+                return SLOT_POLL_INTERVAL
+            self.in_flight += 1
+            self.acquired += 1
+            return 0.0
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _waiters(self, waiter: _Waiter) -> List[int]:
+        return self._slot_waiters if waiter.has_token else self._token_waiters[waiter.bucket]
+
+    def _start_wait(self, waiter: _Waiter):
+        with self._lock:
+            waiter.queued = True
+            self._waiters(waiter)[waiter.priority] += 1
+            self._waiting[waiter.priority] += 1
+            self.queued += 1
+
+    def _end_wait(self, waiter: _Waiter, waited: float, rejected: bool):
+        with self._lock:
+            self._waiters(waiter)[waiter.priority] -= 1
+            self._waiting[waiter.priority] -= 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            if rejected:
+                self.rejected[waiter.priority] += 1
+
+    def _check_deadline(self, operation: str, delay: float, deadline: float):
+        if time.monotonic() + delay > deadline:
+            raise RateLimitExceeded(
+                f"Stripe call {operation} rejected by client-side rate limiter",
+                retry_after=max(delay, SLOT_POLL_INTERVAL),
+            )
+
+    @contextmanager
+    def slot(self, operation: str):
+        """Hold a rate-limited, concurrency-limited slot for a blocking Stripe call."""
+        waiter = _Waiter(*classify(operation))
+        delay = self._try_acquire(waiter)
+        if delay:
+            start = time.monotonic()
+            deadline = start + self.max_wait
+            rejected = True
+            self._start_wait(waiter)
+            try:
+                while delay:
+                    self._check_deadline(operation, delay, deadline)
+                    time.sleep(delay)
+                    delay = self._try_acquire(waiter)
+                rejected = False
+            finally:
+                self._end_wait(waiter, time.monotonic() - start, rejected)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self, operation: str):
+        """Async variant of slot() that waits without blocking the event loop."""
+        waiter = _Waiter(*classify(operation))
+        delay = self._try_acquire(waiter)
+        if delay:
+            start = time.monotonic()
+            deadline = start + self.max_wait
+            rejected = True
+            self._start_wait(waiter)
+            try:
+                while delay:
+                    self._check_deadline(operation, delay, deadline)
+                    await asyncio.sleep(delay)
+                    delay = self._try_acquire(waiter)
+                rejected = False
+            finally:
+                self._end_wait(waiter, time.monotonic() - start, rejected)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def stats(self) -> Dict:
+        """Bucket levels, in-flight calls and queueing counters."""
+        with self._lock:
+            now = time.monotonic()
+            levels = {}
+            for name, bucket in self.buckets.items():
+                refilled = bucket.tokens + (now - bucket._updated) * bucket.rate
+                levels[name] = round(min(bucket.capacity, refilled), 2)
+            return {
+                "bucket_levels": levels,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "waiting": {"critical": self._waiting[0], "write": self._waiting[1], "read": self._waiting[2]},
+                "acquired": self.acquired,
+                "queued": self.queued,
+                "rejected": {"critical": self.rejected[0], "write": self.rejected[1], "read": self.rejected[2]},
+                "wait_seconds_total": round(self.wait_seconds_total, 3),
+                "wait_seconds_max": round(self.wait_seconds_max, 3),
+            }
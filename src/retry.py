@@ -0,0 +1,191 @@
+"""Retry engine for Stripe calls: jittered backoff, retry budgets and deadlines."""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from lazy_modules import stripe
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = {409, 429, 500, 502, 503, 504}
+
+# Absolute time.monotonic() deadline of the current logical Stripe call
+_deadline: contextvars.ContextVar = contextvars.ContextVar("stripe_call_deadline", default=None)
+
+
+def time_remaining() -> Optional[float]:
+    """Seconds left before the current call's deadline, or None outside a call."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether a Stripe error is transient and safe to retry with the same idempotency key."""
+    if not isinstance(error, stripe.error.StripeError):
+        return False
+    if isinstance(error, stripe.error.APIConnectionError):
+        return bool(getattr(error, "should_retry", False))
+    headers = error.headers or {}
+    hint = headers.get("stripe-should-retry") or headers.get("Stripe-Should-Retry")
+    if hint in ("true", "false"):
+        return hint == "true"
+    return error.http_status in RETRYABLE_STATUS
+
+
+class RetryBudget:
+    """Allows retries up to `ratio` of recent calls plus a small per-second floor.
+
+    Keeps retries from multiplying load on Stripe during an outage: once
+    the budget is spent, failures are returned instead of retried.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, capacity: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._balance = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._balance = min(self.capacity, self._balance + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """Record an original (non-retry) call."""
+        with self._lock:
+            self._refill()
+            self._balance = min(self.capacity, self._balance + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Spend one retry if the budget allows it."""
+        with self._lock:
+            self._refill()
+            if self._balance >= 1:
+                self._balance -= 1
+                return True
+            return False
+
+
+class RetryPolicy:
+    """Backoff and deadline settings, overridable through STRIPE_RETRY_* env vars."""
+
+    def __init__(
+        self,
+        max_attempts: int = None,
+        base_delay: float = None,
+        max_delay: float = None,
+        deadline: float = None,
+        budget_ratio: float = None,
+    ):
+        self.max_attempts = max_attempts or int(os.getenv('STRIPE_RETRY_MAX_ATTEMPTS', 3))
+        self.base_delay = base_delay or float(os.getenv('STRIPE_RETRY_BASE_DELAY', 0.25))
+        self.max_delay = max_delay or float(os.getenv('STRIPE_RETRY_MAX_DELAY', 4.0))
+        self.deadline = deadline or float(os.getenv('STRIPE_CALL_DEADLINE', 20.0))
+        self.budget_ratio = budget_ratio or float(os.getenv('STRIPE_RETRY_BUDGET_RATIO', 0.2))
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter exponential backoff before retry number `retry` (0-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry)))
+
+
+class Retrier:
+    """Runs one logical Stripe call with retries, per-operation budgets and a deadline.
+
+    The deadline is published through a context variable so the HTTP
+    clients can cap each attempt's timeout to the time that is left.
+    Nested calls inherit the tighter of their own and the outer deadline.
+    """
+
+    def __init__(self, policy: RetryPolicy = None):
+        self.policy = policy or RetryPolicy()
+        self._budgets: Dict[str, RetryBudget] = {}
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: defaultdict(int))
+
+    def _budget(self, operation: str) -> RetryBudget:
+        with self._lock:
+            budget = self._budgets.get(operation)
+            if budget is None:
+                budget = self._budgets[operation] = RetryBudget(self.policy.budget_ratio)
+            return budget
+
+    def _count(self, operation: str, key: str):
+        with self._lock:
+            self._counts[operation][key] += 1
+
+    def _enter(self):
+        deadline = time.monotonic() + self.policy.deadline
+        outer = _deadline.get()
+        if outer is not None:
+            deadline = min(deadline, outer)
+        return _deadline.set(deadline)
+
+    def _next_delay(self, operation: str, error: Exception, retry: int) -> Optional[float]:
+        """Delay before the next attempt, or None if the error should be raised."""
+        if not is_retryable(error):
+            return None
+        if retry + 1 >= self.policy.max_attempts:
+            self._count(operation, "attempts_exhausted")
+            return None
+        delay = self.policy.backoff(retry)
+        remaining = time_remaining()
+        if remaining is not None and delay >= remaining:
+            self._count(operation, "deadline_exceeded")
+            return None
+        if not self._budget(operation).withdraw():
+            self._count(operation, "budget_exhausted")
+            return None
+        self._count(operation, "retries")
+        return delay
+
+    def call(self, operation: str, attempt: Callable[[], T]) -> T:
+        """Run attempt() until it succeeds or a non-retryable condition is hit."""
+        self._budget(operation).deposit()
+        self._count(operation, "calls")
+        token = self._enter()
+        try:
+            retry = 0
+            while True:
+                try:
+                    return attempt()
+                except stripe.error.StripeError as e:
+                    delay = self._next_delay(operation, e, retry)
+                    if delay is None:
+                        raise
+                time.sleep(delay)
+                retry += 1
+        finally:
+            _deadline.reset(token)
+
+    async def acall(self, operation: str, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Async variant of call()."""
+        self._budget(operation).deposit()
+        self._count(operation, "calls")
+        token = self._enter()
+        try:
+            retry = 0
+            while True:
+                try:
+                    return await attempt()
+                except stripe.error.StripeError as e:
+                    delay = self._next_delay(operation, e, retry)
+                    if delay is None:
+                        raise
+                await asyncio.sleep(delay)
+                retry += 1
+        finally:
+            _deadline.reset(token)
+
+    def stats(self) -> Dict:
+        """Per-operation call, retry and give-up counts."""
+        with self._lock:
+            return {operation: dict(counts) for operation, counts in self._counts.items()}
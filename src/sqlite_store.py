@@ -0,0 +1,40 @@
+"""Thread-local SQLite access shared by the local persistence layers."""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class SQLiteStore:
+    """One SQLite database file with a connection per thread (WAL, autocommit)."""
+
+    def __init__(self, path: str, schema: str = None):
+        self.path = path
+        self._local = threading.local()
+        if schema:
+            self.conn().executescript(schema)
+
+    def conn(self) -> sqlite3.Connection:
+        """Connection for the calling thread; sqlite3 connections are not shareable."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self.conn().execute(sql, params)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the block's statements on this thread's connection as one write transaction."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
@@ -0,0 +1,50 @@
+"""Pooled keep-alive HTTP client for the Stripe SDK.
+
+Subclasses stripe.HTTPClient, so importing this module imports the SDK;
+PaymentProcessor installs it only once stripe is loaded.
+"""
+import io
+
+import httpx
+import stripe
+
+from http_client import PoolConfig, PoolStats
+
+
+class PooledHTTPClient(stripe.HTTPClient):
+    """Stripe SDK HTTP client backed by a single keep-alive httpx pool."""
+
+    name = "httpx"
+
+    def __init__(self, config: PoolConfig = None):
+        super().__init__()
+        self.config = config or PoolConfig.from_env()
+        self.stats = PoolStats(self.config.max_connections)
+        self._client = httpx.Client(**self.config.client_kwargs())
+
+    def request(self, method, url, headers, post_data=None):
+        timeout = self.config.timeout_for_deadline()
+        with self.stats.track():
+            try:
+                response = self._client.request(
+                    method,
+                    url,
+                    headers=headers,
+                    content=post_data,
+                    timeout=timeout,
+                    extensions={"trace": self.stats.trace},
+                )
+            except (httpx.TimeoutException, httpx.NetworkError) as e:
+                raise stripe.error.APIConnectionError(
+                    f"Error communicating with Stripe: {e}", should_retry=True
+                )
+            except httpx.HTTPError as e:
+                raise stripe.error.APIConnectionError(f"Error communicating with Stripe: {e}")
+        return response.content, response.status_code, response.headers
+
+    def request_stream(self, method, url, headers, post_data=None):
+        content, status_code, headers = self.request(method, url, headers, post_data)
+        return io.BytesIO(content), status_code, headers
+
+    def close(self):
+        self._client.close()
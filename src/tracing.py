@@ -0,0 +1,294 @@
+"""Lightweight tracing with OpenTelemetry-shaped spans and W3C trace context.
+
+Spans carry 128-bit trace ids and 64-bit span ids, kinds, attributes,
+status, events and links, and propagate through `traceparent` headers and
+Stripe object metadata. Finished spans go to an in-process exporter:
+
+  * ring  - keep the most recent TRACING_BUFFER_SIZE spans in memory (default)
+  * file  - append one JSON span per line to TRACING_FILE
+  * none  - disable tracing
+"""
+import atexit
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SERVER = "SERVER"
+CLIENT = "CLIENT"
+CONSUMER = "CONSUMER"
+INTERNAL = "INTERNAL"
+
+# Stripe metadata key carrying the traceparent of the request that created an object
+METADATA_KEY = "traceparent"
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, span_id, sampled) from a W3C traceparent, or None if malformed."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "attributes",
+                 "events", "links", "status", "status_message", "start_ns", "end_ns")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_span_id: Optional[str], attributes: Dict):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.events: List[Dict] = []
+        self.links: List[Dict] = []
+        self.status = "UNSET"
+        self.status_message = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes):
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes})
+
+    def add_link(self, traceparent: Optional[str], **attributes):
+        parsed = parse_traceparent(traceparent)
+        if parsed:
+            self.links.append({"trace_id": parsed[0], "span_id": parsed[1], "attributes": attributes})
+
+    def record_exception(self, exc: BaseException):
+        self.status = "ERROR"
+        self.status_message = str(exc)
+        self.add_event("exception", **{"exception.type": type(exc).__name__, "exception.message": str(exc)})
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": {"code": self.status, "message": self.status_message},
+            "events": self.events,
+            "links": self.links,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off or the trace is not sampled."""
+
+    trace_id = span_id = parent_span_id = traceparent = None
+
+    def __init__(self, remote: Optional[str] = None):
+        # Keep an unsampled remote parent so downstream propagation still carries it
+        self.traceparent = remote
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def add_link(self, traceparent, **attributes):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+_current: ContextVar = ContextVar("current_span", default=None)
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory."""
+
+    def __init__(self, size: int = 10000):
+        self.spans = deque(maxlen=size)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def find(self, trace_id: str = None, min_duration_ms: float = 0, limit: int = 100) -> List[Dict]:
+        """Most recent spans first, optionally filtered by trace or duration."""
+        results = []
+        for span in reversed(list(self.spans)):
+            if trace_id and span.trace_id != trace_id:
+                continue
+            if (span.end_ns - span.start_ns) / 1e6 < min_duration_ms:
+                continue
+            results.append(span.to_dict())
+            if len(results) >= limit:
+                break
+        return results
+
+    def flush(self):
+        pass
+
+
+class FileExporter(RingBufferExporter):
+    """Appends spans as JSON lines, also keeping a ring buffer for lookups."""
+
+    def __init__(self, path: str, size: int = 10000):
+        super().__init__(size)
+        self.path = path
+        self._file = open(path, "a", buffering=1 << 16)
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def export(self, span: Span):
+        super().export(span)
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+
+class Tracer:
+    """Creates spans, tracks the current one per task/thread and hands finished spans to the exporter."""
+
+    def __init__(self, exporter=None, sample_rate: float = 1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        kind = os.getenv('TRACING_EXPORTER', 'ring').lower()
+        size = int(os.getenv('TRACING_BUFFER_SIZE', 10000))
+        if kind == "none":
+            exporter = None
+        elif kind == "file":
+            exporter = FileExporter(os.getenv('TRACING_FILE', 'traces.jsonl'), size)
+        else:
+            exporter = RingBufferExporter(size)
+        return cls(exporter, float(os.getenv('TRACING_SAMPLE_RATE', 1.0)))
+
+    @contextmanager
+    def span(self, name: str, kind: str = INTERNAL, traceparent: str = None, **attributes) -> Iterator[Span]:
+        """Start a child of the current span, or of `traceparent` / a new trace if there is none."""
+        if self.exporter is None:
+            yield _NoopSpan()
+            return
+        parent = _current.get()
+        trace_id = parent_id = None
+        if isinstance(parent, Span):
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, True
+        elif parent is not None:
+            sampled = False
+        else:
+            remote = parse_traceparent(traceparent)
+            if remote is not None:
+                trace_id, parent_id, sampled = remote
+                parent = _NoopSpan(traceparent)
+            else:
+                sampled = random.random() < self.sample_rate
+                trace_id = f"{random.getrandbits(128):032x}"
+                parent = _NoopSpan()
+
+        if not sampled:
+            # Unsampled traces still mark the context so child spans stay unsampled
+            token = _current.set(parent)
+            try:
+                yield parent
+            finally:
+                _current.reset(token)
+            return
+
+        span = Span(name, kind, trace_id, parent_id, attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current.reset(token)
+            self.exporter.export(span)
+
+
+tracer = Tracer.from_env()
+
+
+def span(name: str, kind: str = INTERNAL, traceparent: str = None, **attributes):
+    """Start a span on the process-wide tracer."""
+    return tracer.span(name, kind, traceparent, **attributes)
+
+
+def current_traceparent() -> Optional[str]:
+    """traceparent of the active span, for propagation to Stripe metadata or outgoing requests."""
+    current = _current.get()
+    return current.traceparent if current is not None else None
+
+
+def with_traceparent(metadata: Optional[Dict]) -> Dict:
+    """Copy of Stripe metadata tagged with the active traceparent, if any."""
+    metadata = dict(metadata or {})
+    traceparent = current_traceparent()
+    if traceparent:
+        metadata[METADATA_KEY] = traceparent
+    return metadata
+
+
+class TracingMiddleware:
+    """ASGI middleware opening a SERVER span per request and returning its traceparent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        incoming = None
+        for key, value in scope.get("headers", ()):
+            if key == b"traceparent":
+                incoming = value.decode("latin-1")
+                break
+
+        with span(f"HTTP {scope['method']}", SERVER, incoming, **{"http.method": scope["method"]}) as server_span:
+            async def send_with_trace(message):
+                if message["type"] == "http.response.start":
+                    server_span.set_attribute("http.status_code", message["status"])
+                    if server_span.traceparent:
+                        message["headers"] = list(message.get("headers", [])) + [
+                            (b"traceparent", server_span.traceparent.encode())
+                        ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route and isinstance(server_span, Span):
+                    server_span.name = f"{scope['method']} {route}"
+                    server_span.set_attribute("http.route", route)
@@ -0,0 +1,249 @@
+"""Event-ID deduplication for at-least-once Stripe webhook delivery."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from sqlite_store import SQLiteStore
+
+# lease_until is set while a claim's handlers run and cleared once they succeed
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed_events (
+    event_id TEXT PRIMARY KEY,
+    processed_at REAL NOT NULL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_events_at ON processed_events (processed_at);
+-- Handlers that already succeeded for an event whose other handlers failed
+CREATE TABLE IF NOT EXISTS handler_results (
+    event_id TEXT NOT NULL,
+    handler TEXT NOT NULL,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (event_id, handler)
+);
+"""
+
+# Takes a row with no lease conflict: absent, or an in-progress claim whose lease lapsed
+CLAIM_SQL = """
+INSERT INTO processed_events (event_id, processed_at, lease_until) VALUES (?, ?, ?)
+ON CONFLICT (event_id) DO UPDATE SET processed_at = excluded.processed_at, lease_until = excluded.lease_until
+WHERE processed_events.lease_until IS NOT NULL AND processed_events.lease_until < excluded.processed_at
+"""
+
+
+class EventInProgress(Exception):
+    """Another worker holds a live claim on the event; retry once its lease could have lapsed."""
+
+    def __init__(self, event_id: str):
+        super().__init__(f"Event {event_id} is being processed by another worker")
+        self.event_id = event_id
+
+
+class EventDeduplicator:
+    """Bounded in-memory LRU in front of a persistent event-ID index.
+
+    claim() takes an expiring lease on an event ID so concurrent workers
+    cannot both process the same delivery; complete() marks it processed
+    once the handlers succeeded, and release() drops the lease when they
+    failed. If the process dies mid-handler the lease lapses after
+    `lease_seconds` and a redelivery is processed again. When only some of
+    an event's handlers fail, record_handlers() keeps the ones that
+    succeeded so the retry runs just the rest. Index rows older than the
+    retention window are pruned as new events arrive.
+    """
+
+    PRUNE_EVERY = 1000
+    # IDs per SELECT ... IN (...) in known(); well under SQLite's parameter limit
+    LOOKUP_CHUNK = 500
+
+    def __init__(
+        self,
+        path: str = None,
+        cache_size: int = None,
+        retention_days: float = None,
+        lease_seconds: float = None,
+    ):
+        self.path = path or os.getenv('WEBHOOK_DEDUP_PATH', 'webhook_dedup.db')
+        self.cache_size = cache_size or int(os.getenv('WEBHOOK_DEDUP_CACHE_SIZE', 100000))
+        days = retention_days or float(os.getenv('WEBHOOK_DEDUP_RETENTION_DAYS', 30))
+        self.retention_seconds = days * 86400
+        self.lease_seconds = lease_seconds or float(os.getenv('WEBHOOK_DEDUP_LEASE_SECONDS', 300))
+        self.db = SQLiteStore(self.path, SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(processed_events)")}
+        if "lease_until" not in columns:
+            # Existing rows are completed claims
+            self.db.execute("ALTER TABLE processed_events ADD COLUMN lease_until REAL")
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.memory_hits = 0
+        self.store_hits = 0
+        self._claims_since_prune = 0
+
+    def _remember(self, event_id: str):
+        self._recent[event_id] = None
+        self._recent.move_to_end(event_id)
+        if len(self._recent) > self.cache_size:
+            self._recent.popitem(last=False)
+
+    def _is_done(self, event_id: str) -> bool:
+        with self._lock:
+            self.checked += 1
+            if event_id in self._recent:
+                self._recent.move_to_end(event_id)
+                self.memory_hits += 1
+                return True
+        return False
+
+    def claim(self, event_id: str) -> bool:
+        """Lease event_id for processing. Returns False if it was already processed.
+
+        Raises EventInProgress while another claim's lease is live.
+        """
+        if self._is_done(event_id):
+            return False
+        now = time.time()
+        with self.db.transaction() as conn:
+            if conn.execute(CLAIM_SQL, (event_id, now, now + self.lease_seconds)).rowcount == 1:
+                return True
+            row = conn.execute(
+                "SELECT lease_until FROM processed_events WHERE event_id = ?", (event_id,)
+            ).fetchone()
+        if row[0] is not None:
+            raise EventInProgress(event_id)
+        with self._lock:
+            self._remember(event_id)
+            self.store_hits += 1
+        return False
+
+    def claim_many(self, event_ids: List[str]) -> List[Optional[bool]]:
+        """claim() for a batch in one transaction.
+
+        Per ID: True if leased, False if already processed, None if another
+        claim's lease is live.
+        """
+        claimed: List[Optional[bool]] = [False] * len(event_ids)
+        candidates = [i for i, event_id in enumerate(event_ids) if not self._is_done(event_id)]
+
+        now = time.time()
+        processed = []
+        with self.db.transaction() as conn:
+            for i in candidates:
+                if conn.execute(CLAIM_SQL, (event_ids[i], now, now + self.lease_seconds)).rowcount == 1:
+                    claimed[i] = True
+                    continue
+                row = conn.execute(
+                    "SELECT lease_until FROM processed_events WHERE event_id = ?", (event_ids[i],)
+                ).fetchone()
+                if row[0] is not None:
+                    claimed[i] = None
+                else:
+                    processed.append(event_ids[i])
+
+        with self._lock:
+            for event_id in processed:
+                self._remember(event_id)
+            self.store_hits += len(processed)
+        return claimed
+
+    def complete(self, event_id: str):
+        """Mark a claimed event processed, so redeliveries are skipped."""
+        self.complete_many([event_id])
+
+    def complete_many(self, event_ids: List[str]):
+        """complete() for a batch."""
+        if not event_ids:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE processed_events SET lease_until = NULL WHERE event_id = ?",
+                [(event_id,) for event_id in event_ids],
+            )
+            conn.executemany(
+                "DELETE FROM handler_results WHERE event_id = ?", [(event_id,) for event_id in event_ids]
+            )
+        with self._lock:
+            for event_id in event_ids:
+                self._remember(event_id)
+            self._claims_since_prune += len(event_ids)
+            prune = self._claims_since_prune >= self.PRUNE_EVERY
+            if prune:
+                self._claims_since_prune = 0
+        if prune:
+            self.prune()
+
+    def known(self, event_ids: List[str]) -> Set[str]:
+        """The subset of event_ids already processed (not merely claimed), without claiming any."""
+        with self._lock:
+            found = {event_id for event_id in event_ids if event_id in self._recent}
+        rest = [event_id for event_id in event_ids if event_id not in found]
+        for i in range(0, len(rest), self.LOOKUP_CHUNK):
+            chunk = rest[i:i + self.LOOKUP_CHUNK]
+            rows = self.db.execute(
+                f"SELECT event_id FROM processed_events WHERE lease_until IS NULL "
+                f"AND event_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def handlers_done(self, event_ids: List[str]) -> Dict[str, Set[str]]:
+        """Names of the handlers recorded as succeeded, per event ID that has any."""
+        done: Dict[str, Set[str]] = {}
+        for i in range(0, len(event_ids), self.LOOKUP_CHUNK):
+            chunk = event_ids[i:i + self.LOOKUP_CHUNK]
+            rows = self.db.execute(
+                f"SELECT event_id, handler FROM handler_results "
+                f"WHERE event_id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            for event_id, handler in rows:
+                done.setdefault(event_id, set()).add(handler)
+        return done
+
+    def record_handlers(self, results: List[tuple]):
+        """Record (event_id, handler name) pairs that succeeded, so a retry skips them."""
+        if not results:
+            return
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO handler_results (event_id, handler, completed_at) VALUES (?, ?, ?)",
+                [(event_id, handler, now) for event_id, handler in results],
+            )
+
+    def release(self, event_id: str):
+        """Drop a claim whose handlers failed so a redelivery of event_id is processed again."""
+        self.release_many([event_id])
+
+    def release_many(self, event_ids: List[str]):
+        """release() for a batch."""
+        if not event_ids:
+            return
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM processed_events WHERE event_id = ? AND lease_until IS NOT NULL",
+                [(event_id,) for event_id in event_ids],
+            )
+
+    def prune(self) -> int:
+        """Drop index entries older than the retention window."""
+        cutoff = time.time() - self.retention_seconds
+        self.db.execute("DELETE FROM handler_results WHERE completed_at < ?", (cutoff,))
+        return self.db.execute(
+            "DELETE FROM processed_events WHERE processed_at < ?", (cutoff,)
+        ).rowcount
+
+    def stats(self) -> Dict:
+        """Duplicate hit counts and rate since startup."""
+        with self._lock:
+            duplicates = self.memory_hits + self.store_hits
+            return {
+                "checked": self.checked,
+                "duplicates": duplicates,
+                "memory_hits": self.memory_hits,
+                "store_hits": self.store_hits,
+                "hit_rate": duplicates / self.checked if self.checked else 0.0,
+                "cached_ids": len(self._recent),
+            }
@@ -0,0 +1,355 @@
+"""Durable acknowledge-then-process queue for verified Stripe webhook events."""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+from retry import RetryPolicy
+from sqlite_store import SQLiteStore
+from webhook_signature import loads
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    event_id TEXT NOT NULL,
+    event_type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_retry_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_status ON webhook_events (status, id);
+CREATE INDEX IF NOT EXISTS idx_webhook_events_type ON webhook_events (status, event_type, id);
+"""
+
+# Run after the column migration, so queues created before next_retry_at existed can open
+RETRY_INDEX = "CREATE INDEX IF NOT EXISTS idx_webhook_events_retry ON webhook_events (status, next_retry_at)"
+
+# Columns returned for dead-letter inspection
+DEAD_LETTER_COLUMNS = "id, event_id, event_type, status, attempts, last_error, received_at, next_retry_at"
+
+
+class WebhookQueue:
+    """SQLite-backed webhook queue drained by a pool of worker threads.
+
+    Verified events are persisted by enqueue() so the endpoint can answer
+    Stripe immediately; workers then pass each event to `handler` (normally
+    PaymentProcessor.handle_webhook_event). Events left 'processing' by a
+    crash are re-queued on start().
+
+    Events whose type passes `is_batched` are micro-batched instead: a
+    worker claims up to `batch_size` pending events of that type, waits up
+    to `batch_wait_ms` for more to arrive if the batch is short, and passes
+    them to `batch_handler` (normally PaymentProcessor.handle_webhook_events),
+    which returns a result per event.
+
+    A failed event becomes the queue's dead letter: it keeps its error and
+    attempt count and is marked 'failed' with a next_retry_at from
+    jittered exponential backoff. A redrive thread moves due events back
+    to 'pending'; after `max_attempts` an event is parked as 'dead' until
+    replayed by hand with replay().
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict], Dict],
+        path: str = None,
+        workers: int = None,
+        poll_interval: float = 1.0,
+        batch_handler: Callable[[List[Dict]], List[Dict]] = None,
+        is_batched: Callable[[str], bool] = None,
+        batch_size: int = None,
+        batch_wait_ms: float = None,
+        retry_policy: RetryPolicy = None,
+        redrive_interval: float = None,
+    ):
+        self.handler = handler
+        self.path = path or os.getenv('WEBHOOK_QUEUE_PATH', 'webhook_queue.db')
+        self.workers = workers if workers is not None else int(os.getenv('WEBHOOK_WORKERS', 4))
+        self.poll_interval = poll_interval
+        self.batch_handler = batch_handler
+        self.is_batched = is_batched if batch_handler and is_batched else (lambda event_type: False)
+        self.batch_size = batch_size or int(os.getenv('WEBHOOK_BATCH_SIZE', 100))
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None
+                           else float(os.getenv('WEBHOOK_BATCH_WAIT_MS', 50))) / 1000
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_attempts=int(os.getenv('WEBHOOK_MAX_ATTEMPTS', 8)),
+            base_delay=float(os.getenv('WEBHOOK_RETRY_BASE_DELAY', 2)),
+            max_delay=float(os.getenv('WEBHOOK_RETRY_MAX_DELAY', 600)),
+        )
+        self.redrive_interval = redrive_interval or float(os.getenv('WEBHOOK_REDRIVE_INTERVAL', 1))
+        self.db = SQLiteStore(self.path, SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(webhook_events)")}
+        if "next_retry_at" not in columns:
+            self.db.execute("ALTER TABLE webhook_events ADD COLUMN next_retry_at REAL")
+            # Events that failed before retries were scheduled are due now
+            self.db.execute("UPDATE webhook_events SET next_retry_at = ? WHERE status = 'failed'", (time.time(),))
+        self.db.execute(RETRY_INDEX)
+        self._wakeup = threading.Condition()
+        # Notified on every enqueue, for workers topping up a short batch
+        self._arrival = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._redrive_thread: Optional[threading.Thread] = None
+        # (monotonic second, events completed in that second)
+        self._completed = deque(maxlen=3600)
+        self._completed_lock = threading.Lock()
+
+    def enqueue(self, event_id: str, event_type: str, payload: bytes) -> int:
+        """Persist a verified event; returns its queue position id."""
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        cursor = self.db.execute(
+            "INSERT INTO webhook_events (event_id, event_type, payload, received_at) VALUES (?, ?, ?, ?)",
+            (event_id, event_type, payload, time.time()),
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        if self.is_batched(event_type):
+            with self._arrival:
+                self._arrival.notify_all()
+        return cursor.lastrowid
+
+    def _claim(self) -> Optional[tuple]:
+        """Atomically move the oldest pending event to 'processing'."""
+        return self.db.execute(
+            """
+            UPDATE webhook_events SET status = 'processing', attempts = attempts + 1
+            WHERE id = (SELECT id FROM webhook_events WHERE status = 'pending' ORDER BY id LIMIT 1)
+            RETURNING id, event_id, event_type, payload, attempts
+            """
+        ).fetchone()
+
+    def _claim_type(self, event_type: str, limit: int) -> List[tuple]:
+        """Atomically move up to `limit` of the oldest pending events of one type to 'processing'."""
+        return self.db.execute(
+            """
+            UPDATE webhook_events SET status = 'processing', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM webhook_events WHERE status = 'pending' AND event_type = ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, event_id, event_type, payload, attempts
+            """,
+            (event_type, limit),
+        ).fetchall()
+
+    def _fill_batch(self, first: tuple) -> List[tuple]:
+        """Claim more events of `first`'s type until the batch is full or the wait is over."""
+        rows = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(rows) < self.batch_size:
+            rows.extend(self._claim_type(first[2], self.batch_size - len(rows)))
+            remaining = deadline - time.monotonic()
+            if len(rows) >= self.batch_size or remaining <= 0 or self._stopping.is_set():
+                break
+            with self._arrival:
+                self._arrival.wait(remaining)
+        return rows
+
+    def process_next(self) -> bool:
+        """Process the oldest pending event, or a batch of its type. Returns False when the queue is empty."""
+        row = self._claim()
+        if row is None:
+            return False
+
+        if self.batch_size > 1 and self.is_batched(row[2]):
+            self._process_batch(self._fill_batch(row))
+            return True
+
+        row_id, event_id, _, payload, attempts = row
+        try:
+            self.handler(loads(payload))
+        except Exception as e:
+            logger.error(f"Webhook event {event_id} failed (attempt {attempts}): {e}")
+            self._mark_failed(self.db.conn(), [(row_id, attempts, str(e))])
+        else:
+            self.db.execute("DELETE FROM webhook_events WHERE id = ?", (row_id,))
+        self._record_completion()
+        return True
+
+    def _process_batch(self, rows: List[tuple]):
+        try:
+            results = self.batch_handler([loads(row[3]) for row in rows])
+            if len(results) != len(rows):
+                raise ValueError(f"Batch handler returned {len(results)} results for {len(rows)} events")
+        except Exception as e:
+            logger.error(f"Webhook batch of {len(rows)} {rows[0][2]} events failed: {e}")
+            results = [{"success": False, "error": str(e)}] * len(rows)
+
+        failed = [(row[0], row[4], result.get("error") or "Handler reported failure")
+                  for row, result in zip(rows, results) if not result.get("success")]
+        if failed:
+            logger.error(f"{len(failed)} of {len(rows)} {rows[0][2]} events failed")
+        with self.db.transaction() as conn:
+            self._mark_failed(conn, failed)
+            conn.executemany(
+                "DELETE FROM webhook_events WHERE id = ?",
+                [(row[0],) for row, result in zip(rows, results) if result.get("success")],
+            )
+        self._record_completion(len(rows))
+
+    def _mark_failed(self, conn, failures: List[tuple]):
+        """Schedule a retry for each (row id, attempts, error), or park it as 'dead'."""
+        now = time.time()
+        updates = []
+        for row_id, attempts, error in failures:
+            if attempts >= self.retry_policy.max_attempts:
+                logger.error(f"Webhook queue row {row_id} is dead after {attempts} attempts")
+                updates.append(("dead", error, None, row_id))
+            else:
+                updates.append(("failed", error, now + self.retry_policy.backoff(attempts - 1), row_id))
+        conn.executemany(
+            "UPDATE webhook_events SET status = ?, last_error = ?, next_retry_at = ? WHERE id = ?", updates
+        )
+
+    def redrive_due(self) -> int:
+        """Move failed events whose retry time has come back to 'pending'."""
+        count = self.db.execute(
+            """
+            UPDATE webhook_events SET status = 'pending', next_retry_at = NULL
+            WHERE status = 'failed' AND next_retry_at <= ?
+            """,
+            (time.time(),),
+        ).rowcount
+        if count:
+            logger.info(f"Redriving {count} failed webhook events")
+            self._notify_workers()
+        return count
+
+    def dead_letters(self, status: str = None, event_type: str = None, limit: int = 100) -> List[Dict]:
+        """Failed and dead events, oldest first, optionally filtered."""
+        query = f"SELECT {DEAD_LETTER_COLUMNS} FROM webhook_events WHERE status IN ('failed', 'dead')"
+        params = []
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        if event_type:
+            query += " AND event_type = ?"
+            params.append(event_type)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        cursor = self.db.execute(query, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def dead_letter(self, row_id: int) -> Optional[Dict]:
+        """One failed or dead event including its payload."""
+        cursor = self.db.execute(
+            f"SELECT {DEAD_LETTER_COLUMNS}, payload FROM webhook_events "
+            "WHERE id = ? AND status IN ('failed', 'dead')",
+            (row_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip([column[0] for column in cursor.description], row))
+        entry["payload"] = loads(entry["payload"])
+        return entry
+
+    def replay(self, row_id: int = None, event_type: str = None, status: str = None) -> int:
+        """Re-queue failed/dead events now: one by id, or all matching the filters. Returns the count.
+
+        Replayed events get a fresh attempt budget.
+        """
+        query = ("UPDATE webhook_events SET status = 'pending', attempts = 0, next_retry_at = NULL "
+                 "WHERE status IN ('failed', 'dead')")
+        params = []
+        for column, value in (("id", row_id), ("event_type", event_type), ("status", status)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        count = self.db.execute(query, params).rowcount
+        if count:
+            self._notify_workers()
+        return count
+
+    def discard(self, row_id: int) -> bool:
+        """Delete a failed or dead event without processing it."""
+        return self.db.execute(
+            "DELETE FROM webhook_events WHERE id = ? AND status IN ('failed', 'dead')", (row_id,)
+        ).rowcount == 1
+
+    def _notify_workers(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def _record_completion(self, count: int = 1):
+        second = int(time.monotonic())
+        with self._completed_lock:
+            if self._completed and self._completed[-1][0] == second:
+                self._completed[-1][1] += count
+            else:
+                self._completed.append([second, count])
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if not self.process_next():
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+
+    def _redrive(self):
+        while not self._stopping.wait(self.redrive_interval):
+            try:
+                self.redrive_due()
+            except Exception as e:
+                logger.error(f"Webhook redrive failed: {e}")
+
+    def start(self):
+        """Re-queue interrupted events and start the worker threads."""
+        self.db.execute("UPDATE webhook_events SET status = 'pending' WHERE status = 'processing'")
+        self._stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._redrive_thread = threading.Thread(target=self._redrive, name="webhook-redrive", daemon=True)
+        self._redrive_thread.start()
+        logger.info(f"Webhook queue started with {self.workers} workers")
+
+    def stop(self, timeout: float = 10.0):
+        """Stop workers after their current event; pending events stay on disk."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        with self._arrival:
+            self._arrival.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        if self._redrive_thread:
+            self._redrive_thread.join(timeout)
+            self._redrive_thread = None
+
+    def stats(self, window: float = 60.0) -> Dict:
+        """Queue depth, age of the oldest event, recent drain rate and dead letters."""
+        counts = dict(self.db.execute(
+            "SELECT status, COUNT(*) FROM webhook_events GROUP BY status"
+        ).fetchall())
+        oldest = self.db.execute(
+            "SELECT MIN(received_at) FROM webhook_events WHERE status IN ('pending', 'processing')"
+        ).fetchone()[0]
+        next_retry = self.db.execute(
+            "SELECT MIN(next_retry_at) FROM webhook_events WHERE status = 'failed'"
+        ).fetchone()[0]
+
+        cutoff = time.monotonic() - window
+        with self._completed_lock:
+            recent = sum(count for second, count in self._completed if second >= cutoff)
+        return {
+            "depth": counts.get("pending", 0) + counts.get("processing", 0),
+            "pending": counts.get("pending", 0),
+            "processing": counts.get("processing", 0),
+            "failed": counts.get("failed", 0),
+            "dead": counts.get("dead", 0),
+            "next_retry_in_seconds": max(0.0, next_retry - time.time()) if next_retry else None,
+            "oldest_event_age_seconds": time.time() - oldest if oldest else 0.0,
+            "drain_rate_per_second": recent / window,
+            "workers": len(self._threads),
+        }
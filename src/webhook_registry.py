@@ -0,0 +1,296 @@
+"""Webhook handler registry: many handlers per event type, resolved once per type.
+
+Handlers subscribe to an exact event type or a wildcard pattern
+(`invoice.*`, `*`). Each may be a plain function or a coroutine function
+and can set a timeout and a concurrency limit; every call is timed into
+the webhook_handler_* metrics. When several handlers match an event they
+run in parallel on a shared thread pool (coroutines on an event loop), so
+independent consumers such as provisioning and analytics never wait on
+each other.
+"""
+import asyncio
+import contextvars
+import fnmatch
+import inspect
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import record_webhook_handler
+import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandlerError(Exception):
+    """One or more handlers failed for an event.
+
+    `errors` maps handler name to message; `succeeded` names the handlers
+    that did not fail, so a retry can skip them.
+    """
+
+    def __init__(self, event_type: str, errors: Dict[str, str], succeeded: List[str] = ()):
+        self.errors = errors
+        self.succeeded = list(succeeded)
+        details = "; ".join(f"{name}: {error}" for name, error in errors.items())
+        super().__init__(f"{event_type} handler failed: {details}")
+
+
+class WebhookHandler:
+    """One registered handler and its limits."""
+
+    def __init__(
+        self,
+        pattern: str,
+        fn: Callable,
+        name: str = None,
+        timeout: float = None,
+        max_concurrency: int = None,
+        batch: Callable = None,
+        event: bool = False,
+    ):
+        self.pattern = pattern
+        self.fn = fn
+        self.name = name or getattr(fn, "__name__", repr(fn))
+        self.timeout = timeout
+        # Takes a list of payloads and returns a result per payload
+        self.batch = batch
+        # Pass the whole event rather than its data.object
+        self.event = event
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def matches(self, event_type: str) -> bool:
+        return fnmatch.fnmatchcase(event_type, self.pattern)
+
+    def payload(self, event: Dict) -> Any:
+        return event if self.event else event['data']['object']
+
+
+def _failed(result: Any) -> Optional[str]:
+    """Error message if a handler result reports failure, else None."""
+    if isinstance(result, dict) and result.get("success") is False:
+        return result.get("error") or "Handler reported failure"
+    return None
+
+
+class WebhookRegistry:
+    """Routes events to their handlers; lookups are cached per event type."""
+
+    def __init__(self, threads: int = None):
+        self.threads = threads or int(os.getenv('WEBHOOK_HANDLER_THREADS', 32))
+        self._handlers: List[WebhookHandler] = []
+        self._by_type: Dict[str, Tuple[WebhookHandler, ...]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="webhook-handler")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def register(self, pattern: str, fn: Callable, **options) -> WebhookHandler:
+        """Subscribe `fn` to events matching `pattern`; see WebhookHandler for options.
+
+        The name identifies the handler when per-handler results are
+        recorded, so it must be unique per pattern.
+        """
+        handler = WebhookHandler(pattern, fn, **options)
+        with self._lock:
+            if any(h.pattern == pattern and h.name == handler.name for h in self._handlers):
+                raise ValueError(f"A handler named {handler.name} is already registered for {pattern}")
+            self._handlers.append(handler)
+            self._by_type = {}
+        return handler
+
+    def on(self, pattern: str, **options):
+        """Decorator form of register()."""
+        def decorator(fn):
+            self.register(pattern, fn, **options)
+            return fn
+        return decorator
+
+    def handlers_for(self, event_type: str) -> Tuple[WebhookHandler, ...]:
+        handlers = self._by_type.get(event_type)
+        if handlers is None:
+            with self._lock:
+                handlers = tuple(h for h in self._handlers if h.matches(event_type))
+                self._by_type = {**self._by_type, event_type: handlers}
+        return handlers
+
+    def is_batched(self, event_type: str) -> bool:
+        """Whether any handler for the type takes batches."""
+        return any(h.batch for h in self.handlers_for(event_type))
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Run coroutine handlers on `loop` (e.g. the API's, so they can share its clients)."""
+        self._loop = loop
+
+    def _event_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="webhook-async-handlers", daemon=True).start()
+            return self._loop
+
+    def _call(self, handler: WebhookHandler, fn: Callable, payload: Any) -> Any:
+        if handler._slots:
+            handler._slots.acquire()
+        try:
+            with tracing.span(handler.name):
+                if inspect.iscoroutinefunction(fn):
+                    coro = asyncio.wait_for(fn(payload), handler.timeout)
+                    return asyncio.run_coroutine_threadsafe(coro, self._event_loop()).result()
+                return fn(payload)
+        finally:
+            if handler._slots:
+                handler._slots.release()
+
+    def _call_batch(self, handler: WebhookHandler, payloads: List[Any]) -> List[Any]:
+        if handler.batch:
+            results = self._call(handler, handler.batch, payloads)
+            if len(results) != len(payloads):
+                raise ValueError(f"{handler.name} returned {len(results)} results for {len(payloads)} events")
+            return results
+        results = []
+        for payload in payloads:
+            try:
+                results.append(self._call(handler, handler.fn, payload))
+            except Exception as e:
+                results.append({"success": False, "error": str(e)})
+        return results
+
+    def _run_all(
+        self,
+        handlers: Tuple[WebhookHandler, ...],
+        target: Callable,
+        events: List[Dict],
+        late: Callable = None,
+    ) -> List[tuple]:
+        """Run target(handler) for each handler; returns (result, error) pairs in handler order.
+
+        A single handler without a timeout runs on the calling thread;
+        otherwise each goes to the pool with the caller's trace context.
+        """
+        event_type = events[0]['type']
+        if len(handlers) == 1 and handlers[0].timeout is None:
+            return [self._timed(handlers[0], event_type, lambda: target(handlers[0]))]
+
+        futures = []
+        for handler in handlers:
+            context = contextvars.copy_context()
+            futures.append(self._pool.submit(context.run, target, handler))
+        outcomes = []
+        for handler, future in zip(handlers, futures):
+            on_late = (lambda: self._watch_late(handler, future, events, late)) if late is not None else None
+            outcomes.append(self._timed(handler, event_type, lambda: future.result(handler.timeout), future, on_late))
+        return outcomes
+
+    @staticmethod
+    def _watch_late(handler: WebhookHandler, future: Future, events: List[Dict], late: Callable):
+        """Hand late(handler, events, outcome) a future of the per-event success flags of a
+        timed-out handler that is still running (a thread cannot be stopped)."""
+        outcome: Future = Future()
+
+        def finished(done: Future):
+            try:
+                result = done.result()
+            except BaseException:
+                outcome.set_result([False] * len(events))
+                return
+            results = result if isinstance(result, list) else [result]
+            if len(results) != len(events):
+                outcome.set_result([False] * len(events))
+            else:
+                outcome.set_result([_failed(r) is None for r in results])
+
+        late(handler, events, outcome)
+        future.add_done_callback(finished)
+
+    @staticmethod
+    def _timed(
+        handler: WebhookHandler, event_type: str, wait: Callable, future: Future = None, on_late: Callable = None
+    ) -> tuple:
+        start = time.perf_counter()
+        try:
+            result = wait()
+        except (FutureTimeout, asyncio.TimeoutError):
+            outcome, result, error = "timeout", None, f"timed out after {handler.timeout}s"
+            # cancel() only stops a handler that has not started; one already running carries on
+            if future is not None and not future.cancel() and on_late is not None:
+                on_late()
+        except Exception as e:
+            outcome, result, error = type(e).__name__, None, str(e)
+        else:
+            error = None if isinstance(result, list) else _failed(result)
+            outcome = "failed" if error else "ok"
+        record_webhook_handler(handler.name, event_type, outcome, time.perf_counter() - start)
+        if error:
+            logger.error(f"Webhook handler {handler.name} failed for {event_type}: {error}")
+        return result, error
+
+    def dispatch(self, event: Dict, handlers: Tuple[WebhookHandler, ...] = None, late: Callable = None) -> Dict:
+        """Run every handler for the event; raises WebhookHandlerError if any failed.
+
+        Returns the handler's result when one handler matched, else
+        {"success": True, "results": {handler name: result}}. A handler
+        that timed out but is still running is passed to
+        late(handler, [event], outcome), where `outcome` is a future of its
+        eventual success flag per event.
+        """
+        event_type = event['type']
+        handlers = handlers if handlers is not None else self.handlers_for(event_type)
+        outcomes = self._run_all(handlers, lambda h: self._call(h, h.fn, h.payload(event)), [event], late)
+        errors = {h.name: error for h, (_, error) in zip(handlers, outcomes) if error}
+        if errors:
+            raise WebhookHandlerError(event_type, errors, [h.name for h in handlers if h.name not in errors])
+        if len(handlers) == 1:
+            return outcomes[0][0]
+        return {"success": True, "results": {h.name: result for h, (result, _) in zip(handlers, outcomes)}}
+
+    def dispatch_batch(
+        self, events: List[Dict], handlers: Tuple[WebhookHandler, ...] = None, late: Callable = None
+    ) -> List[Dict]:
+        """Run every handler over events of one type; returns a result per event.
+
+        Batch handlers get all payloads in one call, others are called per
+        payload. An event fails if any handler failed for it, with
+        {"success": False, "error": ..., "succeeded_handlers": [names]}.
+        Late handlers are reported as in dispatch().
+        """
+        event_type = events[0]['type']
+        handlers = handlers if handlers is not None else self.handlers_for(event_type)
+        outcomes = self._run_all(
+            handlers, lambda h: self._call_batch(h, [h.payload(event) for event in events]), events, late
+        )
+        results = []
+        for i in range(len(events)):
+            per_handler, errors = {}, {}
+            for handler, (batch_results, batch_error) in zip(handlers, outcomes):
+                result = batch_results[i] if batch_results is not None else None
+                error = batch_error or _failed(result)
+                if error:
+                    errors[handler.name] = error
+                per_handler[handler.name] = result
+            if errors:
+                results.append({
+                    "success": False,
+                    "error": str(WebhookHandlerError(event_type, errors)),
+                    "succeeded_handlers": [h.name for h in handlers if h.name not in errors],
+                })
+            elif len(handlers) == 1:
+                results.append(per_handler[handlers[0].name])
+            else:
+                results.append({"success": True, "results": per_handler})
+        return results
+
+    def stats(self) -> List[Dict]:
+        """Registered handlers and their limits."""
+        return [
+            {
+                "pattern": h.pattern,
+                "name": h.name,
+                "async": inspect.iscoroutinefunction(h.fn),
+                "batch": h.batch is not None,
+                "timeout": h.timeout,
+            }
+            for h in self._handlers
+        ]